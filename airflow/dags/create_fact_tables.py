@@ -2,13 +2,20 @@ from airflow import DAG
 from airflow.providers.snowflake.operators.snowflake import SnowflakeOperator
 from airflow.models import Variable
 from airflow.operators.bash import BashOperator
+from airflow.operators.python import PythonOperator
 from datetime import datetime
-
-selected_year = Variable.get("selected_year", default_var="2016")
-selected_quarter = Variable.get("selected_quarter", default_var="Q4")
+from export_snapshots import FACT_TABLES, create_snapshot_stage_sql, unload_snapshots_sql
+from quarters import load_concurrency, quarter_name, resolve_quarters
 
 aws_s3_bucket = Variable.get("AWS_S3_BUCKET", default_var="my-default-bucket")
 
+# "json" for the indented array files, "ndjson" for the line-delimited files (JSON_OUTPUT_FORMAT in the transformer)
+json_output_format = Variable.get("json_output_format", default_var="json")
+json_file_format = "raw_data.ndjson_file_format" if json_output_format == "ndjson" else "raw_data.json_file_format"
+
+# Backend whose preview cache is cleared after the load
+backend_url = Variable.get("backend_url", default_var="https://fastapi-service-992661127227.us-central1.run.app")
+
 default_args = {'owner': 'airflow', 'start_date': datetime(2024, 1, 1), 'retries': 1}
 dag = DAG('create_fact_tables_to_snowflake',default_args=default_args, schedule_interval=None)
 
@@ -31,55 +38,77 @@ create_table_task = SnowflakeOperator(
     snowflake_conn_id='snowflake_default',
     sql="""
     CREATE TABLE IF NOT EXISTS raw_data.raw_financial_json (
-        v VARIANT
+        v VARIANT,
+        loaded_at TIMESTAMP_LTZ
     );
+
+    -- Load time of each row, the watermark of the incremental fact table models
+    ALTER TABLE raw_data.raw_financial_json ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMP_LTZ;
+
+    -- One JSON document per line, used for the streamed .ndjson transformer output
+    CREATE FILE FORMAT IF NOT EXISTS raw_data.ndjson_file_format
+    TYPE = 'JSON'
+    STRIP_OUTER_ARRAY = FALSE;
     """,
     dag=dag
 )
 
 
-# loading data into the staging table
-load_json_task = SnowflakeOperator(
-    task_id='load_json',
-    snowflake_conn_id='snowflake_default',
-    sql=f"""
-    COPY INTO raw_data.raw_financial_json
-    FROM @sec_json_stage
-    FILES = ('{selected_year}{selected_quarter}.json')
-    FILE_FORMAT = raw_data.json_file_format;
-    """,
+# quarters to load: trigger conf "quarters", else the Variables (see quarters.py)
+resolve_quarters_task = PythonOperator(
+    task_id='resolve_quarters',
+    python_callable=resolve_quarters,
     dag=dag
 )
 
-# creating fact tables
+def load_json_sql(quarter):
+    return f"""
+    COPY INTO raw_data.raw_financial_json (v, loaded_at)
+    FROM (SELECT $1, CURRENT_TIMESTAMP() FROM @sec_json_stage)
+    FILES = ('{quarter_name(quarter)}.{json_output_format}')
+    FILE_FORMAT = (FORMAT_NAME = {json_file_format});
+    """
+
+# loading data into the staging table, one mapped task per quarter, several running at once
+load_json_task = SnowflakeOperator.partial(
+    task_id='load_json',
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+    **load_concurrency()
+).expand(sql=resolve_quarters_task.output.map(load_json_sql))
+
+# creating fact tables on the first run; afterwards dbt merges each newly loaded quarter into them
 create_tables_sql = """
-CREATE OR REPLACE TABLE balance_sheet (
+CREATE TABLE IF NOT EXISTS balance_sheet (
     company_name STRING,
     fiscal_year INT,
     fiscal_period STRING,
     total_assets NUMBER,
     total_liabilities NUMBER,
     total_equity NUMBER,
+    loaded_at TIMESTAMP_LTZ,
     CONSTRAINT pk_balance_sheet PRIMARY KEY (company_name, fiscal_year, fiscal_period)
 );
 
-CREATE OR REPLACE TABLE income_statement (
+CREATE TABLE IF NOT EXISTS income_statement (
     company_name STRING,
     fiscal_year INT,
     fiscal_period STRING,
     revenue NUMBER,
     operating_income NUMBER,
     net_income NUMBER,
+    loaded_at TIMESTAMP_LTZ,
     CONSTRAINT pk_income_statement PRIMARY KEY (company_name, fiscal_year, fiscal_period)
 );
 
-CREATE OR REPLACE TABLE cash_flow (
+CREATE TABLE IF NOT EXISTS cash_flow (
     company_name STRING,
     fiscal_year INT,
     fiscal_period STRING,
     operating_cash_flow NUMBER,
     investing_cash_flow NUMBER,
     financing_cash_flow NUMBER,
+    loaded_at TIMESTAMP_LTZ,
     CONSTRAINT pk_cash_flow PRIMARY KEY (company_name, fiscal_year, fiscal_period)
 );
 """
@@ -109,13 +138,33 @@ dbt_test_task = BashOperator(
 #     dag=dag,
 # )
 
-# Run DBT inside Airflow
+# Run DBT inside Airflow; trigger with {"full_refresh": true} to rebuild the incremental fact tables from scratch
 dbt_run_task = BashOperator(
     task_id="dbt_run",
-    bash_command="cd /opt/airflow/dbt && dbt run",
+    bash_command="cd /opt/airflow/dbt && dbt run {{ '--full-refresh' if (dag_run.conf or {}).get('full_refresh') else '' }}",
+    dag=dag
+)
+
+
+# Unload the loaded tables to S3 snapshots, which the backend download endpoints redirect to
+export_snapshots_task = SnowflakeOperator(
+    task_id='export_snapshots',
+    snowflake_conn_id='snowflake_default',
+    sql=create_snapshot_stage_sql(aws_s3_bucket) + unload_snapshots_sql([(table, table) for table in FACT_TABLES]),
     dag=dag
 )
 
+# Clear the backend's preview cache so the dashboard shows the new quarter right away
+invalidate_cache_task = BashOperator(
+    task_id="invalidate_backend_cache",
+    bash_command=(
+        'if [ -z "$CACHE_INVALIDATE_TOKEN" ]; then echo "cache_invalidate_token not set, skipping"; exit 0; fi; '
+        f'curl -fsS -X POST -H "X-Cache-Token: $CACHE_INVALIDATE_TOKEN" {backend_url}/cache/invalidate'
+    ),
+    env={"CACHE_INVALIDATE_TOKEN": "{{ var.value.get('cache_invalidate_token', '') }}"},
+    append_env=True,
+    dag=dag
+)
 
 # task dependencies
-create_stage_task >> create_table_task >> load_json_task >> create_fact_tables_task >> dbt_test_task >> dbt_run_task
+create_stage_task >> create_table_task >> load_json_task >> create_fact_tables_task >> dbt_test_task >> dbt_run_task >> export_snapshots_task >> invalidate_cache_task
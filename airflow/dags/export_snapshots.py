@@ -0,0 +1,100 @@
+"""
+Shared SQL for the export snapshots the backend download endpoints redirect to.
+
+Each table is unloaded with COPY INTO as gzipped CSV and Parquet files under
+s3://<bucket>/sec_exports/<table>/<format>/<run>/, a new prefix per task attempt, as many files as the
+unload produces. The manifest at sec_exports/<table>/<format>_manifest.json, which the backend reads
+and presigns the listed files from, is replaced only once the new files are complete, so it never
+points at missing files. The run it replaced is kept until the next export, as URLs presigned from it
+may still be in use; the one before is removed. EXPORT_S3_PREFIX in the backend must match
+SNAPSHOT_PREFIX here.
+"""
+
+SNAPSHOT_PREFIX = "sec_exports/"
+SNAPSHOT_STAGE = "sec_export_stage"
+SNAPSHOT_MANIFEST_FORMAT = "sec_snapshot_manifest_format"
+
+# Prefix of this task attempt's files (rendered by Airflow), so a retry never writes into a live snapshot
+SNAPSHOT_RUN = "{{ ts_nodash }}_{{ ti.try_number }}"
+
+# Fact tables built by dbt, and the raw tables loaded by txt_pipeline
+FACT_TABLES = ["balance_sheet", "income_statement", "cash_flow"]
+RAW_TABLES = {
+    "sec_numbers": "raw_data.sec_numbers",
+    "sec_submissions": "raw_data.sec_submissions",
+    "sec_tags": "raw_data.sec_tags",
+    "sec_presentation": "raw_data.sec_presentation",
+}
+
+# Unload file format of each snapshot format
+SNAPSHOT_FORMATS = {
+    "csv": "TYPE = CSV COMPRESSION = GZIP FIELD_OPTIONALLY_ENCLOSED_BY = '\"' NULL_IF = ('') EMPTY_FIELD_AS_NULL = FALSE",
+    "parquet": "TYPE = PARQUET COMPRESSION = SNAPPY",
+}
+
+# Upper bound of each unloaded file (Snowflake's maximum on S3); larger tables span several files
+MAX_SNAPSHOT_FILE_BYTES = 5 * 1024 * 1024 * 1024
+
+
+def snapshot_manifest_path(name, snapshot_format):
+    """Manifest location relative to the stage, outside the runs' prefixes."""
+    return f"{name}/{snapshot_format}_manifest.json"
+
+
+def create_snapshot_stage_sql(aws_s3_bucket):
+    return f"""
+    CREATE OR REPLACE STAGE {SNAPSHOT_STAGE}
+    URL = 's3://{aws_s3_bucket}/{SNAPSHOT_PREFIX}'
+    CREDENTIALS = (AWS_KEY_ID='{{{{ conn.aws_default.login }}}}'
+                   AWS_SECRET_KEY='{{{{ conn.aws_default.password }}}}');
+
+    -- Reads the current manifests to find the runs they replace
+    CREATE FILE FORMAT IF NOT EXISTS {SNAPSHOT_MANIFEST_FORMAT} TYPE = JSON;
+    """
+
+
+def unload_snapshots_sql(tables):
+    """
+    Statements unloading each (snapshot name, source table) pair as .csv.gz and .parquet files into this
+    run's prefix, then replacing its manifest: the LIST of the new files turned into JSON with RESULT_SCAN,
+    plus the run ids. Last, the run two snapshots back, named by the replaced manifest, is removed.
+    """
+    statements = []
+    for name, source in tables:
+        for snapshot_format, file_format in SNAPSHOT_FORMATS.items():
+            manifest = snapshot_manifest_path(name, snapshot_format)
+            run_prefix = f"{name}/{snapshot_format}/{SNAPSHOT_RUN}/"
+            statements.append(f"""
+    SET (previous_run, older_run) = (
+        SELECT COALESCE(MAX($1:run::STRING), ''), COALESCE(MAX($1:previous::STRING), '')
+        FROM @{SNAPSHOT_STAGE}/{manifest} (FILE_FORMAT => '{SNAPSHOT_MANIFEST_FORMAT}')
+    );
+
+    COPY INTO @{SNAPSHOT_STAGE}/{run_prefix}{name}_
+    FROM {source}
+    FILE_FORMAT = ({file_format})
+    HEADER = TRUE MAX_FILE_SIZE = {MAX_SNAPSHOT_FILE_BYTES};
+
+    LIST @{SNAPSHOT_STAGE}/{run_prefix};
+
+    COPY INTO @{SNAPSHOT_STAGE}/{manifest}
+    FROM (
+        SELECT OBJECT_CONSTRUCT(
+            'run', '{SNAPSHOT_RUN}',
+            'previous', $previous_run,
+            'files', ARRAY_AGG(OBJECT_CONSTRUCT(
+                'key', REGEXP_REPLACE("name", '^s3://[^/]+/', ''),
+                'size', "size"
+            )) WITHIN GROUP (ORDER BY "name")
+        )
+        FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()))
+    )
+    FILE_FORMAT = (TYPE = JSON COMPRESSION = NONE)
+    SINGLE = TRUE OVERWRITE = TRUE;
+
+    SET remove_older_run = (
+        SELECT IFF($older_run = '', 'SELECT 1', 'REMOVE @{SNAPSHOT_STAGE}/{name}/{snapshot_format}/' || $older_run || '/')
+    );
+    EXECUTE IMMEDIATE $remove_older_run;
+    """)
+    return "".join(statements)
@@ -1,23 +1,30 @@
 """
 Airflow DAG for:
 1. Checking & creating Snowflake S3 stage
-2. Loading JSON data from S3 into Snowflake
-3. Running DBT transformations
+2. Loading JSON data from S3 into Snowflake, one mapped COPY task per selected quarter
+3. Running DBT transformations once all quarters are loaded
+4. Exporting S3 snapshots and clearing the backend preview cache
 """
 
 from airflow import DAG
 from airflow.providers.snowflake.operators.snowflake import SnowflakeOperator
 from airflow.models import Variable
 from airflow.operators.bash import BashOperator
+from airflow.operators.python import PythonOperator
 from datetime import datetime
-
-# Load Airflow Variables (default to latest quarter)
-selected_year = Variable.get("selected_year", default_var="2016")
-selected_quarter = Variable.get("selected_quarter", default_var="Q4")
+from export_snapshots import FACT_TABLES, create_snapshot_stage_sql, unload_snapshots_sql
+from quarters import load_concurrency, quarter_name, resolve_quarters
 
 # Fetch S3 Bucket Name from Airflow Variables
 aws_s3_bucket = Variable.get("AWS_S3_BUCKET", default_var="my-default-bucket")
 
+# "json" for the indented array files, "ndjson" for the line-delimited files (JSON_OUTPUT_FORMAT in the transformer)
+json_output_format = Variable.get("json_output_format", default_var="json")
+json_file_format = "raw_data.ndjson_file_format" if json_output_format == "ndjson" else "raw_data.json_file_format"
+
+# Backend whose preview cache is cleared after the load
+backend_url = Variable.get("backend_url", default_var="https://fastapi-service-992661127227.us-central1.run.app")
+
 # DAG Configuration
 default_args = {'owner': 'airflow', 'start_date': datetime(2024, 1, 1), 'retries': 1}
 dag = DAG('json_s3_to_snowflake_dbt', default_args=default_args, schedule_interval=None)
@@ -46,36 +53,71 @@ create_table_task = SnowflakeOperator(
         quarter STRING,
         financial_data VARIANT
     );
+
+    -- One JSON document per line, used for the streamed .ndjson transformer output
+    CREATE FILE FORMAT IF NOT EXISTS raw_data.ndjson_file_format
+    TYPE = 'JSON'
+    STRIP_OUTER_ARRAY = FALSE;
     """,
     dag=dag
 )
 
-# Task 3: Load JSON from S3 → Snowflake (Filters by Year & Quarter)
-load_json_task = SnowflakeOperator(
-    task_id='load_json',
-    snowflake_conn_id='snowflake_default',
-    sql=f"""
-    COPY INTO raw_data.sec_financial_json
-    FROM @sec_json_stage
-    FILES = ('{selected_year}{selected_quarter}.json')
-    FILE_FORMAT = raw_data.json_file_format;
-    """,
+# Task 3: Pick the quarters to load (trigger conf "quarters", else the Variables; see quarters.py)
+resolve_quarters_task = PythonOperator(
+    task_id='resolve_quarters',
+    python_callable=resolve_quarters,
     dag=dag
 )
 
-# Task 4: Run DBT Tests for JSON Validation
+def load_json_sql(quarter):
+    return f"""
+    COPY INTO raw_data.sec_financial_json
+    FROM @sec_json_stage
+    FILES = ('{quarter_name(quarter)}.{json_output_format}')
+    FILE_FORMAT = {json_file_format};
+    """
+
+# Task 4: Load JSON from S3 → Snowflake, one mapped task per quarter, several running at once
+load_json_task = SnowflakeOperator.partial(
+    task_id='load_json',
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+    **load_concurrency()
+).expand(sql=resolve_quarters_task.output.map(load_json_sql))
+
+# Task 5: Run DBT Tests for JSON Validation
 dbt_test_task = BashOperator(
     task_id="dbt_test",
     bash_command="cd /opt/airflow/dbt && dbt test",
     dag=dag
 )
 
-# Task 5: Run DBT inside Airflow
+# Task 6: Run DBT inside Airflow; trigger with {"full_refresh": true} to rebuild the incremental marts
 dbt_run_task = BashOperator(
     task_id="dbt_run",
-    bash_command="cd /opt/airflow/dbt && dbt run",
+    bash_command="cd /opt/airflow/dbt && dbt run {{ '--full-refresh' if (dag_run.conf or {}).get('full_refresh') else '' }}",
+    dag=dag
+)
+
+# Task 7: Unload the loaded tables to S3 snapshots, which the backend download endpoints redirect to
+export_snapshots_task = SnowflakeOperator(
+    task_id='export_snapshots',
+    snowflake_conn_id='snowflake_default',
+    sql=create_snapshot_stage_sql(aws_s3_bucket) + unload_snapshots_sql([(table, table) for table in FACT_TABLES]),
+    dag=dag
+)
+
+# Task 8: Clear the backend's preview cache so the dashboard shows the new quarter right away
+invalidate_cache_task = BashOperator(
+    task_id="invalidate_backend_cache",
+    bash_command=(
+        'if [ -z "$CACHE_INVALIDATE_TOKEN" ]; then echo "cache_invalidate_token not set, skipping"; exit 0; fi; '
+        f'curl -fsS -X POST -H "X-Cache-Token: $CACHE_INVALIDATE_TOKEN" {backend_url}/cache/invalidate'
+    ),
+    env={"CACHE_INVALIDATE_TOKEN": "{{ var.value.get('cache_invalidate_token', '') }}"},
+    append_env=True,
     dag=dag
 )
 
-# DAG Task Flow: Create Stage → Create Table → Load JSON → Run DBT
-create_stage_task >> create_table_task >> load_json_task >>  dbt_test_task >> dbt_run_task
\ No newline at end of file
+# DAG Task Flow: Create Stage → Create Table → Load JSON (per quarter) → Run DBT → Export Snapshots → Clear Backend Cache
+create_stage_task >> create_table_task >> load_json_task >>  dbt_test_task >> dbt_run_task >> export_snapshots_task >> invalidate_cache_task
\ No newline at end of file
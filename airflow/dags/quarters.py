@@ -0,0 +1,72 @@
+"""
+Quarter selection shared by the load DAGs, which fan their COPY INTO tasks out per quarter with
+dynamic task mapping and run dbt once after every quarter is loaded.
+
+The quarters come from the trigger's conf ({"quarters": "2009q1-2023q4"}), else the "quarters"
+Variable, else the single selected_year/selected_quarter Variables. A spec is a comma-separated list
+of quarters and inclusive ranges, e.g. "2015q1-2015q4,2016q3".
+"""
+
+import re
+from airflow.models import Variable
+
+QUARTER_PATTERN = re.compile(r"^(\d{4})q([1-4])$", re.IGNORECASE)
+
+
+def parse_quarter(text):
+    match = QUARTER_PATTERN.match(text.strip())
+    if match is None:
+        raise ValueError(f"Invalid quarter '{text}', expected e.g. 2016q4")
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_quarters(spec):
+    """Expands a quarter spec into ordered, de-duplicated (year, quarter number) pairs."""
+    if isinstance(spec, (list, tuple)):
+        spec = ",".join(spec)
+    quarters = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        start, _, end = item.partition("-")
+        first = parse_quarter(start)
+        last = parse_quarter(end) if end else first
+        if last < first:
+            raise ValueError(f"Quarter range '{item.strip()}' ends before it starts")
+        year, number = first
+        while (year, number) <= last:
+            if (year, number) not in quarters:
+                quarters.append((year, number))
+            year, number = (year, number + 1) if number < 4 else (year + 1, 1)
+    if not quarters:
+        raise ValueError("No quarters selected")
+    return quarters
+
+
+def quarter_name(quarter):
+    """Folder and file name of a (year, quarter number) pair as the scripts write them to S3, e.g. 2024q1."""
+    year, number = quarter
+    return f"{year}q{number}"
+
+
+def resolve_quarters(dag_run=None, **context):
+    """PythonOperator callable: this run's quarters as [year, quarter number] pairs, pushed to XCom."""
+    spec = (dag_run.conf or {}).get("quarters") if dag_run else None
+    if not spec:
+        spec = Variable.get("quarters", default_var=None)
+    if not spec:
+        spec = Variable.get("selected_year", default_var="2016") + Variable.get("selected_quarter", default_var="q4")
+    quarters = parse_quarters(spec)
+    print(f"Loading {len(quarters)} quarter(s): {', '.join(quarter_name(quarter) for quarter in quarters)}")
+    return [[year, number] for year, number in quarters]
+
+
+def load_concurrency():
+    """
+    Pool and per-DAG cap for the mapped COPY tasks. Point snowflake_load_pool at a pool sized to what
+    the warehouse takes (airflow pools set snowflake_load 4 "Snowflake COPYs") to bound COPYs across DAGs.
+    """
+    return {
+        "pool": Variable.get("snowflake_load_pool", default_var="default_pool"),
+        "max_active_tis_per_dag": int(Variable.get("max_parallel_loads", default_var="4")),
+    }
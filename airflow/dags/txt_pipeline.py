@@ -1,23 +1,26 @@
 """
 Airflow DAG for:
 1. Checking & creating Snowflake S3 stage
-2. Loading txt data from S3 into Snowflake
-3. Running DBT transformations
+2. Loading txt data from S3 into Snowflake, one mapped COPY task per selected quarter
+3. Running DBT transformations once all quarters are loaded
+4. Exporting S3 snapshots and clearing the backend preview cache
 """
 
 from airflow import DAG
 from airflow.providers.snowflake.operators.snowflake import SnowflakeOperator
 from airflow.models import Variable
 from airflow.operators.bash import BashOperator
+from airflow.operators.python import PythonOperator
 from datetime import datetime
-
-# Load Airflow Variables (default to latest quarter)
-selected_year = Variable.get("selected_year", default_var="2016")
-selected_quarter = Variable.get("selected_quarter", default_var="q4")
+from export_snapshots import RAW_TABLES, create_snapshot_stage_sql, unload_snapshots_sql
+from quarters import load_concurrency, quarter_name, resolve_quarters
 
 # Fetch S3 Bucket Name from Airflow Variables
 aws_s3_bucket = Variable.get("AWS_S3_BUCKET", default_var="team-6-a2-ds")
 
+# Backend whose preview cache is cleared after the load
+backend_url = Variable.get("backend_url", default_var="https://fastapi-service-992661127227.us-central1.run.app")
+
 # DAG Configuration
 default_args = {'owner': 'airflow', 'start_date': datetime(2024, 1, 1), 'retries': 1}
 dag = DAG(dag_id='txt_s3_to_snowflake_dbt', default_args=default_args, schedule_interval=None, catchup=False)
@@ -121,48 +124,79 @@ create_table_task1 = SnowflakeOperator(
     dag=dag
 )
 
-# Task 3: Load txt from S3 → Snowflake (Filters by Year & Quarter)
-load_txt_task1 = SnowflakeOperator(
-    task_id='load_txt',
-    snowflake_conn_id='snowflake_default',
-    sql=f"""
+# Task 3: Pick the quarters to load (trigger conf "quarters", else the Variables; see quarters.py)
+resolve_quarters_task1 = PythonOperator(
+    task_id='resolve_quarters',
+    python_callable=resolve_quarters,
+    dag=dag
+)
+
+def load_txt_sql(quarter):
+    folder = quarter_name(quarter)
+    return f"""
     COPY INTO raw_data.sec_numbers
     FROM @sec_txt_stage
-    FILES = ('{selected_year}{selected_quarter}/num.txt')
+    FILES = ('{folder}/num.txt')
     FILE_FORMAT = raw_data.tsv_file_format;
 
     COPY INTO raw_data.sec_submissions
     FROM @sec_txt_stage
-    FILES = ('{selected_year}{selected_quarter}/sub.txt')
+    FILES = ('{folder}/sub.txt')
     FILE_FORMAT = raw_data.tsv_file_format;
 
     COPY INTO raw_data.sec_tags
     FROM @sec_txt_stage
-    FILES = ('{selected_year}{selected_quarter}/tag.txt')
+    FILES = ('{folder}/tag.txt')
     FILE_FORMAT = raw_data.tsv_file_format;
 
     COPY INTO raw_data.sec_presentation
     FROM @sec_txt_stage
-    FILES = ('{selected_year}{selected_quarter}/pre.txt')
+    FILES = ('{folder}/pre.txt')
     FILE_FORMAT = raw_data.tsv_file_format;
 
-    """,
-    dag=dag
-)
+    """
 
-# Task 4: Run DBT Tests for JSON Validation
+# Task 4: Load txt from S3 → Snowflake, one mapped task per quarter, several running at once
+load_txt_task1 = SnowflakeOperator.partial(
+    task_id='load_txt',
+    snowflake_conn_id='snowflake_default',
+    dag=dag,
+    **load_concurrency()
+).expand(sql=resolve_quarters_task1.output.map(load_txt_sql))
+
+# Task 5: Run DBT Tests for JSON Validation
 dbt_test_task1 = BashOperator(
     task_id="dbt_test",
     bash_command="cd /opt/airflow/dbt && dbt test",
     dag=dag
 )
 
-# Task 5: Run DBT inside Airflow
+# Task 6: Run DBT inside Airflow; trigger with {"full_refresh": true} to rebuild the incremental marts
 dbt_run_task1 = BashOperator(
     task_id="dbt_run",
-    bash_command="cd /opt/airflow/dbt && dbt run",
+    bash_command="cd /opt/airflow/dbt && dbt run {{ '--full-refresh' if (dag_run.conf or {}).get('full_refresh') else '' }}",
+    dag=dag
+)
+
+# Task 7: Unload the loaded tables to S3 snapshots, which the backend download endpoints redirect to
+export_snapshots_task1 = SnowflakeOperator(
+    task_id='export_snapshots',
+    snowflake_conn_id='snowflake_default',
+    sql=create_snapshot_stage_sql(aws_s3_bucket) + unload_snapshots_sql(RAW_TABLES.items()),
+    dag=dag
+)
+
+# Task 8: Clear the backend's preview cache so the dashboard shows the new quarter right away
+invalidate_cache_task1 = BashOperator(
+    task_id="invalidate_backend_cache",
+    bash_command=(
+        'if [ -z "$CACHE_INVALIDATE_TOKEN" ]; then echo "cache_invalidate_token not set, skipping"; exit 0; fi; '
+        f'curl -fsS -X POST -H "X-Cache-Token: $CACHE_INVALIDATE_TOKEN" {backend_url}/cache/invalidate'
+    ),
+    env={"CACHE_INVALIDATE_TOKEN": "{{ var.value.get('cache_invalidate_token', '') }}"},
+    append_env=True,
     dag=dag
 )
 
-# DAG Task Flow: Create Stage → Create Table → Load JSON → Run DBT
-create_stage_task1 >> create_table_task1 >> load_txt_task1 >>  dbt_test_task1 >> dbt_run_task1
\ No newline at end of file
+# DAG Task Flow: Create Stage → Create Table → Load txt (per quarter) → Run DBT → Export Snapshots → Clear Backend Cache
+create_stage_task1 >> create_table_task1 >> load_txt_task1 >>  dbt_test_task1 >> dbt_run_task1 >> export_snapshots_task1 >> invalidate_cache_task1
\ No newline at end of file
@@ -1,27 +1,49 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 import snowflake.connector
+from snowflake.connector.constants import FIELD_ID_TO_NAME
 import os
 import pandas as pd
 import io
 import csv
-from fastapi.responses import StreamingResponse, JSONResponse
+import json
+import zlib
+import base64
+import hashlib
+import contextvars
+from datetime import timezone
+import time
+import asyncio
+import uuid
+import secrets
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Literal
+from fastapi.responses import RedirectResponse, Response, StreamingResponse, JSONResponse
 from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 import uvicorn
 
-app = FastAPI()
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
 
-load_dotenv()
-
-from fastapi.middleware.cors import CORSMiddleware
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Change "*" to specific frontend domain for security
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+load_dotenv()
 
 # Allowed table names for denormalized data
 ALLOWED_TABLES = {"balance_sheet", "income_statement", "cash_flow"}
@@ -37,6 +59,536 @@ SNOWFLAKE_WAREHOUSE = os.getenv("SNOWFLAKE_WAREHOUSE")
 SNOWFLAKE_ROLE = os.getenv("SNOWFLAKE_ROLE")
 
 
+# Connection pool limits (see SnowflakeConnectionPool)
+POOL_MAX_SIZE = int(os.getenv("SNOWFLAKE_POOL_MAX_SIZE", 8))
+POOL_MIN_SIZE = int(os.getenv("SNOWFLAKE_POOL_MIN_SIZE", 1))
+POOL_MAX_AGE_SECONDS = int(os.getenv("SNOWFLAKE_POOL_MAX_AGE_SECONDS", 3600))
+POOL_HEALTH_CHECK_AFTER_SECONDS = int(os.getenv("SNOWFLAKE_POOL_HEALTH_CHECK_AFTER_SECONDS", 60))
+POOL_CHECKOUT_TIMEOUT_SECONDS = float(os.getenv("SNOWFLAKE_POOL_CHECKOUT_TIMEOUT_SECONDS", 10))
+
+# Warehouse round-trips (status polls, fetches, aborts) run on this many dedicated threads, so a slow
+# query never ties up the event loop or Starlette's threadpool; queries are submitted asynchronously
+# and give up with a 504 after SNOWFLAKE_QUERY_TIMEOUT_SECONDS.
+WAREHOUSE_THREADS = int(os.getenv("WAREHOUSE_THREADS", POOL_MAX_SIZE * 2))
+QUERY_TIMEOUT_SECONDS = float(os.getenv("SNOWFLAKE_QUERY_TIMEOUT_SECONDS", 120))
+QUERY_POLL_MAX_INTERVAL_SECONDS = 1.0
+
+# Page sizes of the /query endpoint
+QUERY_PAGE_SIZE = 100
+QUERY_MAX_PAGE_SIZE = 1000
+# Longest cursor accepted: a sec_numbers key is 11 short values, so anything near this was not issued by us
+QUERY_MAX_CURSOR_LENGTH = 4096
+
+# Tables served by /query/{table_name}: output column -> SQL expression, the filters each one supports,
+# and the keyset key, which starts with (company_name, fiscal_year, fiscal_period) and is made unique
+# and non-null so pages can resume from the last row's key instead of an OFFSET.
+FACT_TABLE_KEY = ["company_name", "fiscal_year", "fiscal_period"]
+FACT_TABLE_FILTERS = {"company": "company_name", "fiscal_year": "fiscal_year", "fiscal_period": "fiscal_period"}
+SUBMISSION_COLUMNS = [
+    "adsh", "cik", "name", "sic", "countryba", "stprba", "cityba", "zipba", "bas1", "bas2", "baph",
+    "countryma", "stprma", "cityma", "zipma", "mas1", "mas2", "countryinc", "stprinc", "ein", "former",
+    "changed", "afs", "wksi", "fye", "form", "period", "fy", "fp", "filed", "accepted", "prevrpt", "detail",
+    "instance", "nciks", "aciks",
+]
+NUMBER_COLUMNS = ["adsh", "tag", "version", "ddate", "qtrs", "uom", "segments", "coreg", "value", "footnote"]
+QUERY_TABLES = {
+    "balance_sheet": {
+        "from": "balance_sheet",
+        "columns": {c: c for c in FACT_TABLE_KEY + ["total_assets", "total_liabilities", "total_equity"]},
+        "filters": FACT_TABLE_FILTERS,
+        "key": FACT_TABLE_KEY,
+    },
+    "income_statement": {
+        "from": "income_statement",
+        "columns": {c: c for c in FACT_TABLE_KEY + ["revenue", "operating_income", "net_income"]},
+        "filters": FACT_TABLE_FILTERS,
+        "key": FACT_TABLE_KEY,
+    },
+    "cash_flow": {
+        "from": "cash_flow",
+        "columns": {c: c for c in FACT_TABLE_KEY + ["operating_cash_flow", "investing_cash_flow", "financing_cash_flow"]},
+        "filters": FACT_TABLE_FILTERS,
+        "key": FACT_TABLE_KEY,
+    },
+    "sec_submissions": {
+        "from": "sec_submissions",
+        "columns": {c: c for c in SUBMISSION_COLUMNS},
+        "filters": {"company": "name", "fiscal_year": "fy", "fiscal_period": "fp"},
+        "key": ["COALESCE(name, '')", "COALESCE(fy, 0)", "COALESCE(fp, '')", "adsh"],
+    },
+    "sec_numbers": {
+        "from": "sec_numbers n JOIN sec_submissions s ON s.adsh = n.adsh",
+        "columns": {
+            "company_name": "s.name", "fiscal_year": "s.fy", "fiscal_period": "s.fp",
+            **{c: f"n.{c}" for c in NUMBER_COLUMNS},
+        },
+        "filters": {"company": "s.name", "fiscal_year": "s.fy", "fiscal_period": "s.fp", "tag": "n.tag"},
+        "key": [
+            "COALESCE(s.name, '')", "COALESCE(s.fy, 0)", "COALESCE(s.fp, '')", "n.adsh", "n.tag", "n.version",
+            "n.ddate", "n.qtrs", "n.uom", "COALESCE(n.segments, '')", "COALESCE(n.coreg, '')",
+        ],
+    },
+}
+
+# Dashboard aggregations served by /stats/{aggregate}, computed in the warehouse over the full raw tables.
+# {filters} becomes the WHERE clause for the optional fiscal_year/fiscal_period filters, which apply to the
+# submissions (aliased s) the rows belong to; sec_tags is narrowed to the tags those submissions report.
+AGGREGATES = {
+    "top_tags": {
+        "sql": """
+            SELECT n.tag AS tag, SUM(n.value) AS total_value
+            FROM sec_numbers n JOIN sec_submissions s ON s.adsh = n.adsh
+            WHERE n.value IS NOT NULL {filters}
+            GROUP BY n.tag ORDER BY total_value DESC LIMIT %(limit)s
+        """,
+        "tables": ("sec_numbers", "sec_submissions"),
+        "limit": 10,
+    },
+    "submissions_by_country": {
+        "sql": """
+            SELECT COALESCE(s.countryba, 'Unknown') AS country, COUNT(*) AS submissions
+            FROM sec_submissions s
+            WHERE TRUE {filters}
+            GROUP BY 1 ORDER BY submissions DESC LIMIT %(limit)s
+        """,
+        "tables": ("sec_submissions",),
+        "limit": 20,
+    },
+    "tag_datatypes": {
+        "sql": """
+            SELECT COALESCE(t.datatype, 'Unknown') AS datatype, COUNT(*) AS tags
+            FROM sec_tags t
+            WHERE TRUE {tag_filter}
+            GROUP BY 1 ORDER BY tags DESC LIMIT %(limit)s
+        """,
+        "tables": ("sec_tags", "sec_numbers", "sec_submissions"),
+        "limit": 20,
+    },
+}
+AGGREGATE_TAG_FILTER = """
+    AND (t.tag, t.version) IN (
+        SELECT n.tag, n.version FROM sec_numbers n JOIN sec_submissions s ON s.adsh = n.adsh WHERE TRUE {filters}
+    )
+"""
+AGGREGATE_MAX_LIMIT = 100
+# Aggregates only change when a DAG loads new data, which clears them through /cache/invalidate,
+# so they outlive the preview TTL
+AGGREGATE_CACHE_TTL_SECONDS = float(os.getenv("AGGREGATE_CACHE_TTL_SECONDS", 24 * 3600))
+
+# Rows fetched and CSV-encoded per chunk by the streaming download endpoints
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 10000))
+EXPORT_MAX_BATCH_ROWS = 100000
+
+# Export formats of the download and preview endpoints; the columnar ones need pyarrow
+EXPORT_FORMATS = {
+    "csv": {"media_type": "text/csv", "extension": "csv"},
+    "parquet": {"media_type": "application/vnd.apache.parquet", "extension": "parquet"},
+    "arrow": {"media_type": "application/vnd.apache.arrow.stream", "extension": "arrow"},
+}
+ARROW_FORMATS = {"parquet", "arrow"}
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+# Content-Encodings negotiated for downloads, in order of preference (zstd needs the zstandard package).
+# Parquet is already compressed, so it is always sent as is.
+DOWNLOAD_ENCODINGS = ("zstd", "gzip")
+GZIP_LEVEL = int(os.getenv("DOWNLOAD_GZIP_LEVEL", 6))
+ZSTD_LEVEL = int(os.getenv("DOWNLOAD_ZSTD_LEVEL", 3))
+
+# Export snapshots unloaded by the DAGs (airflow/dags/export_snapshots.py): the files of a snapshot are
+# listed in s3://EXPORT_S3_BUCKET/EXPORT_S3_PREFIX<table>/<format>_manifest.json. When the snapshot is at
+# least as new as the table, downloads redirect to a presigned URL of its file, or to
+# GET /snapshots/{table_name}, which presigns each of them, when it spans several; otherwise downloads
+# stream live. Leaving EXPORT_S3_BUCKET unset disables both.
+EXPORT_S3_BUCKET = os.getenv("EXPORT_S3_BUCKET", os.getenv("S3_BUCKET_NAME"))
+EXPORT_S3_PREFIX = os.getenv("EXPORT_S3_PREFIX", "sec_exports/")
+EXPORT_URL_TTL_SECONDS = int(os.getenv("EXPORT_URL_TTL_SECONDS", 900))
+SNAPSHOT_FORMATS = ("csv", "parquet")
+
+# Preview result cache: entries live RESULT_CACHE_TTL_SECONDS, at most RESULT_CACHE_MAX_ENTRIES of them.
+# The DAGs clear it after each load through POST /cache/invalidate with the CACHE_INVALIDATE_TOKEN.
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", 900))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 256))
+CACHE_INVALIDATE_TOKEN = os.getenv("CACHE_INVALIDATE_TOKEN")
+
+
+class PoolTimeout(Exception):
+    """No pooled connection became available within the checkout timeout."""
+
+
+class SnowflakeConnectionPool:
+    """
+    Bounded, thread-safe pool of Snowflake connections, so requests skip the login round-trips.
+    Idle connections are reused newest first; a connection idle longer than health_check_after is
+    checked with SELECT 1 before reuse, and any connection older than max_age is closed and replaced.
+    """
+
+    def __init__(self, connect, max_size=POOL_MAX_SIZE, max_age=POOL_MAX_AGE_SECONDS,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER_SECONDS, checkout_timeout=POOL_CHECKOUT_TIMEOUT_SECONDS):
+        self._connect = connect
+        self.max_size = max_size
+        self.max_age = max_age
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self._idle = deque()  # (connection, created_at, last_used_at)
+        self._created_at = {}
+        self._size = 0
+        self._closed = False
+        self._lock = threading.Condition()
+        self._stats = {"created": 0, "reused": 0, "recycled": 0, "health_check_failures": 0, "waits": 0, "timeouts": 0}
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+            self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        """Closes a connection and frees its slot. Call without holding the lock."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+            self._size -= 1
+            self._lock.notify()
+
+    def _is_healthy(self, conn):
+        try:
+            if conn.is_closed():
+                return False
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+            finally:
+                cur.close()
+            return True
+        except Exception:
+            return False
+
+    def warm_up(self, count):
+        """Opens up to count connections ahead of the first requests; failures are left to checkout."""
+        for _ in range(min(count, self.max_size)):
+            with self._lock:
+                if self._size >= self.max_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception as e:
+                with self._lock:
+                    self._size -= 1
+                print(f"Snowflake pool warm-up failed: {e}")
+                return
+            self.release(conn)
+
+    def acquire(self, timeout=None):
+        """Checks out a connection, opening one if the pool is below max_size; raises PoolTimeout otherwise."""
+        deadline = time.monotonic() + (self.checkout_timeout if timeout is None else timeout)
+        while True:
+            candidate = None
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("Snowflake connection pool is closed")
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No Snowflake connection available within {self.checkout_timeout}s")
+                    self._stats["waits"] += 1
+                    self._lock.wait(remaining)
+                    continue
+
+            if candidate is None:
+                try:
+                    return self._open()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+
+            conn, created_at, last_used_at = candidate
+            now = time.monotonic()
+            if now - created_at > self.max_age:
+                self._stats["recycled"] += 1
+                self._discard(conn)
+                continue
+            if now - last_used_at > self.health_check_after and not self._is_healthy(conn):
+                self._stats["health_check_failures"] += 1
+                self._discard(conn)
+                continue
+            with self._lock:
+                self._stats["reused"] += 1
+            return conn
+
+    def release(self, conn, broken=False):
+        """Returns a connection to the pool, or closes it if it is broken, closed or the pool is shut down."""
+        try:
+            closed = conn.is_closed()
+        except Exception:
+            closed = True
+        if broken or closed or self._closed:
+            self._discard(conn)
+            return
+        with self._lock:
+            self._idle.append((conn, self._created_at.get(id(conn), time.monotonic()), time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager around acquire/release."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                **self._stats,
+            }
+
+    def close(self):
+        """Closes idle connections and makes checked-out ones close when they come back."""
+        with self._lock:
+            self._closed = True
+            idle = [conn for conn, _, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+
+class LoadCancelled(Exception):
+    """The caller running a coalesced ResultCache load was cancelled; its waiters load again."""
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with a TTL for small query results, keyed by query and parameters.
+    Concurrent misses on the same key are coalesced: one caller runs the loader, the others wait
+    for its result (or its exception; failures are never cached). If that caller is cancelled, e.g.
+    its client disconnected, a waiter takes over the load. Entries are tagged with the tables they
+    read so a load can invalidate just those.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, tables, value)
+        self._loading = {}  # key -> Future of the load in flight
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    async def get_or_load(self, key, loader, tables=(), ttl=None):
+        """
+        Returns the cached value for key, or awaits loader() once for all concurrent callers.
+        ttl overrides the cache-wide TTL for this entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[2]
+            self._entries.pop(key, None)
+            future = self._loading.get(key)
+            if future is None:
+                future = self._loading[key] = Future()
+                generation = self._generation
+                self._stats["misses"] += 1
+                waiting = False
+            else:
+                self._stats["coalesced"] += 1
+                waiting = True
+        if waiting:
+            try:
+                return await asyncio.wrap_future(future)
+            except LoadCancelled:
+                return await self.get_or_load(key, loader, tables, ttl)
+
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            with self._lock:
+                self._loading.pop(key, None)
+            future.set_exception(LoadCancelled())
+            raise
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._loading.pop(key, None)
+            # A load that raced an invalidation may hold stale rows; hand it out but don't keep it
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), frozenset(tables), value)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+        future.set_result(value)
+        return value
+
+    def invalidate(self, tables=None):
+        """Drops every entry, or only those reading one of the given tables; returns how many were dropped."""
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += 1
+            if not tables:
+                dropped = len(self._entries)
+                self._entries.clear()
+                return dropped
+            tables = {table.lower() for table in tables}
+            stale = [key for key, (_, entry_tables, _) in self._entries.items() if entry_tables & tables]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"] + self._stats["coalesced"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                **self._stats,
+            }
+
+
+# Prometheus metrics, labelled by route template (never the raw path) to keep cardinality bounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+REQUEST_LATENCY = Histogram(
+    "backend_request_duration_seconds", "Request latency, until the last body byte is sent",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+PHASE_LATENCY = Histogram(
+    "backend_request_phase_seconds", "Time a request spent per phase: connect, execute, fetch, serialize",
+    ["endpoint", "phase"], buckets=LATENCY_BUCKETS,
+)
+ROWS_FETCHED = Counter("backend_rows_fetched_total", "Rows fetched from Snowflake", ["endpoint"])
+BYTES_SENT = Counter("backend_response_bytes_total", "Response body bytes sent", ["endpoint"])
+QUERIES = Counter("backend_snowflake_queries_total", "Snowflake queries submitted", ["endpoint"])
+
+# Per-request timings, filled in by phase()/record_* from the handler and the warehouse threads it uses
+request_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    __slots__ = ("phases", "rows", "query_ids")
+
+    def __init__(self):
+        self.phases = {}
+        self.rows = 0
+        self.query_ids = []
+
+
+@contextmanager
+def phase(name):
+    """Adds the wall time of the block to the current request's phase; a no-op outside requests."""
+    metrics = request_metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.phases[name] = metrics.phases.get(name, 0.0) + time.perf_counter() - started
+
+
+def record_rows(count):
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.rows += count
+
+
+def record_query_id(query_id):
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.query_ids.append(query_id)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times each request through its last body byte, counts the bytes sent, and
+    observes the phase breakdown collected in request_metrics. Snowflake query IDs go out in an
+    X-Snowflake-Query-Id header, for looking the query up in Snowflake's query history.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        started = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if metrics.query_ids:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"x-snowflake-query-id", ",".join(metrics.query_ids).encode("latin-1"))
+                    ]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            request_metrics.reset(token)
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.labels(endpoint, scope["method"], str(status)).observe(time.perf_counter() - started)
+            for name, seconds in metrics.phases.items():
+                PHASE_LATENCY.labels(endpoint, name).observe(seconds)
+            if metrics.rows:
+                ROWS_FETCHED.labels(endpoint).inc(metrics.rows)
+            if metrics.query_ids:
+                QUERIES.labels(endpoint).inc(len(metrics.query_ids))
+            BYTES_SENT.labels(endpoint).inc(sent)
+
+
+class BackendStatsCollector:
+    """Exports the connection pool and result cache counters at scrape time."""
+
+    def collect(self):
+        pool = getattr(app.state, "snowflake_pool", None)
+        if pool is not None:
+            stats = pool.stats()
+            for name in ("size", "idle", "in_use", "max_size"):
+                yield GaugeMetricFamily(f"backend_pool_{name}", f"Snowflake pool connections: {name}", value=stats[name])
+            for name in ("created", "reused", "recycled", "health_check_failures", "waits", "timeouts"):
+                yield CounterMetricFamily(f"backend_pool_{name}", f"Snowflake pool checkouts: {name}", value=stats[name])
+        cache = getattr(app.state, "result_cache", None)
+        if cache is not None:
+            stats = cache.stats()
+            yield GaugeMetricFamily("backend_cache_entries", "Cached preview results", value=stats["entries"])
+            for name in ("hits", "misses", "coalesced", "evictions", "invalidations"):
+                yield CounterMetricFamily(f"backend_cache_{name}", f"Preview cache lookups: {name}", value=stats[name])
+
+
 def get_snowflake_connection():
     """
     Establishes a connection to Snowflake.
@@ -56,14 +608,696 @@ def get_snowflake_connection():
         raise HTTPException(status_code=500, detail=f"Failed to connect to Snowflake: {str(e)}")
 
 
+@asynccontextmanager
+async def lifespan(app):
+    """Creates the Snowflake connection pool, result cache and warehouse threads at startup; closes them at shutdown."""
+    app.state.snowflake_pool = SnowflakeConnectionPool(get_snowflake_connection)
+    app.state.result_cache = ResultCache()
+    app.state.warehouse_executor = ThreadPoolExecutor(max_workers=WAREHOUSE_THREADS, thread_name_prefix="warehouse")
+    await run_in_threadpool(app.state.snowflake_pool.warm_up, POOL_MIN_SIZE)
+    yield
+    app.state.warehouse_executor.shutdown(wait=True, cancel_futures=True)
+    app.state.snowflake_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+from fastapi.middleware.cors import CORSMiddleware
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Change "*" to specific frontend domain for security
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["ETag", "X-Export-Id", "X-Snowflake-Query-Id"],
+)
+app.add_middleware(MetricsMiddleware)
+REGISTRY.register(BackendStatsCollector())
+
+
+def in_warehouse_thread(fn, *args):
+    """
+    Runs a blocking connector call on the warehouse threads; returns an awaitable. The call sees the
+    caller's context, so phase() and record_rows() inside it count toward the right request.
+    """
+    return asyncio.wrap_future(submit_to_warehouse(fn, *args))
+
+
+def submit_to_warehouse(fn, *args):
+    """Like in_warehouse_thread, but returns the concurrent.futures.Future so callers can wait for the call after cancelling its awaitable."""
+    context = contextvars.copy_context()
+    return app.state.warehouse_executor.submit(context.run, fn, *args)
+
+
+async def acquire_connection():
+    """
+    Checks a connection out of the app's pool without blocking the event loop, answering 503 when the
+    pool stays exhausted. Waits happen on the event loop's default executor so they never hold a warehouse thread.
+    """
+    pool = app.state.snowflake_pool
+    loop = asyncio.get_running_loop()
+    acquiring = loop.run_in_executor(None, pool.acquire)
+    try:
+        with phase("connect"):
+            return await asyncio.shield(acquiring)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.CancelledError:
+        # The checkout may still succeed after the request is gone; hand that connection straight back
+        acquiring.add_done_callback(lambda f: f.cancelled() or f.exception() or pool.release(f.result()))
+        raise
+
+
+def finish_query(conn, cur, abort=False, pending=None):
+    """
+    Closes the cursor, aborting its query first if asked, and returns the connection to the pool.
+    pending is a fetch that may still be running on the cursor; it is cancelled if it has not started,
+    otherwise waited for, so the cursor is never closed or the connection reused under it.
+    """
+    if abort and cur.sfqid:
+        try:
+            cur.abort_query(cur.sfqid)
+        except Exception as e:
+            print(f"Error aborting query {cur.sfqid}: {e}")
+    if pending is not None and not pending.cancel():
+        try:
+            pending.result()
+        except Exception as e:
+            print(f"Fetch for query {cur.sfqid} failed after abort: {e}")
+    try:
+        cur.close()
+    finally:
+        app.state.snowflake_pool.release(conn)
+
+
+def release_query(conn, cur, abort=False, pending=None):
+    """Schedules finish_query on the warehouse threads; safe to call from cancelled tasks and finally blocks."""
+    app.state.warehouse_executor.submit(finish_query, conn, cur, abort, pending)
+
+
+async def start_query(query, params=None, request=None, timeout=QUERY_TIMEOUT_SECONDS):
+    """
+    Submits query (with params bound by the connector) via execute_async and polls its status until the results are ready, so no thread
+    waits on the warehouse meanwhile. Raises 504 after timeout seconds and gives up when the client
+    of request disconnects; either way the query is aborted. Returns (conn, cur) positioned on the
+    results; the caller hands them to release_query when done.
+    """
+    loop = asyncio.get_running_loop()
+    conn = await acquire_connection()
+    cur = conn.cursor()
+    try:
+        with phase("execute"):
+            await in_warehouse_thread(cur.execute_async, query, params)
+            record_query_id(cur.sfqid)
+            deadline = loop.time() + timeout
+            interval = 0.05
+            while True:
+                status = await in_warehouse_thread(conn.get_query_status_throw_if_error, cur.sfqid)
+                if not conn.is_still_running(status):
+                    break
+                if request is not None and await request.is_disconnected():
+                    raise HTTPException(status_code=499, detail="Client disconnected.")
+                if loop.time() >= deadline:
+                    raise HTTPException(status_code=504, detail=f"Query did not finish within {timeout:g}s.")
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, QUERY_POLL_MAX_INTERVAL_SECONDS)
+            await in_warehouse_thread(cur.get_results_from_sfqid, cur.sfqid)
+    except BaseException as e:
+        release_query(conn, cur, abort=True)
+        if isinstance(e, (HTTPException, asyncio.CancelledError)):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+    return conn, cur
+
+
+# Streaming exports in flight, by export id, so clients can cancel them mid-stream
+active_exports = {}
+active_exports_lock = threading.Lock()
+
+
+def encode_csv_batch(rows, header=None):
+    """CSV-encodes one batch of rows (plus an optional header row) to bytes."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if header is not None:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return output.getvalue().encode("utf-8")
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last drain, for streaming pyarrow writers."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def timestamp_unit(scale):
+    """Arrow unit holding a Snowflake fractional-seconds scale (0-9) exactly, as the connector converts it."""
+    if scale == 0:
+        return "s"
+    if scale <= 3:
+        return "ms"
+    if scale <= 6:
+        return "us"
+    return "ns"
+
+
+def arrow_type(desc):
+    """
+    Arrow type of one result column, from its cursor description entry. Integers are int64 and scaled
+    numbers keep their NUMBER(precision, scale) as decimal128; semi-structured values are JSON text.
+    """
+    type_name = FIELD_ID_TO_NAME[desc.type_code]
+    scale = desc.scale or 0
+    if type_name == "FIXED":
+        return pa.int64() if scale == 0 else pa.decimal128(desc.precision or 38, scale)
+    if type_name == "REAL":
+        return pa.float64()
+    if type_name == "BOOLEAN":
+        return pa.bool_()
+    if type_name == "DATE":
+        return pa.date32()
+    if type_name == "TIME":
+        return pa.time64("ns" if scale > 6 else "us")
+    if type_name in ("TIMESTAMP_NTZ", "TIMESTAMP"):
+        return pa.timestamp(timestamp_unit(scale))
+    if type_name in ("TIMESTAMP_LTZ", "TIMESTAMP_TZ"):
+        return pa.timestamp(timestamp_unit(scale), tz="UTC")
+    if type_name == "BINARY":
+        return pa.binary()
+    return pa.string()
+
+
+def arrow_schema(cur):
+    """
+    One schema for the whole result. Snowflake sizes each Arrow chunk's types to its own values (int8 in
+    one chunk, int64 or decimal in the next), so every batch is cast to this before it is written.
+    """
+    return pa.schema([pa.field(desc.name, arrow_type(desc)) for desc in cur.description])
+
+
+def empty_arrow_table(cur):
+    """Arrow table for a result with no rows; Snowflake returns no batches, so columns come from the description."""
+    return arrow_schema(cur).empty_table()
+
+
+def new_arrow_writer(sink, schema, export_format):
+    if export_format == "parquet":
+        return pq.ParquetWriter(sink, schema, compression=PARQUET_COMPRESSION)
+    return pa.ipc.new_stream(sink, schema)
+
+
+def iter_csv_chunks(cur, batch_size):
+    yield encode_csv_batch([], header=[desc[0] for desc in cur.description])
+    while True:
+        with phase("fetch"):
+            rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        record_rows(len(rows))
+        with phase("serialize"):
+            chunk = encode_csv_batch(rows)
+        yield chunk
+
+
+def iter_arrow_chunks(cur, export_format):
+    """
+    Encodes the result batch by batch as Parquet (one zstd row group per batch) or an Arrow IPC stream.
+    Batches come straight from Snowflake's Arrow result chunks, keeping native numeric and date types.
+    """
+    sink = ChunkSink()
+    schema = arrow_schema(cur)
+    writer = new_arrow_writer(sink, schema, export_format)
+    written = False
+    batches = cur.fetch_arrow_batches()
+    while True:
+        with phase("fetch"):
+            table = next(batches, None)
+        if table is None:
+            break
+        record_rows(table.num_rows)
+        with phase("serialize"):
+            writer.write_table(table.cast(schema))
+        written = True
+        yield sink.drain()
+    if not written:
+        writer.write_table(empty_arrow_table(cur))
+    writer.close()
+    yield sink.drain()
+
+
+def encode_arrow_table(table, export_format):
+    sink = ChunkSink()
+    writer = new_arrow_writer(sink, table.schema, export_format)
+    writer.write_table(table)
+    writer.close()
+    return sink.drain()
+
+
+def check_export_format(export_format):
+    if export_format in ARROW_FORMATS and pa is None:
+        raise HTTPException(status_code=400, detail=f"{export_format} export requires pyarrow, which is not installed.")
+
+
+async def stream_export(conn, cur, chunks, export_id):
+    """
+    Yields the byte chunks of an export, pulling each one on the warehouse threads so fetches never
+    block the event loop. Stops when the export is cancelled through DELETE /exports/{export_id} or the client
+    disconnects; either way the running query is aborted and the connection goes back to the pool.
+    """
+    cancelled = threading.Event()
+    with active_exports_lock:
+        active_exports[export_id] = cancelled
+    finished = False
+    # The fetch in flight when the client goes away keeps running on its warehouse thread; finish_query waits for it
+    pending = None
+    try:
+        while not cancelled.is_set():
+            pending = submit_to_warehouse(next, chunks, None)
+            chunk = await asyncio.wrap_future(pending)
+            pending = None
+            if chunk is None:
+                finished = True
+                break
+            yield chunk
+    finally:
+        with active_exports_lock:
+            active_exports.pop(export_id, None)
+        if not finished:
+            print(f"Export {export_id} stopped before completion, aborting query {cur.sfqid}")
+        release_query(conn, cur, abort=not finished, pending=pending)
+
+
+def parse_accept_encoding(accept_encoding):
+    """Maps each encoding in an Accept-Encoding header to its q-value."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, parameters = part.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def accepts_encoding(accepted, encoding):
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+def negotiate_encoding(accepted, export_format):
+    """Picks the preferred DOWNLOAD_ENCODINGS entry the client accepts with q > 0, or None for identity."""
+    if export_format == "parquet":
+        return None
+    for encoding in DOWNLOAD_ENCODINGS:
+        if encoding == "zstd" and zstandard is None:
+            continue
+        if accepts_encoding(accepted, encoding):
+            return encoding
+    return None
+
+
+def compress_chunks(chunks, encoding):
+    """
+    Compresses an export stream on the fly. Every chunk is flushed to a block boundary, so the client
+    can decode each batch as soon as it arrives instead of waiting for the compressor's window to fill.
+    """
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        flush_block = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        flush_block = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+    for chunk in chunks:
+        with phase("serialize"):
+            compressed = compressor.compress(chunk) + flush_block()
+        yield compressed
+    yield compressor.flush()
+
+
+async def table_version(table_name):
+    """
+    Last-altered timestamp and row count of a table from INFORMATION_SCHEMA, a metadata lookup that
+    needs no scan; None if the table is not visible in the current schema.
+    """
+    _, rows = await fetch_rows(
+        "SELECT last_altered, row_count FROM information_schema.tables "
+        "WHERE table_schema = CURRENT_SCHEMA() AND table_name = %(table_name)s",
+        {"table_name": table_name.upper()},
+    )
+    return rows[0] if rows else None
+
+
+def download_etag(table_name, version, export_format, encoding):
+    """Strong ETag for one representation of a table version: it changes with the data, format and encoding."""
+    last_altered, row_count = version
+    digest = hashlib.sha256(f"{table_name}|{last_altered}|{row_count}|{export_format}|{encoding}".encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+_s3_client = None
+
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            "s3",
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            region_name=os.getenv("AWS_REGION"),
+            config=Config(signature_version="s3v4"),
+        )
+    return _s3_client
+
+
+def snapshot_manifest_key(table_name, export_format):
+    return f"{EXPORT_S3_PREFIX}{table_name}/{export_format}_manifest.json"
+
+
+def read_snapshot_manifest(key):
+    """(last modified, files) of a snapshot manifest, or None when there is none."""
+    try:
+        obj = get_s3_client().get_object(Bucket=EXPORT_S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return obj["LastModified"], json.loads(obj["Body"].read())["files"]
+
+
+def as_utc(timestamp):
+    return timestamp.replace(tzinfo=timezone.utc) if timestamp.tzinfo is None else timestamp
+
+
+async def current_snapshot(table_name, export_format, version):
+    """
+    Files ({"key", "size"} from the manifest) of the table's snapshot in this format, or None when there
+    is no snapshot, it is empty or older than the table (loaded outside the DAGs), or S3 cannot be
+    reached. Lookups are cached with the previews, so the DAGs' cache invalidation also picks up a
+    fresh snapshot.
+    """
+    if not EXPORT_S3_BUCKET or export_format not in SNAPSHOT_FORMATS:
+        return None
+    key = snapshot_manifest_key(table_name, export_format)
+
+    async def lookup():
+        return await run_in_threadpool(read_snapshot_manifest, key)
+
+    try:
+        manifest = await app.state.result_cache.get_or_load(("snapshot", key), lookup, tables=(table_name,))
+    except Exception as e:
+        print(f"Error looking up snapshot {key}: {e}")
+        return None
+    if manifest is None:
+        return None
+    last_modified, files = manifest
+    if not files:
+        return None
+    if version is not None and as_utc(last_modified) < as_utc(version[0]):
+        return None
+    return files
+
+
+def presign_snapshot_file(key, file_name, export_format, content_encoding=None):
+    params = {
+        "Bucket": EXPORT_S3_BUCKET,
+        "Key": key,
+        "ResponseContentDisposition": f"attachment; filename={file_name}",
+        "ResponseContentType": EXPORT_FORMATS[export_format]["media_type"],
+    }
+    if content_encoding is not None:
+        params["ResponseContentEncoding"] = content_encoding
+    return get_s3_client().generate_presigned_url("get_object", Params=params, ExpiresIn=EXPORT_URL_TTL_SECONDS)
+
+
+async def current_snapshot_url(table_name, export_format, version):
+    """
+    Where a download of the table's current snapshot in this format is redirected: the presigned URL
+    of its file, or GET /snapshots/{table_name} listing presigned URLs of its files when it spans
+    several. None when there is no current snapshot.
+    """
+    files = await current_snapshot(table_name, export_format, version)
+    if files is None:
+        return None
+    if len(files) > 1:
+        return f"/snapshots/{table_name}?format={export_format}"
+    file_name = f"{table_name}.{EXPORT_FORMATS[export_format]['extension']}"
+    # CSV is served as gzip Content-Encoding so clients decode it transparently into the usual CSV
+    content_encoding = "gzip" if export_format == "csv" else None
+    return presign_snapshot_file(files[0]["key"], file_name, export_format, content_encoding)
+
+
+async def download_response(request, table_name, export_format, batch_size, live=False):
+    """
+    Sends a whole table as CSV, Parquet or an Arrow IPC stream. A repeat download whose If-None-Match
+    matches the ETag derived from the table version gets a 304 without running the query. Otherwise
+    the client is redirected to the current S3 snapshot when there is one (unless live is set), and
+    only then is the table streamed from Snowflake: batch_size rows per chunk, compressed with the
+    negotiated Content-Encoding, with an X-Export-Id header that DELETE /exports/{export_id} accepts.
+    """
+    check_export_format(export_format)
+    accepted = parse_accept_encoding(request.headers.get("accept-encoding"))
+    encoding = negotiate_encoding(accepted, export_format)
+    headers = {"Vary": "Accept-Encoding"}
+    version = await table_version(table_name)
+    if version is not None:
+        headers["ETag"] = download_etag(table_name, version, export_format, encoding)
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    if not live and (export_format != "csv" or accepts_encoding(accepted, "gzip")):
+        snapshot_url = await current_snapshot_url(table_name, export_format, version)
+        if snapshot_url is not None:
+            return RedirectResponse(snapshot_url, status_code=307, headers={"Vary": "Accept-Encoding"})
+
+    conn, cur = await start_query(f"SELECT * FROM {table_name}", request=request)
+    if export_format == "csv":
+        chunks = iter_csv_chunks(cur, batch_size)
+    else:
+        chunks = iter_arrow_chunks(cur, export_format)
+    if encoding is not None:
+        chunks = compress_chunks(chunks, encoding)
+        headers["Content-Encoding"] = encoding
+    export_id = uuid.uuid4().hex
+    headers.update({
+        "Content-Disposition": f"attachment; filename={table_name}.{EXPORT_FORMATS[export_format]['extension']}",
+        "X-Export-Id": export_id,
+    })
+    return StreamingResponse(
+        stream_export(conn, cur, chunks, export_id),
+        media_type=EXPORT_FORMATS[export_format]["media_type"],
+        headers=headers,
+    )
+
+
+async def preview_file_response(table_name, export_format):
+    """Returns the 20-row preview of a table as a CSV, Parquet or Arrow file."""
+    check_export_format(export_format)
+    content = await app.state.result_cache.get_or_load(
+        ("preview", table_name, export_format),
+        lambda: load_preview_file(table_name, export_format),
+        tables=(table_name,),
+    )
+    headers = {"Content-Disposition": f"attachment; filename={table_name}_preview.{EXPORT_FORMATS[export_format]['extension']}"}
+    return Response(content=content, media_type=EXPORT_FORMATS[export_format]["media_type"], headers=headers)
+
+
+def encode_result_file(cur, export_format):
+    with phase("fetch"):
+        if export_format == "csv":
+            result = cur.fetchall()
+        else:
+            schema = arrow_schema(cur)
+            result = pa.concat_tables([empty_arrow_table(cur)] + [table.cast(schema) for table in cur.fetch_arrow_batches()])
+    record_rows(len(result))
+    with phase("serialize"):
+        if export_format == "csv":
+            return encode_csv_batch(result, header=[desc[0] for desc in cur.description])
+        return encode_arrow_table(result, export_format)
+
+
+async def load_preview_file(table_name, export_format):
+    conn, cur = await start_query(f"SELECT * FROM {table_name} LIMIT 20")
+    try:
+        return await in_warehouse_thread(encode_result_file, cur, export_format)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        release_query(conn, cur)
+
+
+@app.delete("/exports/{export_id}")
+async def cancel_export(export_id: str):
+    """Cancels a streaming download by the id from its X-Export-Id header."""
+    with active_exports_lock:
+        cancelled = active_exports.get(export_id)
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail="No active export with this id.")
+    cancelled.set()
+    return {"export_id": export_id, "cancelled": True}
+
+
+def fetch_all(cur):
+    with phase("fetch"):
+        rows = cur.fetchall()
+    record_rows(len(rows))
+    return [desc[0] for desc in cur.description], rows
+
+
+async def fetch_rows(query, params=None):
+    """Runs a small query on a pooled connection; returns (column names, rows)."""
+    conn, cur = await start_query(query, params)
+    try:
+        return await in_warehouse_thread(fetch_all, cur)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        release_query(conn, cur)
+
+
+def cached(key, loader, tables, ttl=None):
+    return app.state.result_cache.get_or_load(key, loader, tables=tables, ttl=ttl)
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(table: list[str] = Query(None), x_cache_token: str = Header(None)):
+    """
+    Clears cached previews, all of them or only those of the given tables (repeat ?table=).
+    Called by the Airflow DAGs after each load; needs the X-Cache-Token header to match CACHE_INVALIDATE_TOKEN.
+    """
+    if not CACHE_INVALIDATE_TOKEN:
+        raise HTTPException(status_code=403, detail="Cache invalidation is disabled: CACHE_INVALIDATE_TOKEN is not set.")
+    if x_cache_token is None or not secrets.compare_digest(x_cache_token, CACHE_INVALIDATE_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid cache token.")
+    dropped = app.state.result_cache.invalidate(table)
+    return {"invalidated": dropped, "tables": table or "all"}
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Preview cache counters: entries, hits, misses, coalesced waits, evictions and invalidations."""
+    return app.state.result_cache.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus exposition: request and phase latency histograms, rows, bytes, pool and cache counters."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/pool/stats")
+async def get_pool_stats():
+    """Snowflake connection pool counters: size, idle/in-use connections, reuse, recycling and waits."""
+    return app.state.snowflake_pool.stats()
+
+
+def encode_page_cursor(key_values):
+    return base64.urlsafe_b64encode(json.dumps(jsonable_encoder(key_values)).encode("utf-8")).decode("ascii")
+
+
+def decode_page_cursor(cursor, key_length):
+    """Key values of a next_cursor; 400 unless it is a list of key_length scalars, as encode_page_cursor writes."""
+    if len(cursor) > QUERY_MAX_CURSOR_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    try:
+        key_values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not isinstance(key_values, list) or len(key_values) != key_length:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in key_values):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return key_values
+
+
+def keyset_predicate(key, params):
+    """
+    Expands (k0, k1, ...) > (%(after_0)s, %(after_1)s, ...) into ORs of equality prefixes, which every
+    warehouse evaluates (and prunes on) without row-value comparison support.
+    """
+    terms = []
+    for i, expression in enumerate(key):
+        equal_prefix = [f"{key[j]} = %(after_{j})s" for j in range(i)]
+        terms.append("(" + " AND ".join(equal_prefix + [f"{expression} > %(after_{i})s"]) + ")")
+    return "(" + " OR ".join(terms) + ")"
+
+
+def build_page_query(spec, columns, filters, after, limit):
+    """
+    Builds the parameterized query for one page: projected columns plus the key (as __key_i), the
+    filters pushed down as bound parameters, and the keyset predicate when resuming after a cursor.
+    """
+    params = {"limit": limit + 1}
+    conditions = []
+    for name, value in filters.items():
+        expression = spec["filters"][name]
+        if name == "company" and value.endswith("*"):
+            conditions.append(f"STARTSWITH({expression}, %(company)s)")
+            params["company"] = value[:-1]
+        elif name == "fiscal_year":
+            year_from, year_to = value
+            if year_from is not None:
+                conditions.append(f"{expression} >= %(fiscal_year_from)s")
+                params["fiscal_year_from"] = year_from
+            if year_to is not None:
+                conditions.append(f"{expression} <= %(fiscal_year_to)s")
+                params["fiscal_year_to"] = year_to
+        else:
+            conditions.append(f"{expression} = %({name})s")
+            params[name] = value
+    if after is not None:
+        conditions.append(keyset_predicate(spec["key"], params))
+        params.update({f"after_{i}": value for i, value in enumerate(after)})
+
+    select = [f"{spec['columns'][c]} AS {c}" for c in columns]
+    select += [f"{expression} AS __key_{i}" for i, expression in enumerate(spec["key"])]
+    query = f"SELECT {', '.join(select)} FROM {spec['from']}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY {', '.join(spec['key'])} LIMIT %(limit)s"
+    return query, params
+
+
 @app.get("/")
-def home():
+async def home():
     return {"message": "FastAPI is running!"}
 
 
 # Fetch ALL JSON Data from the STG_DATA_JSON View
 @app.get("/json_view/")
-def get_json_view_data():
+async def get_json_view_data():
     """
     Fetch all JSON data from the STG_DATA_JSON view.
     """
@@ -72,119 +1306,212 @@ def get_json_view_data():
     """
 
     try:
-        conn = get_snowflake_connection()
-        cur = conn.cursor()
-        cur.execute(query)
-        data = [dict(zip([column[0] for column in cur.description], row)) for row in cur.fetchall()]
-
-        cur.close()
-        conn.close()
+        columns, rows = await cached(("json_view",), lambda: fetch_rows(query), tables=("stg_data_json",))
+        data = [dict(zip(columns, row)) for row in rows]
 
         if not data:
             raise HTTPException(status_code=404, detail="No data found in the view.")
 
-        return {"json_view_data": data}
+        with phase("serialize"):
+            return JSONResponse(content=jsonable_encoder({"json_view_data": data}))
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/denormalized/preview/{table_name}")
-def get_denormalized_preview(table_name: str):
+async def get_denormalized_preview(table_name: str, format: Literal["json", "csv", "parquet", "arrow"] = "json"):
     if table_name not in ALLOWED_TABLES:
         raise HTTPException(status_code=400, detail="Invalid table name. Must be one of: balance_sheet, income_statement, cash_flow")
-    
-    conn = get_snowflake_connection()
-    cur = conn.cursor()
+    if format != "json":
+        return await preview_file_response(table_name, format)
+
+    query = f"SELECT * FROM {table_name} LIMIT 20"
     try:
-        query = f"SELECT * FROM {table_name} LIMIT 20"
-        cur.execute(query)
-        data = cur.fetchall()
-        # You can also include column names
-        columns = [desc[0] for desc in cur.description]
-        return JSONResponse(content={"columns": columns, "data": data})
+        columns, data = await cached(("preview", table_name, "json"), lambda: fetch_rows(query), tables=(table_name,))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+
+    with phase("serialize"):
+        return JSONResponse(content={"columns": columns, "data": data})
 
 @app.get("/denormalized/download/{table_name}")
-def download_denormalized(table_name: str):
+async def download_denormalized(
+    request: Request,
+    table_name: str,
+    format: Literal["csv", "parquet", "arrow"] = "csv",
+    batch_size: int = Query(EXPORT_BATCH_ROWS, ge=1, le=EXPORT_MAX_BATCH_ROWS),
+    live: bool = Query(False, description="Stream from Snowflake even when an S3 snapshot exists"),
+):
     if table_name not in ALLOWED_TABLES:
         raise HTTPException(status_code=400, detail="Invalid table name. Must be one of: balance_sheet, income_statement, cash_flow")
-    
-    conn = get_snowflake_connection()
-    cur = conn.cursor()
-    try:
-        query = f"SELECT * FROM {table_name}"
-        cur.execute(query)
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        # Write header row
-        writer.writerow(columns)
-        writer.writerows(rows)
-        output.seek(0)
-
-        headers = {"Content-Disposition": f"attachment; filename={table_name}.csv"}
-        return StreamingResponse(output, media_type="text/csv", headers=headers)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+
+    return await download_response(request, table_name, format, batch_size, live)
 
 @app.get("/normalized/preview/{table_name}")
-def get_normalized_preview(table_name: str):
+async def get_normalized_preview(table_name: str, format: Literal["json", "csv", "parquet", "arrow"] = "json"):
     if table_name not in ALLOWED_NORMALIZED_TABLES:
         raise HTTPException(status_code=400, detail="Invalid table name. Must be one of: sec_numbers, sec_submissions, sec_tags, sec_presentation")
-   
-    conn = get_snowflake_connection()
-    cur = conn.cursor()
+    if format != "json":
+        return await preview_file_response(table_name, format)
+
+    query = f"SELECT * FROM {table_name} LIMIT 20"
     try:
-        query = f"SELECT * FROM {table_name} LIMIT 20"
-        cur.execute(query)
-        data = cur.fetchall()
-        # You can also include column names
-        columns = [desc[0] for desc in cur.description]
-        content={"columns": columns, "data": data}
-        return JSONResponse(content=jsonable_encoder(content))
+        columns, data = await cached(("preview", table_name, "json"), lambda: fetch_rows(query), tables=(table_name,))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+
+    content={"columns": columns, "data": data}
+    with phase("serialize"):
+        return JSONResponse(content=jsonable_encoder(content))
 
 @app.get("/normalized/download/{table_name}")
-def download_normalized(table_name: str):
+async def download_normalized(
+    request: Request,
+    table_name: str,
+    format: Literal["csv", "parquet", "arrow"] = "csv",
+    batch_size: int = Query(EXPORT_BATCH_ROWS, ge=1, le=EXPORT_MAX_BATCH_ROWS),
+    live: bool = Query(False, description="Stream from Snowflake even when an S3 snapshot exists"),
+):
     if table_name not in ALLOWED_NORMALIZED_TABLES:
         raise HTTPException(status_code=400, detail="Invalid table name. Must be one of: sec_numbers, sec_submissions, sec_tags, sec_presentation")
-   
-    conn = get_snowflake_connection()
-    cur = conn.cursor()
+
+    return await download_response(request, table_name, format, batch_size, live)
+
+@app.get("/snapshots/{table_name}")
+async def get_snapshot(table_name: str, format: Literal["csv", "parquet"] = "csv"):
+    """
+    Presigned URLs of every file of a table's current S3 snapshot; downloads of a snapshot split over
+    several files redirect here, and clients fetch the files in parallel straight from S3. CSV files
+    are gzipped with a header row each. 404 when there is no current snapshot (the download endpoints
+    then stream the table live).
+    """
+    if table_name not in ALLOWED_TABLES | ALLOWED_NORMALIZED_TABLES:
+        raise HTTPException(status_code=400, detail=f"Invalid table name. Must be one of: {', '.join(sorted(ALLOWED_TABLES | ALLOWED_NORMALIZED_TABLES))}")
+
+    version = await table_version(table_name)
+    files = await current_snapshot(table_name, format, version)
+    if files is None:
+        raise HTTPException(status_code=404, detail=f"No current {format} snapshot of {table_name}.")
+    return {
+        "table": table_name,
+        "format": format,
+        "expires_in": EXPORT_URL_TTL_SECONDS,
+        "files": [
+            {"url": presign_snapshot_file(f["key"], f["key"].rsplit("/", 1)[-1], format), "size": f["size"]}
+            for f in files
+        ],
+    }
+
+@app.get("/query/{table_name}")
+async def query_table(
+    request: Request,
+    table_name: str,
+    columns: str = Query(None, description="Comma-separated columns to return; all by default"),
+    company: str = Query(None, description="Exact company name, or a prefix ending in *"),
+    fiscal_year_from: int = None,
+    fiscal_year_to: int = None,
+    fiscal_period: str = None,
+    tag: str = Query(None, description="XBRL tag (sec_numbers only)"),
+    limit: int = Query(QUERY_PAGE_SIZE, ge=1, le=QUERY_MAX_PAGE_SIZE),
+    cursor: str = Query(None, description="next_cursor of the previous page"),
+):
+    """
+    Filtered, keyset-paginated reads of the fact tables, sec_submissions and sec_numbers. Filters run in
+    the warehouse as bound parameters and pages resume after the previous page's last key, so a deep
+    page costs the same as the first. Pass next_cursor back as cursor until it comes back null.
+    """
+    spec = QUERY_TABLES.get(table_name)
+    if spec is None:
+        raise HTTPException(status_code=400, detail=f"Invalid table name. Must be one of: {', '.join(QUERY_TABLES)}")
+
+    selected = list(spec["columns"]) if columns is None else [c.strip().lower() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in selected if c not in spec["columns"]]
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail=f"Unknown columns {unknown}. Must be among: {', '.join(spec['columns'])}")
+
+    filters = {}
+    if company:
+        filters["company"] = company
+    if fiscal_year_from is not None or fiscal_year_to is not None:
+        filters["fiscal_year"] = (fiscal_year_from, fiscal_year_to)
+    if fiscal_period:
+        filters["fiscal_period"] = fiscal_period
+    if tag:
+        if "tag" not in spec["filters"]:
+            raise HTTPException(status_code=400, detail="The tag filter only applies to sec_numbers.")
+        filters["tag"] = tag
+    after = decode_page_cursor(cursor, len(spec["key"])) if cursor else None
+
+    query, params = build_page_query(spec, selected, filters, after, limit)
+    conn, cur = await start_query(query, params, request=request)
     try:
-        query = f"SELECT * FROM {table_name}"
-        cur.execute(query)
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-       
-        output = io.StringIO()
-        writer = csv.writer(output)
-        # Write header row
-        writer.writerow(columns)
-        writer.writerows(rows)
-        output.seek(0)
- 
-        headers = {"Content-Disposition": f"attachment; filename={table_name}.csv"}
-        return StreamingResponse(output, media_type="text/csv", headers=headers)
+        _, rows = await in_warehouse_thread(fetch_all, cur)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        cur.close()
-        conn.close()
+        release_query(conn, cur)
+
+    next_cursor = encode_page_cursor(list(rows[limit - 1][len(selected):])) if len(rows) > limit else None
+    content = {
+        "columns": selected,
+        "data": [row[:len(selected)] for row in rows[:limit]],
+        "next_cursor": next_cursor,
+    }
+    with phase("serialize"):
+        return JSONResponse(content=jsonable_encoder(content))
+
+def build_aggregate_query(spec, fiscal_year, fiscal_period, limit):
+    """Fills an AGGREGATES query with the submission filters as bound parameters."""
+    params = {"limit": limit}
+    conditions = ""
+    if fiscal_year is not None:
+        conditions += " AND s.fy = %(fiscal_year)s"
+        params["fiscal_year"] = fiscal_year
+    if fiscal_period is not None:
+        conditions += " AND s.fp = %(fiscal_period)s"
+        params["fiscal_period"] = fiscal_period
+    tag_filter = AGGREGATE_TAG_FILTER.format(filters=conditions) if conditions else ""
+    return spec["sql"].format(filters=conditions, tag_filter=tag_filter), params
+
+
+@app.get("/stats/{aggregate}")
+async def get_aggregate(
+    aggregate: str,
+    fiscal_year: int = None,
+    fiscal_period: str = Query(None, description="FY, Q1, Q2, Q3 or Q4"),
+    limit: int = Query(None, ge=1, le=AGGREGATE_MAX_LIMIT, description="Top-N groups to return"),
+):
+    """
+    Dashboard aggregations over the full sec_numbers, sec_submissions and sec_tags tables, grouped and
+    ranked in the warehouse so only the top groups are sent. Results are cached until the next data load.
+    """
+    spec = AGGREGATES.get(aggregate)
+    if spec is None:
+        raise HTTPException(status_code=400, detail=f"Invalid aggregate. Must be one of: {', '.join(AGGREGATES)}")
+    if fiscal_period is not None:
+        fiscal_period = fiscal_period.upper()
+    limit = limit or spec["limit"]
+
+    query, params = build_aggregate_query(spec, fiscal_year, fiscal_period, limit)
+    key = ("aggregate", aggregate, fiscal_year, fiscal_period, limit)
+    try:
+        columns, data = await cached(
+            key, lambda: fetch_rows(query, params), tables=spec["tables"], ttl=AGGREGATE_CACHE_TTL_SECONDS,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    with phase("serialize"):
+        return JSONResponse(content=jsonable_encoder({"columns": columns, "data": data}))
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))  # Render dynamically assigns PORT
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -1,16 +1,37 @@
-WITH raw AS (
+WITH source AS (
     SELECT
         company_name,
         fiscal_year,
         fiscal_period,
-        data
+        data,
+        loaded_at
     FROM {{ ref('stg_raw_financials_json') }}
 ),
+{% if is_incremental() %}
+-- Keys with rows loaded since the last run
+new_keys AS (
+    SELECT DISTINCT company_name, fiscal_year, fiscal_period
+    FROM source
+    WHERE loaded_at > (SELECT COALESCE(MAX(loaded_at), '1970-01-01'::TIMESTAMP_LTZ) FROM {{ this }})
+),
+{% endif %}
+raw AS (
+    -- Every row of those keys, whichever load brought it, so the merge replaces each key with its full aggregate
+    SELECT s.*
+    FROM source s
+    {% if is_incremental() %}
+    JOIN new_keys k
+      ON s.company_name IS NOT DISTINCT FROM k.company_name
+     AND s.fiscal_year IS NOT DISTINCT FROM k.fiscal_year
+     AND s.fiscal_period IS NOT DISTINCT FROM k.fiscal_period
+    {% endif %}
+),
 flattened_bs AS (
     SELECT
         r.company_name,
         r.fiscal_year,
         r.fiscal_period,
+        r.loaded_at,
         bs.value AS bs_item
     FROM raw r,
          LATERAL FLATTEN(input => r.data:bs) bs
@@ -29,7 +50,8 @@ aggregated AS (
                 END)
         ) AS total_assets,
         MAX(CASE WHEN bs_item:concept::STRING IN ('Liabilities', 'LiabilitiesCurrent') THEN bs_item:value::NUMBER END) AS total_liabilities,
-        MAX(CASE WHEN bs_item:concept::STRING IN ('StockholdersEquity', 'Equity') THEN bs_item:value::NUMBER END) AS total_equity
+        MAX(CASE WHEN bs_item:concept::STRING IN ('StockholdersEquity', 'Equity') THEN bs_item:value::NUMBER END) AS total_equity,
+        MAX(loaded_at) AS loaded_at
     FROM flattened_bs
     GROUP BY company_name,fiscal_year, fiscal_period
 )
@@ -1,16 +1,37 @@
-WITH raw AS (
+WITH source AS (
     SELECT
         company_name,
         fiscal_year,
         fiscal_period,
-        data
+        data,
+        loaded_at
     FROM {{ ref('stg_raw_financials_json') }}
 ),
+{% if is_incremental() %}
+-- Keys with rows loaded since the last run
+new_keys AS (
+    SELECT DISTINCT company_name, fiscal_year, fiscal_period
+    FROM source
+    WHERE loaded_at > (SELECT COALESCE(MAX(loaded_at), '1970-01-01'::TIMESTAMP_LTZ) FROM {{ this }})
+),
+{% endif %}
+raw AS (
+    -- Every row of those keys, whichever load brought it, so the merge replaces each key with its full aggregate
+    SELECT s.*
+    FROM source s
+    {% if is_incremental() %}
+    JOIN new_keys k
+      ON s.company_name IS NOT DISTINCT FROM k.company_name
+     AND s.fiscal_year IS NOT DISTINCT FROM k.fiscal_year
+     AND s.fiscal_period IS NOT DISTINCT FROM k.fiscal_period
+    {% endif %}
+),
 flattened_cf AS (
     SELECT
         r.company_name,
         r.fiscal_year,
         r.fiscal_period,
+        r.loaded_at,
         cf.value AS cf_item
     FROM raw r,
          LATERAL FLATTEN(input => r.data:cf) cf
@@ -22,7 +43,8 @@ aggregated AS (
         fiscal_period,
         MAX(CASE WHEN cf_item:concept::STRING = 'NetCashProvidedByUsedInOperatingActivities' THEN cf_item:value::NUMBER END) AS operating_cash_flow,
         MAX(CASE WHEN cf_item:concept::STRING = 'NetCashProvidedByUsedInInvestingActivities' THEN cf_item:value::NUMBER END) AS investing_cash_flow,
-        MAX(CASE WHEN cf_item:concept::STRING = 'NetCashProvidedByUsedInFinancingActivities' THEN cf_item:value::NUMBER END) AS financing_cash_flow
+        MAX(CASE WHEN cf_item:concept::STRING = 'NetCashProvidedByUsedInFinancingActivities' THEN cf_item:value::NUMBER END) AS financing_cash_flow,
+        MAX(loaded_at) AS loaded_at
     FROM flattened_cf
     GROUP BY company_name, fiscal_year, fiscal_period
 )
@@ -2,5 +2,6 @@ SELECT
     v:"name"::STRING AS company_name,
     v:"year"::NUMBER AS fiscal_year,
     v:"quarter"::STRING AS fiscal_period,
-    v:"data" AS data
+    v:"data" AS data,
+    loaded_at
 FROM {{ source('raw_data', 'raw_financial_json') }}
\ No newline at end of file
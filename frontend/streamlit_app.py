@@ -1,5 +1,8 @@
+import asyncio
+import threading
+import time
 import streamlit as st
-import requests
+import httpx
 import pandas as pd
 import io
 import plotly.express as px
@@ -8,6 +11,142 @@ import plotly.graph_objects as go
 # Backend FastAPI URL
 BASE_URL = "https://fastapi-service-992661127227.us-central1.run.app"
 
+# Previews only change when a DAG loads new data, so reruns within this window reuse them
+PREVIEW_CACHE_TTL_SECONDS = 600
+# Snapshot file links are presigned for 15 minutes, so they are refetched well before they expire
+SNAPSHOT_LINKS_TTL_SECONDS = 300
+
+# Whole-call timeouts: previews read 20 rows, aggregates scan the full raw tables in the warehouse
+PREVIEW_TIMEOUT_SECONDS = 30
+AGGREGATE_TIMEOUT_SECONDS = 120
+JSON_VIEW_TIMEOUT_SECONDS = 30
+
+DENORMALIZED_TABLES = ["balance_sheet", "income_statement", "cash_flow"]
+RAW_TABLES = ["sec_numbers", "sec_submissions", "sec_tags", "sec_presentation"]
+FISCAL_PERIODS = ["All", "FY", "Q1", "Q2", "Q3", "Q4"]
+
+# Raw table -> /stats aggregate behind its chart
+RAW_AGGREGATES = {"sec_numbers": "top_tags", "sec_submissions": "submissions_by_country", "sec_tags": "tag_datatypes"}
+
+
+class BackendFetcher:
+    """
+    Runs backend GETs concurrently on one pooled httpx.AsyncClient, which lives on a background event loop
+    shared by every session. Each call is kept as a future for PREVIEW_CACHE_TTL_SECONDS, so reruns and
+    prefetched selections reuse it; failed calls are dropped and retried by the next rerun.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="backend-fetcher", daemon=True).start()
+        self._client = asyncio.run_coroutine_threadsafe(self._open_client(), self._loop).result()
+        self._futures = {}  # (path, params) -> (expires_at, future)
+        self._lock = threading.Lock()
+
+    async def _open_client(self):
+        return httpx.AsyncClient(
+            base_url=BASE_URL,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+            transport=httpx.AsyncHTTPTransport(retries=2),
+        )
+
+    async def _get(self, path, params, timeout):
+        response = await asyncio.wait_for(self._client.get(path, params=params, timeout=timeout), timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch(self, path, params=None, timeout=PREVIEW_TIMEOUT_SECONDS, ttl=PREVIEW_CACHE_TTL_SECONDS):
+        """Starts the GET for path and params, or reuses the one in flight or cached for ttl; returns its future."""
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        key = (path, tuple(sorted(params.items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._futures.get(key)
+            if entry is not None and entry[0] > now and not (entry[1].done() and entry[1].exception()):
+                return entry[1]
+            for stale in [k for k, (expires_at, _) in self._futures.items() if expires_at <= now]:
+                del self._futures[stale]
+            future = asyncio.run_coroutine_threadsafe(self._get(path, params, timeout), self._loop)
+            self._futures[key] = (now + ttl, future)
+            return future
+
+
+@st.cache_resource
+def get_fetcher():
+    return BackendFetcher()
+
+
+def fetch_preview(kind, table):
+    return get_fetcher().fetch(f"/{kind}/preview/{table}")
+
+
+def fetch_aggregate(aggregate, fiscal_year=None, fiscal_period=None):
+    params = {"fiscal_year": fiscal_year, "fiscal_period": fiscal_period}
+    return get_fetcher().fetch(f"/stats/{aggregate}", params, timeout=AGGREGATE_TIMEOUT_SECONDS)
+
+
+def fetch_snapshot(table):
+    return get_fetcher().fetch(f"/snapshots/{table}", {"format": "csv"}, ttl=SNAPSHOT_LINKS_TTL_SECONDS)
+
+
+def download_buttons(kind, table, label):
+    """
+    One link per file when the table's CSV snapshot is split over several, so the browser fetches each
+    straight from S3; otherwise the download endpoint, which redirects to a single-file snapshot or
+    streams the table live.
+    """
+    snapshot = wait_for(fetch_snapshot(table), "Checking for a snapshot ...")
+    files = snapshot["files"] if snapshot is not None else []
+    if len(files) <= 1:
+        st.link_button(label, f"{BASE_URL}/{kind}/download/{table}")
+        return
+    st.caption(f"The full table is split into {len(files)} gzipped CSV files, each with a header row.")
+    for part, snapshot_file in enumerate(files, start=1):
+        size_mb = snapshot_file["size"] / (1024 * 1024)
+        st.link_button(f"{label} (part {part} of {len(files)}, {size_mb:,.0f} MB)", snapshot_file["url"])
+
+
+def wait_for(future, message):
+    """Shows message in a placeholder until the call finishes; returns its JSON, or None if it failed."""
+    placeholder = st.empty()
+    if not future.done():
+        placeholder.info(message)
+    try:
+        return future.result()
+    except (httpx.HTTPError, ValueError, asyncio.TimeoutError):
+        return None
+    finally:
+        placeholder.empty()
+
+
+def aggregate_frame(payload):
+    if payload is None:
+        return None
+    return pd.DataFrame(payload.get("data"), columns=payload.get("columns"))
+
+
+def aggregate_filters():
+    """The raw tab's fiscal year/period filters, from the widgets' session state."""
+    fiscal_year = st.session_state.get("fiscal_year")
+    fiscal_period = st.session_state.get("fiscal_period", "All")
+    return (int(fiscal_year) if fiscal_year is not None else None), (None if fiscal_period == "All" else fiscal_period)
+
+
+# Start every call this run renders at once, so a rerun waits for the slowest call rather than their sum,
+# then prefetch the other selections' previews so switching tables doesn't cost a round trip
+denorm_selected = st.session_state.get("denorm_table", DENORMALIZED_TABLES[0])
+raw_selected = st.session_state.get("raw_table", RAW_TABLES[0])
+fetch_preview("denormalized", denorm_selected)
+fetch_preview("normalized", raw_selected)
+fetch_snapshot(denorm_selected)
+fetch_snapshot(raw_selected)
+if raw_selected in RAW_AGGREGATES:
+    fetch_aggregate(RAW_AGGREGATES[raw_selected], *aggregate_filters())
+for table in DENORMALIZED_TABLES:
+    fetch_preview("denormalized", table)
+for table in RAW_TABLES:
+    fetch_preview("normalized", table)
+
 # Streamlit App Title
 st.title("📊 SEC Financial Data")
 st.header("Assignment 2 - Team 6")
@@ -18,11 +157,10 @@ with tab_json:
     # Fetch JSON Data from View
     st.header("📄 View JSON")
     if st.button("Fetch JSON Data"):
-        url = f"{BASE_URL}/json_view/"
-        response = requests.get(url)
+        payload = wait_for(get_fetcher().fetch("/json_view/", timeout=JSON_VIEW_TIMEOUT_SECONDS), "Fetching JSON data ...")
 
-        if response.status_code == 200:
-            data = response.json()["json_view_data"]
+        if payload is not None:
+            data = payload["json_view_data"]
             df = pd.DataFrame(data)
 
             # Limit displayed data to 100 rows
@@ -49,17 +187,13 @@ with tab_denorm:
     st.header("Denormalized Tables Preview & Visualizations")
     
     # Create a dropdown for table selection
-    table_choice = st.selectbox("Select Table", ["balance_sheet", "income_statement", "cash_flow"])
+    table_choice = st.selectbox("Select Table", DENORMALIZED_TABLES, key="denorm_table")
     
-    # Build the preview endpoint. Here we assume your FastAPI endpoint is of the form:
-    #   GET /denormalized/preview/<table_name>
-    preview_endpoint = f"{BASE_URL}/denormalized/preview/{table_choice}"
-    
-    st.info(f"Fetching preview data for **{table_choice}** ...")
-    response = requests.get(preview_endpoint)
-    if response.status_code == 200:
-        data = response.json().get("data")
-        columns = response.json().get("columns")
+    # GET /denormalized/preview/<table_name>, already in flight or prefetched
+    payload = wait_for(fetch_preview("denormalized", table_choice), f"Fetching preview data for {table_choice} ...")
+    if payload is not None:
+        data = payload.get("data")
+        columns = payload.get("columns")
         df = pd.DataFrame()
         if columns and data:
             df = pd.DataFrame(data,columns=columns)
@@ -151,32 +285,22 @@ with tab_denorm:
     else:
         st.error("Failed to load preview data.")
     
-    # Optionally, add a download button using an endpoint for the full file.
-    download_url = f"{BASE_URL}/denormalized/download/{table_choice}"
-    csv_data = requests.get(download_url).content
-    st.download_button(
-        label="Download Full Data as CSV",
-        data=csv_data,
-        file_name=f"{table_choice}.csv",
-        mime="text/csv"
-    )
+    # The browser downloads the full file straight from the backend (or its S3 snapshot) on click,
+    # so nothing is transferred until the user asks for it and the app never holds the table
+    download_buttons("denormalized", table_choice, "Download Full Data as CSV")
 
 with tab_raw:
     st.header("Raw Data Preview & Visualizations")
 
     # Create a dropdown for selecting raw data tables
-    raw_tables = ["sec_numbers", "sec_submissions", "sec_tags", "sec_presentation"]
-    table_choice_raw = st.selectbox("Select Raw Data Table", raw_tables)
-
-    # Build the preview endpoint
-    preview_endpoint_raw = f"{BASE_URL}/normalized/preview/{table_choice_raw}"
+    table_choice_raw = st.selectbox("Select Raw Data Table", RAW_TABLES, key="raw_table")
 
-    st.info(f"Fetching preview data for **{table_choice_raw}** ...")
-    response = requests.get(preview_endpoint_raw)
+    # GET /normalized/preview/<table_name>, already in flight or prefetched
+    payload = wait_for(fetch_preview("normalized", table_choice_raw), f"Fetching preview data for {table_choice_raw} ...")
 
-    if response.status_code == 200:
-        data = response.json().get("data")
-        columns = response.json().get("columns")
+    if payload is not None:
+        data = payload.get("data")
+        columns = payload.get("columns")
         df = pd.DataFrame()
 
         if columns and data:
@@ -186,30 +310,38 @@ with tab_raw:
         else:
             st.warning("No data available to display")
 
-        # Visualizations based on table selection
+        # Visualizations are aggregated in the warehouse over the full tables, not the preview rows
+        if table_choice_raw in RAW_AGGREGATES:
+            filter_year, filter_period = st.columns(2)
+            filter_year.number_input("Fiscal Year", min_value=2000, max_value=2100, value=None, step=1, key="fiscal_year")
+            filter_period.selectbox("Fiscal Period", FISCAL_PERIODS, key="fiscal_period")
+            aggregate_payload = wait_for(
+                fetch_aggregate(RAW_AGGREGATES[table_choice_raw], *aggregate_filters()),
+                f"Aggregating {table_choice_raw} in the warehouse ...",
+            )
+
         viz_placeholder = st.empty()
         if table_choice_raw == "sec_numbers":
-            if not df.empty and {"TAG", "VALUE"}.issubset(set(df.columns)):
-                viz_placeholder.subheader("Top 10 Reported Values by Tag")
-                
-                top_tags = df.groupby("TAG")["VALUE"].sum().nlargest(10).reset_index()
+            top_tags = aggregate_frame(aggregate_payload)
+            if top_tags is not None and not top_tags.empty:
+                tag_column, value_column = top_tags.columns
                 fig = px.bar(
                     top_tags,
-                    x="TAG",
-                    y="VALUE",
+                    x=tag_column,
+                    y=value_column,
                     title="Top 10 SEC Reported Values",
-                    labels={"VALUE": "Reported Value", "TAG": "Tag"},
+                    labels={value_column: "Reported Value", tag_column: "Tag"},
                 )
                 fig.update_layout(width=600, height=500)
-                viz_placeholder.plotly_chart(fig)
+                with viz_placeholder.container():
+                    st.subheader("Top 10 Reported Values by Tag")
+                    st.plotly_chart(fig)
             else:
-                viz_placeholder.warning("Required columns not available for sec_numbers visualization.")
+                viz_placeholder.warning("No data available for sec_numbers visualization.")
 
         elif table_choice_raw == "sec_submissions":
-            if not df.empty and {"COUNTRYBA"}.issubset(set(df.columns)):
-                viz_placeholder.subheader("Submissions by Country")
-                
-                country_counts = df["COUNTRYBA"].value_counts().reset_index()
+            country_counts = aggregate_frame(aggregate_payload)
+            if country_counts is not None and not country_counts.empty:
                 country_counts.columns = ["Country", "Submissions"]
                 
                 fig = px.pie(
@@ -219,15 +351,15 @@ with tab_raw:
                     title="SEC Submissions by Country",
                 )
                 fig.update_layout(width=500, height=500)
-                viz_placeholder.plotly_chart(fig)
+                with viz_placeholder.container():
+                    st.subheader("Submissions by Country")
+                    st.plotly_chart(fig)
             else:
-                viz_placeholder.warning("Required columns not available for sec_submissions visualization.")
+                viz_placeholder.warning("No data available for sec_submissions visualization.")
 
         elif table_choice_raw == "sec_tags":
-            if not df.empty and {"DATATYPE"}.issubset(set(df.columns)):
-                viz_placeholder.subheader("Tag Data Types Distribution")
-                
-                datatype_counts = df["DATATYPE"].value_counts().reset_index()
+            datatype_counts = aggregate_frame(aggregate_payload)
+            if datatype_counts is not None and not datatype_counts.empty:
                 datatype_counts.columns = ["Data Type", "Count"]
                 
                 fig = px.bar(
@@ -238,20 +370,15 @@ with tab_raw:
                     labels={"Count": "Number of Tags"},
                 )
                 fig.update_layout(width=600, height=500)
-                viz_placeholder.plotly_chart(fig)
+                with viz_placeholder.container():
+                    st.subheader("Tag Data Types Distribution")
+                    st.plotly_chart(fig)
             else:
-                viz_placeholder.warning("Required columns not available for sec_tags visualization.")
+                viz_placeholder.warning("No data available for sec_tags visualization.")
         else: viz_placeholder.error("No Visulizations for this table")
 
     else:
         st.error("Failed to load preview data.")
 
-    # Download Button
-    download_url_raw = f"{BASE_URL}/normalized/download/{table_choice_raw}"
-    csv_data_raw = requests.get(download_url_raw).content
-    st.download_button(
-        label="Download Full Raw Data as CSV",
-        data=csv_data_raw,
-        file_name=f"{table_choice_raw}.csv",
-        mime="text/csv"
-    )
\ No newline at end of file
+    # Download Button: fetched by the browser only when clicked
+    download_buttons("normalized", table_choice_raw, "Download Full Raw Data as CSV")
\ No newline at end of file
@@ -1,47 +1,111 @@
 import os
-import io
+import shutil
+import tempfile
 import zipfile
-from s3_utils import list_files_in_s3, s3_client
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from s3_utils import (
+    list_objects_with_metadata, list_prefixes, load_manifest, save_manifest,
+    manifest_is_current, record_manifest_quarter, invalidate_listing_cache, S3RangeReader,
+)
+from s3_transfer import upload_many
 
 S3_ZIP_FOLDER = "sec_raw_zips/"
 S3_EXTRACT_FOLDER = "sec_extracted_tsv/"
 
+# Recorded in the extract manifest; bump whenever the files extracted from the same ZIP change
+EXTRACTOR_VERSION = "1"
+EXTRACT_MANIFEST = "data_extractor"
+
+# Members of one ZIP that are decompressed and uploaded at the same time
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", 4))
+
+# Bytes moved per read from the decompressed member stream to the local file
+STREAM_COPY_SIZE = 1024 * 1024
+
+# Where a quarter's members are decompressed before upload (the system temp dir by default)
+EXTRACT_TMP_DIR = os.getenv("EXTRACT_TMP_DIR") or None
+
+def extract_member(s3_zip_path, member, local_path):
+    """Streams one ZIP member from S3 through the decompressor into a local file."""
+    # Each member gets its own reader, so concurrent members do not fight over one file position
+    with zipfile.ZipFile(S3RangeReader(s3_zip_path), "r") as z:
+        with z.open(member) as source, open(local_path, "wb") as target:
+            shutil.copyfileobj(source, target, STREAM_COPY_SIZE)
+
 def extract_quarterly(zip_filename):
-    """Extracts a ZIP file directly from S3 and stores extracted TSVs in quarter-wise folders in S3."""
+    """
+    Extracts a ZIP file directly from S3 and stores extracted TSVs in quarter-wise folders in S3.
+    The archive is never downloaded whole: the central directory and member data are read with ranged
+    GETs and each member is decompressed to a local file, up to EXTRACT_CONCURRENCY members at a time.
+    The files are then sent with upload_many, so a failed upload is retried from disk rather than by
+    reading the archive again. Returns the S3 keys of the extracted files.
+    """
     s3_zip_path = os.path.join(S3_ZIP_FOLDER, zip_filename)
 
-    # Download ZIP file into memory
-    zip_obj = s3_client.get_object(Bucket=os.getenv("S3_BUCKET_NAME"), Key=s3_zip_path)
-    zip_data = io.BytesIO(zip_obj['Body'].read())  # Load into memory
-
     # Get quarter folder name from ZIP filename (e.g., "2024q1")
     quarter_folder = zip_filename.replace(".zip", "")
 
-    with zipfile.ZipFile(zip_data, "r") as z:
-        for extracted_file in z.namelist():
-            file_data = z.read(extracted_file)  # Read file into memory
-            
-            # 🔹 FIX: Ensure correct folder structure by explicitly adding a `/`
-            s3_file_path = f"{S3_EXTRACT_FOLDER}{quarter_folder}/{extracted_file}"
+    with zipfile.ZipFile(S3RangeReader(s3_zip_path), "r") as z:
+        members = [info.filename for info in z.infolist() if not info.is_dir()]
+
+    # 🔹 FIX: Ensure correct folder structure by explicitly adding a `/`
+    extracted_keys = [f"{S3_EXTRACT_FOLDER}{quarter_folder}/{member}" for member in members]
 
-            # Upload extracted file to S3
-            s3_client.put_object(Bucket=os.getenv("S3_BUCKET_NAME"), Key=s3_file_path, Body=file_data)
-            print(f"Uploaded: {s3_file_path} to S3.")
+    with tempfile.TemporaryDirectory(prefix=f"{quarter_folder}-", dir=EXTRACT_TMP_DIR) as local_dir:
+        # Local files are numbered, so member names never become paths on this machine
+        local_paths = [os.path.join(local_dir, str(i)) for i in range(len(members))]
+        with ThreadPoolExecutor(max_workers=EXTRACT_CONCURRENCY) as executor:
+            list(executor.map(lambda item: extract_member(s3_zip_path, *item), zip(members, local_paths)))
+
+        stats = upload_many(list(zip(local_paths, extracted_keys)))
+    invalidate_listing_cache(f"{S3_EXTRACT_FOLDER}{quarter_folder}/")
+
+    if stats.failures:
+        raise RuntimeError(f"{len(stats.failures)} of {len(members)} files extracted from {zip_filename} failed to upload")
 
     print(f"Finished processing: {zip_filename}")
+    return extracted_keys
 
-def extract_all_quarters():
-    """Fetches ZIP files from S3 and extracts them to quarter-wise folders in S3."""
-    zip_files = [file.split("/")[-1] for file in list_files_in_s3(S3_ZIP_FOLDER) if file.endswith(".zip")]
+def extract_all_quarters(force=False, only=None):
+    """
+    Fetches ZIP files from S3 and extracts them to quarter-wise folders in S3.
+    ZIPs whose ETag/size and extractor version match the extract manifest, and whose extracted files
+    still exist, are skipped unless force is set; `only` restricts the run to the given quarters.
+    """
+    # List the ZIPs and the already extracted files in one parallel, cached pass
+    list_prefixes([S3_ZIP_FOLDER, S3_EXTRACT_FOLDER])
+    zip_objects = {key: meta for key, meta in list_objects_with_metadata(S3_ZIP_FOLDER).items() if key.endswith(".zip")}
+    zip_files = [key.split("/")[-1] for key in zip_objects]
 
     if not zip_files:
         print("⚠ No ZIP files found in S3!")
         return
 
+    if only:
+        zip_files = [zip_file for zip_file in zip_files if zip_file.replace(".zip", "") in only]
+
+    manifest = load_manifest(EXTRACT_MANIFEST)
+    existing_keys = list_objects_with_metadata(S3_EXTRACT_FOLDER)
+
     for zip_file in zip_files:
-        extract_quarterly(zip_file)
+        quarter = zip_file.replace(".zip", "")
+        sources = {zip_file: zip_objects[f"{S3_ZIP_FOLDER}{zip_file}"]}
+
+        if not force and manifest_is_current(manifest, quarter, sources, EXTRACTOR_VERSION, existing_keys):
+            print(f"Skipping {zip_file}: unchanged since the last extraction.")
+            continue
+
+        extracted_keys = extract_quarterly(zip_file)
+        record_manifest_quarter(manifest, quarter, sources, EXTRACTOR_VERSION, extracted_keys)
+        save_manifest(EXTRACT_MANIFEST, manifest)
 
     print("All ZIP files extracted and TSV files uploaded to quarter-wise folders in S3.")
 
 if __name__ == "__main__":
-    extract_all_quarters()
+    parser = argparse.ArgumentParser(description="Extract SEC quarterly ZIPs from S3 into per-quarter TSV folders.")
+    parser.add_argument("--force", action="store_true", help="Re-extract ZIPs even if the manifest says they are current")
+    parser.add_argument("--only", action="append", metavar="QUARTER", help="Only extract this quarter (e.g. 2024q1); repeatable")
+    args = parser.parse_args()
+
+    extract_all_quarters(force=args.force, only=args.only)
@@ -1,19 +1,111 @@
 import os
+import json
 import requests
+from html.parser import HTMLParser
+from urllib.parse import urljoin
 from tqdm import tqdm
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-from s3_utils import upload_file_to_s3, delete_local_file
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from s3_utils import s3_client, S3_BUCKET_NAME, S3MultipartWriter
 
 # SEC Financial Statement Data URL
 SEC_URL = "https://www.sec.gov/data-research/sec-markets-data/financial-statement-data-sets"
 S3_ZIP_FOLDER = "sec_raw_zips/"
 
-def get_zip_links():
+HEADERS = {"User-Agent": os.getenv("SEC_USER_AGENT", "Mozilla/5.0 (Windows NT 10.0; Win64; x64)")}
+
+# "http" fetches the page and parses anchors directly; "selenium" drives headless Chrome (needs selenium installed)
+LINK_DISCOVERY = os.getenv("LINK_DISCOVERY", "http")
+
+# Last discovered link list with the page's ETag/Last-Modified, for conditional requests
+LINK_CACHE_PATH = os.getenv("LINK_CACHE_PATH", ".sec_zip_links.json")
+
+# Archives downloaded at once, bytes per HTTP read, and resume attempts before an archive is given up
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", 4))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+DOWNLOAD_MAX_RETRIES = int(os.getenv("DOWNLOAD_MAX_RETRIES", 5))
+DOWNLOAD_TIMEOUT = 60
+
+class ZipLinkParser(HTMLParser):
+    """Collects anchor hrefs matching //a[contains(@href, 'financial-statement-data-sets/') and contains(@href, '.zip')]."""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        href = dict(attrs).get("href")
+        if href and "financial-statement-data-sets/" in href and ".zip" in href:
+            # Absolute, like Selenium's get_attribute("href")
+            self.links.append(urljoin(self.base_url, href))
+
+def parse_zip_links(html, base_url=SEC_URL):
+    """Extracts the quarterly ZIP links from the data sets page HTML."""
+    parser = ZipLinkParser(base_url)
+    parser.feed(html)
+    parser.close()
+    return parser.links
+
+def load_link_cache():
+    """Reads the cached link list and validators, or an empty cache."""
+    try:
+        with open(LINK_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_link_cache(cache):
+    """Replaces the link cache file in one rename, so a crash never leaves it half written."""
+    tmp_path = f"{LINK_CACHE_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, LINK_CACHE_PATH)
+
+def get_zip_links_http(session=None, url=SEC_URL):
+    """
+    Fetches the SEC page with a plain GET and parses the ZIP links. Sends If-None-Match/If-Modified-Since
+    from the link cache and reuses the cached list when the page answers 304 Not Modified.
+    """
+    session = session or requests.Session()
+    cache = load_link_cache()
+    if cache.get("url") != url:
+        cache = {}
+
+    headers = dict(HEADERS)
+    if cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    print("Accessing SEC website...")
+    response = session.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+    if response.status_code == 304 and "links" in cache:
+        print("SEC page not modified; using cached ZIP links.")
+        return cache["links"]
+    response.raise_for_status()
+
+    zip_links = parse_zip_links(response.text, response.url or url)
+    if zip_links:
+        save_link_cache({
+            "url": url,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "links": zip_links,
+        })
+    return zip_links
+
+def get_zip_links_selenium():
     """Uses Selenium to scrape ZIP file links from the SEC website."""
+    # Imported here so the default HTTP discovery runs without Chrome or selenium installed
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.chrome.options import Options
+    from webdriver_manager.chrome import ChromeDriverManager
+
     chrome_options = Options()
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
@@ -32,6 +124,14 @@ def get_zip_links():
     #zip_links = [link.get_attribute("href") for link in driver.find_elements(By.XPATH, "//a[contains(@href, '.zip')]")]
     zip_links = [link.get_attribute("href") for link in driver.find_elements(By.XPATH, "//a[contains(@href, 'financial-statement-data-sets/') and contains(@href, '.zip')]")]
     driver.quit()
+    return zip_links
+
+def get_zip_links():
+    """Collects the ZIP file links from the SEC website with the configured LINK_DISCOVERY mode."""
+    if LINK_DISCOVERY == "selenium":
+        zip_links = get_zip_links_selenium()
+    else:
+        zip_links = get_zip_links_http()
 
     if zip_links:
         print(f"Found {len(zip_links)} ZIP files.")
@@ -40,24 +140,102 @@ def get_zip_links():
 
     return zip_links
 
-def download_and_upload_zip(url):
-    """Downloads a ZIP file and uploads it to S3."""
+def get_archive_info(url, session):
+    """Returns (size, Last-Modified) of a remote archive from a HEAD request, or None if it is not available."""
+    response = session.head(url, headers=HEADERS, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    if response.status_code != 200:
+        return None
+
+    size = response.headers.get("content-length")
+    return (int(size) if size is not None else None), response.headers.get("last-modified")
+
+def s3_archive_is_current(s3_path, size, last_modified):
+    """True when S3 already holds this archive with the same size and source Last-Modified."""
+    try:
+        head = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_path)
+    except ClientError:
+        return False
+    return (
+        size is not None
+        and last_modified is not None
+        and head["ContentLength"] == size
+        and head.get("Metadata", {}).get("source-last-modified") == last_modified
+    )
+
+def stream_archive(url, session, writer, size, bar):
+    """
+    Copies an archive from HTTP into writer, resuming with a Range request after a dropped connection
+    instead of starting over. Gives up after DOWNLOAD_MAX_RETRIES consecutive failures.
+    """
+    received = 0
+    failures = 0
+    while size is None or received < size:
+        headers = dict(HEADERS)
+        if received:
+            headers["Range"] = f"bytes={received}-"
+
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+
+                # A server that ignores Range resends the whole file; drop what was already written
+                skip = received if received and response.status_code != 206 else 0
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                    writer.write(chunk)
+                    received += len(chunk)
+                    bar.update(len(chunk))
+                    failures = 0
+
+            if size is None:
+                break
+            if received < size:
+                raise requests.exceptions.ConnectionError(f"connection closed at {received} of {size} bytes")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            failures += 1
+            if failures > DOWNLOAD_MAX_RETRIES:
+                raise
+            print(f"Resuming {url} at byte {received} after error: {e}")
+
+    return received
+
+def download_and_upload_zip(url, session=None):
+    """
+    Streams a ZIP file straight from the SEC site into a multipart upload in S3, with no local copy.
+    Archives already in S3 with the same size and Last-Modified are skipped.
+    """
+    session = session or requests.Session()
     filename = url.split("/")[-1]
-    
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
-    response = requests.get(url, headers=headers, stream=True)
-
-    if response.status_code == 200:
-        with open(filename, "wb") as file, tqdm(desc=filename, total=int(response.headers.get("content-length", 0)), unit="B", unit_scale=True) as bar:
-            for chunk in response.iter_content(chunk_size=1024):
-                file.write(chunk)
-                bar.update(len(chunk))
-        print(f"Downloaded: {filename}")
-
-        upload_file_to_s3(filename, os.path.join(S3_ZIP_FOLDER, filename))
-        delete_local_file(filename)
-    else:
+    s3_path = os.path.join(S3_ZIP_FOLDER, filename)
+
+    info = get_archive_info(url, session)
+    if info is None:
         print(f"Failed to download: {url}")
+        return
+    size, last_modified = info
+
+    if s3_archive_is_current(s3_path, size, last_modified):
+        print(f"Skipping {filename}: already in S3 and unchanged.")
+        return
+
+    metadata = {"source-last-modified": last_modified} if last_modified else {}
+    try:
+        with S3MultipartWriter(s3_path, content_type="application/zip", metadata=metadata) as writer, \
+                tqdm(desc=filename, total=size, unit="B", unit_scale=True) as bar:
+            stream_archive(url, session, writer, size, bar)
+        print(f"Uploaded: {s3_path} to S3.")
+    except Exception as e:
+        print(f"Failed to download: {url} ({e})")
+
+def create_download_session():
+    """A requests session whose connection pool matches DOWNLOAD_CONCURRENCY."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=DOWNLOAD_CONCURRENCY, pool_maxsize=DOWNLOAD_CONCURRENCY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 def scrape_and_download():
     """Scrape SEC ZIP links and upload them to S3."""
@@ -67,8 +245,9 @@ def scrape_and_download():
         print("No ZIP files found! Exiting...")
         return
 
-    for zip_url in zip_links:
-        download_and_upload_zip(zip_url)
+    session = create_download_session()
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+        list(executor.map(lambda zip_url: download_and_upload_zip(zip_url, session), zip_links))
 
     print("All ZIP files uploaded to S3!")
 
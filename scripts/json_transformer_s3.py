@@ -1,24 +1,193 @@
 import os
 import io
+import math
+import heapq
+import pickle
+import shutil
+import zlib
+import tempfile
+import textwrap
+import numpy as np
 import pandas as pd
 import json
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-from s3_utils import list_folders_in_s3, s3_client, list_files_in_s3
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+import argparse
+from s3_utils import (
+    list_folders_in_s3, s3_client, list_files_in_s3, S3MultipartWriter, list_objects_with_metadata, list_prefixes,
+    load_manifest, save_manifest, manifest_is_current, record_manifest_quarter,
+)
 
 # S3 Paths
 S3_EXTRACT_FOLDER = "sec_extracted_tsv/"
 S3_JSON_FOLDER = "sec_json_data/"
 
-def read_tsv_from_s3(s3_path):
-    """Reads a TSV file from S3 into a Pandas DataFrame."""
+# Recorded in the transform manifest; bump whenever the JSON produced from the same TSVs changes
+TRANSFORMER_VERSION = "2"
+TRANSFORM_MANIFEST = "json_transformer"
+
+# "vectorized" joins num/pre/tag once per quarter; "legacy" maps process_sub_row over every submission
+TRANSFORM_ENGINE = os.getenv("TRANSFORM_ENGINE", "vectorized")
+
+# "json" writes one indented JSON array per quarter; "ndjson" streams one record per line to <quarter>.ndjson
+JSON_OUTPUT_FORMAT = os.getenv("JSON_OUTPUT_FORMAT", "json")
+
+# "memory" loads whole TSVs per quarter; "chunked" streams num/pre into adsh-partitioned spill files
+PROCESSING_MODE = os.getenv("PROCESSING_MODE", "memory")
+
+# Chunked mode: target working set per partition, rows per read_csv chunk and where spill files go
+TRANSFORM_MEMORY_BUDGET_MB = int(os.getenv("TRANSFORM_MEMORY_BUDGET_MB", 1024))
+TSV_CHUNK_ROWS = int(os.getenv("TSV_CHUNK_ROWS", 500_000))
+TRANSFORM_SPILL_DIR = os.getenv("TRANSFORM_SPILL_DIR") or None
+
+# Rough peak memory of transforming a partition per byte of raw num.txt + pre.txt (merge + Python entry dicts)
+PARTITION_MEMORY_FACTOR = 3
+
+# Upper bound on partitions, since spilling keeps one open file per partition
+MAX_SPILL_PARTITIONS = 256
+
+# "sharded" splits every quarter's submissions across one shared process pool; "quarter" runs one task per quarter
+WORKER_MODEL = os.getenv("WORKER_MODEL", "sharded")
+
+# Shards per worker process, so uneven shards still keep every core busy until the quarter finishes
+SHARDS_PER_WORKER = int(os.getenv("SHARDS_PER_WORKER", 4))
+
+# Staged Arrow files for shard workers, in the system temp dir by default. Workers memory-map them, so
+# their pages are shared through the page cache; /dev/shm also works but is 64 MB in Docker by default
+SHARED_STAGE_DIR = os.getenv("SHARED_STAGE_DIR") or None
+
+# Parser for the typed TSV loader: "c" (pandas default) or "pyarrow" (multi-threaded, needs pyarrow installed)
+TSV_PARSE_ENGINE = os.getenv("TSV_PARSE_ENGINE", "c")
+
+# Strings pandas.read_csv treats as missing by default, reused so the pyarrow reader agrees with it
+PANDAS_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+# Columns the transformer reads from each quarter file and their in-memory dtypes.
+# Unused columns (footnote, doc, plabel, ...) are never parsed; repeated codes are stored as categories.
+TSV_SCHEMAS = {
+    "sub.txt": {"adsh": str, "name": str, "countryba": str, "cityba": str, "fy": str, "fp": str},
+    "num.txt": {"adsh": "category", "tag": "category", "uom": "category", "value": "float64"},
+    "pre.txt": {"adsh": "category", "tag": "category", "stmt": "category"},
+    "tag.txt": {"tag": str, "tlabel": str},
+}
+
+# Columns parsed as float64 first; if the parser rejects any token (not a number, or an overflowing literal
+# like 1e400), the file is read again with them as text and converted with Python's float(), exactly like
+# the str values safe_int used to see, so a bad token only affects its own row (0, or dropping its
+# submission) instead of failing the whole file. Chunked mode always takes the text path, chunk by chunk.
+FLOAT_TEXT_COLUMNS = ["value"]
+
+# Statement codes from pre.txt and the JSON keys they are written under
+STATEMENT_KEYS = {"BS": "bs", "CF": "cf", "IC": "ic"}
+
+def read_tsv_from_s3(s3_path, schema=None):
+    """
+    Reads a TSV file from S3 into a Pandas DataFrame.
+    Without a schema every column is read as str; with one (see TSV_SCHEMAS) only the listed
+    columns are parsed, with the given dtypes, streaming straight from the S3 response body.
+    """
     try:
         obj = s3_client.get_object(Bucket=os.getenv("S3_BUCKET_NAME"), Key=s3_path)
-        return pd.read_csv(io.BytesIO(obj["Body"].read()), sep="\t", dtype=str)
+        if schema is None:
+            return pd.read_csv(io.BytesIO(obj["Body"].read()), sep="\t", dtype=str)
+
+        try:
+            return parse_typed_tsv(obj["Body"], schema, float_text=False)
+        except ValueError as e:
+            if not any(column in schema for column in FLOAT_TEXT_COLUMNS):
+                raise
+            print(f"{s3_path} has values float64 parsing rejects ({e}); reading them as text")
+            obj = s3_client.get_object(Bucket=os.getenv("S3_BUCKET_NAME"), Key=s3_path)
+            return parse_typed_tsv(obj["Body"], schema, float_text=True)
     except Exception as e:
         print(f"Error reading {s3_path} from S3: {e}")
         return pd.DataFrame()
 
+def parse_typed_tsv(body, schema, float_text):
+    """Parses a TSV stream with the schema's dtypes, keeping FLOAT_TEXT_COLUMNS as text first if float_text is set."""
+    if TSV_PARSE_ENGINE == "pyarrow":
+        return read_tsv_with_pyarrow(body, schema, float_text)
+
+    # round_trip parses with Python's own strtod, so every value equals float() of its token
+    df = pd.read_csv(body, sep="\t", usecols=list(schema), dtype=read_dtypes(schema, float_text), float_precision="round_trip")
+    return convert_float_text(df, schema) if float_text else df
+
+def read_dtypes(schema, float_text=True):
+    """The dtypes to parse a schema's columns with; with float_text, FLOAT_TEXT_COLUMNS stay text until convert_float_text."""
+    return {column: (str if float_text and column in FLOAT_TEXT_COLUMNS else dtype) for column, dtype in schema.items()}
+
+def parse_float(text):
+    """float() of a raw value; NaN when it is not a number, which safe_int turns into 0 like the raw text."""
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+def convert_float_text(df, schema):
+    """Converts the FLOAT_TEXT_COLUMNS of a freshly parsed frame to float64, parsing each distinct token once."""
+    for column in FLOAT_TEXT_COLUMNS:
+        if column in schema and column in df:
+            codes, uniques = pd.factorize(df[column])
+            # Missing values get code -1, i.e. the trailing NaN
+            converted = np.array([parse_float(value) for value in uniques] + [np.nan], dtype=np.float64)
+            df[column] = converted[codes]
+    return df
+
+def arrow_schema(schema):
+    """Translates a TSV_SCHEMAS entry into the equivalent pyarrow schema."""
+    arrow_types = {"category": pa.dictionary(pa.int32(), pa.string()), "float64": pa.float64(), str: pa.string()}
+    return pa.schema([(column, arrow_types[dtype]) for column, dtype in schema.items()])
+
+def arrow_to_pandas(table, schema):
+    """Converts an Arrow table to pandas with the same missing-value representation as read_csv."""
+    df = table.to_pandas()
+
+    # Arrow hands back missing strings as None; the transformer relies on NaN like the pandas path
+    for column, dtype in schema.items():
+        if dtype is str:
+            df[column] = df[column].where(df[column].notna(), np.nan)
+    return df
+
+def read_tsv_with_pyarrow(body, schema, float_text=True):
+    """Parses a TSV stream with pyarrow's multi-threaded reader, giving the same values as the pandas path."""
+    if pa_csv is None:
+        raise ImportError("TSV_PARSE_ENGINE=pyarrow requires the pyarrow package")
+
+    # Declare every type up front: pandas' pyarrow engine infers first, which turns an adsh like "0001" into "1"
+    table = pa_csv.read_csv(
+        body,
+        parse_options=pa_csv.ParseOptions(delimiter="\t"),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=list(schema),
+            column_types=arrow_schema(read_dtypes(schema, float_text)),
+            null_values=PANDAS_NA_VALUES,
+            strings_can_be_null=True,
+        ),
+    )
+    df = arrow_to_pandas(table, read_dtypes(schema, float_text))
+    return convert_float_text(df, schema) if float_text else df
+
+def table_memory_mb(df):
+    """Returns the in-memory size of a DataFrame in MB, including string and category payloads."""
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+def load_quarter_tables(quarter_s3_path):
+    """Loads sub/num/pre/tag for a quarter with the compact TSV_SCHEMAS and reports memory per table."""
+    tables = {}
+    for file_name, schema in TSV_SCHEMAS.items():
+        df = read_tsv_from_s3(f"{quarter_s3_path}{file_name}", schema)
+        print(f"Loaded {file_name}: {len(df)} rows, {table_memory_mb(df):.1f} MB")
+        tables[file_name] = df
+    return tables["sub.txt"], tables["num.txt"], tables["pre.txt"], tables["tag.txt"]
+
 def safe_int(value, default=0):
     """Safely converts a value to int, handling NaN values."""
     try:
@@ -26,6 +195,13 @@ def safe_int(value, default=0):
     except ValueError:
         return default
 
+def safe_int_or_none(value):
+    """Like safe_int, but returns None for infinite values instead of raising OverflowError."""
+    try:
+        return safe_int(value)
+    except OverflowError:
+        return None
+
 def process_sub_row(sub_row, dfNum, dfPre, dfTag):
     """Processes a single submission row into JSON format."""
     try:
@@ -69,57 +245,459 @@ def process_sub_row(sub_row, dfNum, dfPre, dfTag):
         print(f"Error processing row {sub_row.get('name', 'Unknown')}: {e}")
         return None
 
-def process_quarter(quarter_folder):
-    """Processes a single quarter into JSON format and uploads to S3."""
-    print(f"Processing quarter: {quarter_folder}")
+def build_submission_header(sub_row):
+    """Builds the submission-level fields of a JSON record (same rules as process_sub_row)."""
+    fiscal_year = safe_int(sub_row.get("fy", 0))
+    fiscal_period = str(sub_row.get("fp", "Unknown")).strip().upper() if sub_row.get("fp") else "Unknown"
+
+    return {
+        "symbol": sub_row.get("name", "Unknown"),
+        "name": sub_row.get("name", "Unknown"),
+        "country": sub_row.get("countryba", "Unknown"),
+        "city": sub_row.get("cityba", "Unknown"),
+        "year": fiscal_year,
+        "quarter": fiscal_period,
+    }
+
+class StatementEntries:
+    """
+    A quarter's joined statement rows, stably sorted by adsh. get(adsh) builds that submission's
+    {"bs": [...], "cf": [...], "ic": [...]} only when it is asked for, with entries in num.txt order,
+    so a quarter's entries never all exist as dicts at once.
+    """
+
+    def __init__(self, adsh, stmt, tag, label, value, uom):
+        codes, uniques = pd.factorize(adsh)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(uniques)))]).tolist()
+        self._ranges = {key: (bounds[i], bounds[i + 1]) for i, key in enumerate(uniques)}
+        self._columns = [np.asarray(column, dtype=object)[order] for column in (stmt, tag, label, value, uom)]
+
+    def get(self, adsh, default=None):
+        span = self._ranges.get(adsh)
+        if span is None:
+            return default
+        data = {"bs": [], "cf": [], "ic": []}
+        for stmt, tag, label, value, uom in zip(*(column[span[0]:span[1]] for column in self._columns)):
+            data[STATEMENT_KEYS[stmt]].append({"concept": tag, "label": label, "value": value, "unit": uom})
+        return data
+
+def build_statement_entries(dfNum, dfPre, dfTag):
+    """
+    Joins num/pre/tag once for a whole quarter and groups the resulting rows by adsh.
+    Returns (StatementEntries, {adsh with an unconvertible value}).
+    """
+    # Last tag/label and last (adsh, tag)/stmt pair win, exactly like the dict lookups in process_sub_row
+    tag_labels = dfTag.drop_duplicates("tag", keep="last").set_index("tag")["tlabel"]
+    statements = dfPre.drop_duplicates(["adsh", "tag"], keep="last")[["adsh", "tag", "stmt"]]
+
+    # Join keys as plain objects: categorical num/pre columns rarely share the same categories
+    num = dfNum[["adsh", "tag", "value", "uom"]].astype({"adsh": object, "tag": object, "uom": object})
+    statements = statements.astype({"adsh": object, "tag": object, "stmt": object})
+    merged = num.merge(statements, on=["adsh", "tag"], how="left", sort=False)
+
+    # Convert each distinct raw value once instead of once per cell
+    codes, uniques = pd.factorize(merged["value"], use_na_sentinel=False)
+    converted = [safe_int_or_none(value) for value in uniques]
+    merged["value"] = pd.Series([converted[code] for code in codes], index=merged.index, dtype=object)
+
+    # process_sub_row converts every num row of a submission, so one infinity anywhere drops it
+    overflowed = set(merged.loc[merged["value"].isna(), "adsh"])
+
+    merged = merged[merged["stmt"].isin(list(STATEMENT_KEYS))]
+
+    # Labels fall back to the tag itself only when the tag is missing from tag.txt
+    labels = merged["tag"].map(tag_labels)
+    labels = labels.where(merged["tag"].isin(tag_labels.index), merged["tag"])
+
+    entries = StatementEntries(merged["adsh"], merged["stmt"], merged["tag"], labels, merged["value"], merged["uom"])
+    return entries, overflowed
+
+def iter_indexed_quarter_json(dfSub, dfNum, dfPre, dfTag):
+    """Vectorized replacement for mapping process_sub_row over every submission; yields (dfSub index, record) in order."""
+    entries, overflowed = build_statement_entries(dfNum, dfPre, dfTag)
+
+    for index, sub_row in zip(dfSub.index, dfSub.to_dict("records")):
+        try:
+            if sub_row["adsh"] in overflowed:
+                raise OverflowError("cannot convert float infinity to integer")
+
+            json_output = build_submission_header(sub_row)
+            json_output["data"] = entries.get(sub_row["adsh"], {"bs": [], "cf": [], "ic": []})
+            yield index, json_output
+        except Exception as e:
+            print(f"Error processing row {sub_row.get('name', 'Unknown')}: {e}")
+
+def iter_quarter_json(dfSub, dfNum, dfPre, dfTag):
+    """Yields the vectorized JSON records of a quarter in sub.txt order."""
+    for _, json_output in iter_indexed_quarter_json(dfSub, dfNum, dfPre, dfTag):
+        yield json_output
+
+def iter_legacy_quarter_json(dfSub, dfNum, dfPre, dfTag):
+    """Maps process_sub_row over every submission; yields the successful records in sub.txt order."""
+    # Use ThreadPoolExecutor for faster row processing
+    with ThreadPoolExecutor() as executor:
+        for res in executor.map(lambda row: process_sub_row(row, dfNum, dfPre, dfTag), dfSub.to_dict("records")):
+            # Skip None values (failed transformations)
+            if res is not None:
+                yield res
+
+def build_quarter_json(dfSub, dfNum, dfPre, dfTag):
+    """Builds the full list of JSON records for a quarter with the vectorized engine."""
+    return list(iter_quarter_json(dfSub, dfNum, dfPre, dfTag))
+
+def serialize_record(record, output_format=None):
+    """Formats one record exactly as it appears in the quarter file for the given (default: configured) format."""
+    if (output_format or JSON_OUTPUT_FORMAT) == "ndjson":
+        return json.dumps(record)
+    # One element of json.dumps(records, indent=4): the record's own indented form, shifted one level
+    return textwrap.indent(json.dumps(record, indent=4), "    ")
+
+def quarter_output_key(quarter_folder):
+    """S3 key of a quarter's JSON output in the configured JSON_OUTPUT_FORMAT."""
+    extension = "ndjson" if JSON_OUTPUT_FORMAT == "ndjson" else "json"
+    return f"{S3_JSON_FOLDER}{quarter_folder}.{extension}"
+
+def upload_quarter_fragments(quarter_folder, fragments):
+    """
+    Streams serialized records (see serialize_record) to S3 in multipart chunks, without holding the file.
+    "ndjson" writes one record per line; "json" writes the same bytes as json.dumps(records, indent=4).
+    """
+    extension = "ndjson" if JSON_OUTPUT_FORMAT == "ndjson" else "json"
+    json_s3_path = quarter_output_key(quarter_folder)
 
-    quarter_s3_path = f"{S3_EXTRACT_FOLDER}{quarter_folder}/"
+    try:
+        count = 0
+        if extension == "ndjson":
+            with S3MultipartWriter(json_s3_path, content_type="application/x-ndjson") as writer:
+                for fragment in fragments:
+                    writer.write(fragment + "\n")
+                    count += 1
+        else:
+            with S3MultipartWriter(json_s3_path, content_type="application/json") as writer:
+                for fragment in fragments:
+                    writer.write(("[\n" if count == 0 else ",\n") + fragment)
+                    count += 1
+                writer.write("\n]" if count else "[]")
+        print(f"{extension.upper()} for {quarter_folder} ({count} records) uploaded to S3 at {json_s3_path}")
+        return json_s3_path
+    except Exception as e:
+        print(f"Error uploading {extension.upper()} for {quarter_folder} to S3: {e}")
+        return None
+
+def upload_quarter_records(quarter_folder, records):
+    """Uploads a quarter's records in the configured JSON_OUTPUT_FORMAT and returns the S3 key, or None on failure."""
+    return upload_quarter_fragments(quarter_folder, (serialize_record(record) for record in records))
+
+def adsh_partitions(adsh, partitions):
+    """Maps adsh values to partition numbers with a hash that is stable across processes (unlike hash())."""
+    codes, uniques = pd.factorize(adsh)
+    # Missing adsh values (code -1) land in the last slot, partition 0
+    buckets = np.array([zlib.crc32(str(value).encode("utf-8")) % partitions for value in uniques] + [0], dtype=np.int64)
+    return buckets[codes]
+
+def plan_partitions(quarter_s3_path):
+    """Chooses how many adsh partitions keep one partition of num.txt + pre.txt within TRANSFORM_MEMORY_BUDGET_MB."""
+    total_bytes = 0
+    for file_name in ("num.txt", "pre.txt"):
+        head = s3_client.head_object(Bucket=os.getenv("S3_BUCKET_NAME"), Key=f"{quarter_s3_path}{file_name}")
+        total_bytes += head["ContentLength"]
+
+    budget_bytes = TRANSFORM_MEMORY_BUDGET_MB * 1024 * 1024
+    return min(max(1, math.ceil(total_bytes * PARTITION_MEMORY_FACTOR / budget_bytes)), MAX_SPILL_PARTITIONS)
+
+def spill_tsv_partitions(s3_path, schema, partitions, spill_dir, prefix):
+    """
+    Streams a TSV from S3 in TSV_CHUNK_ROWS chunks and appends each chunk's rows to one local
+    spill file per adsh partition. Row order within a partition follows the source file.
+    Returns the number of rows read.
+    """
+    obj = s3_client.get_object(Bucket=os.getenv("S3_BUCKET_NAME"), Key=s3_path)
+    # Categories are per chunk; spill them as shared str objects, which pickle only once per chunk
+    categorical = {column: object for column, dtype in schema.items() if dtype == "category"}
+
+    rows = 0
+    files = [open(os.path.join(spill_dir, f"{prefix}-{p}.pkl"), "wb") for p in range(partitions)]
+    try:
+        chunks = pd.read_csv(obj["Body"], sep="\t", usecols=list(schema), dtype=read_dtypes(schema), chunksize=TSV_CHUNK_ROWS)
+        for chunk in chunks:
+            chunk = convert_float_text(chunk, schema)
+            rows += len(chunk)
+            for p, piece in chunk.groupby(adsh_partitions(chunk["adsh"], partitions), sort=False):
+                pickle.dump(piece.astype(categorical), files[p], protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for f in files:
+            f.close()
+    return rows
+
+def load_spilled_partition(path, schema):
+    """Reads back every chunk appended to a spill file as one compact DataFrame."""
+    pieces = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                pieces.append(pickle.load(f))
+            except EOFError:
+                break
+
+    if not pieces:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in schema.items()})
+    return pd.concat(pieces, ignore_index=True).astype(schema)
+
+def iter_spilled_records(path):
+    """Yields (sub.txt position, record) pairs written by iter_chunked_quarter_json for one partition."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            position, record = line.split("\t", 1)
+            yield int(position), record
+
+def iter_chunked_quarter_json(dfSub, dfTag, partitions, spill_dir):
+    """
+    Transforms a quarter one adsh partition at a time from the spill files written by spill_tsv_partitions,
+    then merges the per-partition results back into sub.txt order. Output matches iter_quarter_json.
+    """
+    dfSub = dfSub.reset_index(drop=True)
+    sub_partitions = adsh_partitions(dfSub["adsh"], partitions)
+
+    for p in range(partitions):
+        dfNum = load_spilled_partition(os.path.join(spill_dir, f"num-{p}.pkl"), TSV_SCHEMAS["num.txt"])
+        dfPre = load_spilled_partition(os.path.join(spill_dir, f"pre-{p}.pkl"), TSV_SCHEMAS["pre.txt"])
+        print(f"Transforming partition {p + 1}/{partitions} ({len(dfNum)} num rows, {table_memory_mb(dfNum):.1f} MB)")
+
+        with open(os.path.join(spill_dir, f"out-{p}.jsonl"), "w", encoding="utf-8") as out:
+            for position, record in iter_indexed_quarter_json(dfSub[sub_partitions == p], dfNum, dfPre, dfTag):
+                out.write(f"{position}\t{json.dumps(record)}\n")
+        del dfNum, dfPre
+
+    merged = heapq.merge(*(iter_spilled_records(os.path.join(spill_dir, f"out-{p}.jsonl")) for p in range(partitions)))
+    for _, record in merged:
+        yield json.loads(record)
+
+def process_quarter_chunked(quarter_folder, quarter_s3_path):
+    """
+    Bounded-memory variant of process_quarter: num.txt and pre.txt are streamed in chunks into local
+    adsh-partitioned spill files and transformed one partition at a time. Only sub.txt and tag.txt,
+    which are small, are held in memory for the whole quarter.
+    """
+    with tempfile.TemporaryDirectory(prefix=f"{quarter_folder}-", dir=TRANSFORM_SPILL_DIR) as spill_dir:
+        try:
+            dfSub = read_tsv_from_s3(f"{quarter_s3_path}sub.txt", TSV_SCHEMAS["sub.txt"])
+            dfTag = read_tsv_from_s3(f"{quarter_s3_path}tag.txt", TSV_SCHEMAS["tag.txt"])
+
+            partitions = plan_partitions(quarter_s3_path)
+            print(f"Spilling num.txt and pre.txt for {quarter_folder} into {partitions} partitions...")
+            num_rows = spill_tsv_partitions(f"{quarter_s3_path}num.txt", TSV_SCHEMAS["num.txt"], partitions, spill_dir, "num")
+            pre_rows = spill_tsv_partitions(f"{quarter_s3_path}pre.txt", TSV_SCHEMAS["pre.txt"], partitions, spill_dir, "pre")
+
+            if dfSub.empty or num_rows == 0 or pre_rows == 0 or dfTag.empty:
+                print(f"Missing data in {quarter_folder}, skipping...")
+                return
+
+            print(f"TSV files spilled for {quarter_folder}. Processing JSON...")
+        except Exception as e:
+            print(f"Error reading TSV files for {quarter_folder}: {e}")
+            return
+
+        return upload_quarter_records(quarter_folder, iter_chunked_quarter_json(dfSub, dfTag, partitions, spill_dir))
 
+def quarter_has_files(quarter_folder, quarter_s3_path):
+    """Checks that the extractor produced files for the quarter."""
     # List files in this quarter folder
     quarter_files = list_files_in_s3(quarter_s3_path)
     print(f"Files in {quarter_folder}: {quarter_files}")
 
     if not quarter_files:
         print(f"No extracted TSV files found in S3 for {quarter_folder}. Skipping...")
-        return
+        return False
+    return True
 
+def load_quarter_for_transform(quarter_folder, quarter_s3_path):
+    """Loads the four quarter tables, or returns None when any of them is missing or empty."""
     print(f"Loading TSV files from S3 for {quarter_folder}...")
     try:
-        dfSub = read_tsv_from_s3(f"{quarter_s3_path}sub.txt")
-        dfNum = read_tsv_from_s3(f"{quarter_s3_path}num.txt")
-        dfPre = read_tsv_from_s3(f"{quarter_s3_path}pre.txt")
-        dfTag = read_tsv_from_s3(f"{quarter_s3_path}tag.txt")
+        tables = load_quarter_tables(quarter_s3_path)
 
-        if dfSub.empty or dfNum.empty or dfPre.empty or dfTag.empty:
+        if any(df.empty for df in tables):
             print(f"Missing data in {quarter_folder}, skipping...")
-            return
+            return None
 
         print(f"TSV files loaded for {quarter_folder}. Processing JSON...")
+        return tables
     except Exception as e:
         print(f"Error reading TSV files for {quarter_folder}: {e}")
+        return None
+
+def process_quarter(quarter_folder):
+    """Processes a single quarter into JSON format and uploads to S3. Returns the output key, or None if skipped or failed."""
+    print(f"Processing quarter: {quarter_folder}")
+
+    quarter_s3_path = f"{S3_EXTRACT_FOLDER}{quarter_folder}/"
+    if not quarter_has_files(quarter_folder, quarter_s3_path):
         return
 
-    json_output_list = []
+    if PROCESSING_MODE == "chunked":
+        return process_quarter_chunked(quarter_folder, quarter_s3_path)
 
-    # Use ThreadPoolExecutor for faster row processing
-    with ThreadPoolExecutor() as executor:
-        results = list(executor.map(lambda row: process_sub_row(row, dfNum, dfPre, dfTag), dfSub.to_dict("records")))
+    tables = load_quarter_for_transform(quarter_folder, quarter_s3_path)
+    if tables is None:
+        return
 
-    # Remove None values (failed transformations)
-    json_output_list = [res for res in results if res is not None]
+    if TRANSFORM_ENGINE == "legacy":
+        records = iter_legacy_quarter_json(*tables)
+    else:
+        records = iter_quarter_json(*tables)
+
+    return upload_quarter_records(quarter_folder, records)
+
+def plan_shards(dfSub, shard_count):
+    """
+    Splits sub.txt into contiguous row ranges, so concatenating shard results keeps sub.txt order.
+    Returns (shard id per sub row, shard count actually used).
+    """
+    # adsh is the sub.txt key; if it ever repeats, one shard keeps every copy next to its num/pre rows
+    shard_count = max(1, min(shard_count, len(dfSub)))
+    if dfSub["adsh"].duplicated().any():
+        shard_count = 1
+    return np.arange(len(dfSub)) * shard_count // max(len(dfSub), 1), shard_count
+
+def group_rows_by_shard(df, adsh_shard, shard_count):
+    """Stable-sorts num/pre rows by the shard of their adsh (source order kept within a shard) and returns (rows, offsets)."""
+    shard_ids = df["adsh"].astype(object).map(adsh_shard).fillna(-1).to_numpy(dtype=np.int64)
+    order = np.argsort(shard_ids, kind="stable")
+    # Rows whose adsh has no submission never reach the output, so they are not staged
+    order = order[shard_ids[order] >= 0]
+    offsets = np.searchsorted(shard_ids[order], np.arange(shard_count + 1))
+    return df.iloc[order].reset_index(drop=True), offsets
+
+def write_staged_table(stage_dir, file_name, df):
+    """Writes a quarter table as an Arrow IPC file that workers memory-map instead of receiving pickled copies."""
+    schema = TSV_SCHEMAS[file_name]
+    table = pa.Table.from_pandas(df[list(schema)], schema=arrow_schema(schema), preserve_index=False)
+    with pa.OSFile(os.path.join(stage_dir, f"{file_name}.arrow"), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def read_staged_table(stage_dir, file_name, start=0, stop=None):
+    """Memory-maps a staged Arrow table and converts only rows [start, stop) to pandas."""
+    schema = TSV_SCHEMAS[file_name]
+    # The table's buffers point into the mapping, which stays open for as long as they are referenced
+    table = pa.ipc.open_file(pa.memory_map(os.path.join(stage_dir, f"{file_name}.arrow"), "r")).read_all()
+    stop = table.num_rows if stop is None else stop
+    return arrow_to_pandas(table.slice(start, stop - start), schema)
+
+def stage_quarter(stage_dir, dfSub, dfNum, dfPre, dfTag, shard_count):
+    """Stages a loaded quarter for the shard workers and returns one (sub, num, pre) row range triple per shard."""
+    sub_shards, shard_count = plan_shards(dfSub, shard_count)
+    adsh_shard = dict(zip(dfSub["adsh"], sub_shards.tolist()))
+
+    dfNum, num_offsets = group_rows_by_shard(dfNum, adsh_shard, shard_count)
+    dfPre, pre_offsets = group_rows_by_shard(dfPre, adsh_shard, shard_count)
+    sub_offsets = np.searchsorted(sub_shards, np.arange(shard_count + 1))
+
+    for file_name, df in (("sub.txt", dfSub), ("num.txt", dfNum), ("pre.txt", dfPre), ("tag.txt", dfTag)):
+        write_staged_table(stage_dir, file_name, df)
+
+    return [
+        ((int(sub_offsets[i]), int(sub_offsets[i + 1])), (int(num_offsets[i]), int(num_offsets[i + 1])), (int(pre_offsets[i]), int(pre_offsets[i + 1])))
+        for i in range(shard_count)
+    ]
+
+def transform_shard(stage_dir, sub_range, num_range, pre_range, output_format):
+    """Process-pool task: transforms one shard of a staged quarter and returns its serialized records in order."""
+    dfSub = read_staged_table(stage_dir, "sub.txt", *sub_range)
+    dfNum = read_staged_table(stage_dir, "num.txt", *num_range)
+    dfPre = read_staged_table(stage_dir, "pre.txt", *pre_range)
+    dfTag = read_staged_table(stage_dir, "tag.txt")
+    return [serialize_record(record, output_format) for record in iter_quarter_json(dfSub, dfNum, dfPre, dfTag)]
+
+def load_and_stage_quarter(quarter_folder, shard_count):
+    """
+    Loads a quarter once and stages it as memory-mapped Arrow files for the shard workers.
+    Returns (stage directory, shard row ranges), or None when the quarter is skipped; the caller
+    removes the directory.
+    """
+    print(f"Processing quarter: {quarter_folder}")
+
+    quarter_s3_path = f"{S3_EXTRACT_FOLDER}{quarter_folder}/"
+    if not quarter_has_files(quarter_folder, quarter_s3_path):
+        return None
 
-    # Convert JSON to string and upload to S3
-    json_data = json.dumps(json_output_list, indent=4)
-    json_s3_path = f"{S3_JSON_FOLDER}{quarter_folder}.json"
+    tables = load_quarter_for_transform(quarter_folder, quarter_s3_path)
+    if tables is None:
+        return None
 
+    stage_dir = tempfile.mkdtemp(prefix=f"{quarter_folder}-", dir=SHARED_STAGE_DIR)
     try:
-        s3_client.put_object(Bucket=os.getenv("S3_BUCKET_NAME"), Key=json_s3_path, Body=json_data)
-        print(f"JSON for {quarter_folder} uploaded to S3 at {json_s3_path}")
-    except Exception as e:
-        print(f"Error uploading JSON for {quarter_folder} to S3: {e}")
+        # The workers read the staged copies; the frames are dropped when this returns
+        return stage_dir, stage_quarter(stage_dir, *tables, shard_count)
+    except BaseException:
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        raise
+
+def transform_staged_quarter(quarter_folder, executor, stage_dir, shards):
+    """Transforms a staged quarter's shards on the shared process pool and uploads the results in shard (sub.txt) order."""
+    print(f"Transforming {quarter_folder} as {len(shards)} shards...")
+    futures = [executor.submit(transform_shard, stage_dir, *shard, JSON_OUTPUT_FORMAT) for shard in shards]
+    try:
+        return upload_quarter_fragments(quarter_folder, (fragment for future in futures for fragment in future.result()))
+    finally:
+        # Shards still queued must not start on a directory that is about to be removed
+        for future in futures:
+            future.cancel()
+
+def process_quarter_sharded(quarter_folder, executor, shard_count):
+    """Transforms one quarter as shards on the shared process pool. Returns the output key, or None if skipped."""
+    staged = load_and_stage_quarter(quarter_folder, shard_count)
+    if staged is None:
+        return None
+    stage_dir, shards = staged
+    try:
+        return transform_staged_quarter(quarter_folder, executor, stage_dir, shards)
+    finally:
+        shutil.rmtree(stage_dir, ignore_errors=True)
+
+def process_quarters_sharded(quarter_names, executor, shard_count, record_done):
+    """
+    Transforms quarters in order as shards on the shared process pool, calling record_done(quarter,
+    output_key) for each. The next quarter is loaded and staged on a background thread while the current
+    one's shards run, so the pool does not sit idle between quarters; at most two quarters are staged at once.
+    """
+    def stage_next(i):
+        return stager.submit(load_and_stage_quarter, quarter_names[i], shard_count) if i < len(quarter_names) else None
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="stager") as stager:
+        staging = stage_next(0)
+        for i, quarter in enumerate(quarter_names):
+            try:
+                staged = staging.result()
+            except Exception as e:
+                print(f"Error in processing {quarter}: {e}")
+                staged = None
+            staging = stage_next(i + 1)
+            if staged is None:
+                continue
 
-def parallel_json_processing():
-    """Runs JSON transformation for each quarter in parallel."""
+            stage_dir, shards = staged
+            try:
+                record_done(quarter, transform_staged_quarter(quarter, executor, stage_dir, shards))
+            except Exception as e:
+                print(f"Error in processing {quarter}: {e}")
+            finally:
+                shutil.rmtree(stage_dir, ignore_errors=True)
+
+def quarter_sources(quarter_folder, objects):
+    """ETag/size of each input TSV of a quarter, taken from a prefix listing."""
+    return {file_name: objects.get(f"{S3_EXTRACT_FOLDER}{quarter_folder}/{file_name}") for file_name in TSV_SCHEMAS}
+
+def parallel_json_processing(force=False, only=None):
+    """
+    Runs JSON transformation for each quarter in parallel.
+    Quarters whose TSVs, transformer version and output are unchanged since the last run (per the
+    transform manifest) are skipped unless force is set; `only` restricts the run to the given quarters.
+    """
+    # One parallel, paginated listing of both prefixes; the quarter folders, source ETags and existing
+    # outputs below are all answered from this cached listing
+    list_prefixes([S3_EXTRACT_FOLDER, S3_JSON_FOLDER])
     quarters = list_folders_in_s3(S3_EXTRACT_FOLDER)  # Get folders (not files)
 
     #print(f"DEBUG: List of extracted quarter folders in S3: {quarters}")
@@ -130,22 +708,53 @@ def parallel_json_processing():
 
     # Extract just the quarter names from the full S3 path
     quarter_names = [folder.rstrip("/").split("/")[-1] for folder in quarters]
+    if only:
+        quarter_names = [quarter for quarter in quarter_names if quarter in only]
+
+    objects = list_objects_with_metadata(S3_EXTRACT_FOLDER)
+    outputs = list_objects_with_metadata(S3_JSON_FOLDER)
+    manifest = load_manifest(TRANSFORM_MANIFEST)
+
+    sources = {quarter: quarter_sources(quarter, objects) for quarter in quarter_names}
+    if not force:
+        quarter_names = [
+            quarter for quarter in quarter_names
+            if not manifest_is_current(manifest, quarter, sources[quarter], TRANSFORMER_VERSION, outputs, [quarter_output_key(quarter)])
+        ]
 
     print(f"Found {len(quarter_names)} quarters to process")
+    if not quarter_names:
+        return
+
+    def record_done(quarter, output_key):
+        if output_key is not None:
+            record_manifest_quarter(manifest, quarter, sources[quarter], TRANSFORMER_VERSION, [output_key])
+            save_manifest(TRANSFORM_MANIFEST, manifest)
 
     num_cores = os.cpu_count()
     print(f"Starting multiprocessing with {num_cores} cores...")
 
+    # Sharding needs the full vectorized in-memory path and pyarrow for the staged tables
+    sharded = WORKER_MODEL == "sharded" and pa is not None and PROCESSING_MODE == "memory" and TRANSFORM_ENGINE != "legacy"
+
     with ProcessPoolExecutor(max_workers=num_cores) as executor:
-        futures = {executor.submit(process_quarter, quarter): quarter for quarter in quarter_names}
+        if sharded:
+            process_quarters_sharded(quarter_names, executor, num_cores * SHARDS_PER_WORKER, record_done)
+        else:
+            futures = {executor.submit(process_quarter, quarter): quarter for quarter in quarter_names}
 
-        for future in futures:
-            try:
-                future.result()  # Ensure exceptions inside processes are logged
-            except Exception as e:
-                print(f"Error in processing {futures[future]}: {e}")
+            for future in futures:
+                try:
+                    record_done(futures[future], future.result())  # Ensure exceptions inside processes are logged
+                except Exception as e:
+                    print(f"Error in processing {futures[future]}: {e}")
 
     print("Multiprocessing completed.")
 
 if __name__ == "__main__":
-    parallel_json_processing()
+    parser = argparse.ArgumentParser(description="Transform extracted SEC TSV quarters into JSON on S3.")
+    parser.add_argument("--force", action="store_true", help="Reprocess quarters even if the manifest says they are current")
+    parser.add_argument("--only", action="append", metavar="QUARTER", help="Only process this quarter (e.g. 2024q1); repeatable")
+    args = parser.parse_args()
+
+    parallel_json_processing(force=args.force, only=args.only)
@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+
+# HTTP connections shared by every thread using the client (botocore's default is 10)
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50))
+
+# botocore-level retries for every request, with client-side rate adaptation on throttling
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 5))
+
+# Managed transfers: objects above the threshold go multipart, S3_TRANSFER_CONCURRENCY parts at a time
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", 16 * 1024 * 1024))
+S3_MULTIPART_CHUNK_SIZE = max(int(os.getenv("S3_MULTIPART_CHUNK_SIZE", 8 * 1024 * 1024)), S3_MIN_PART_SIZE)
+S3_TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", 10))
+
+# Whole-object retries in upload_many/download_many, on top of the per-request retries
+S3_OBJECT_RETRIES = int(os.getenv("S3_OBJECT_RETRIES", 3))
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_CHUNK_SIZE,
+    max_concurrency=S3_TRANSFER_CONCURRENCY,
+    use_threads=True,
+)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_s3_client():
+    """
+    Returns the process-wide S3 client. boto3 clients are thread-safe once created, so every
+    script and thread shares this one and its connection pool; creation itself is guarded by a lock.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = boto3.client(
+                    "s3",
+                    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                    region_name=os.getenv("AWS_REGION"),
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "adaptive"},
+                    ),
+                )
+    return _client
+
+class TransferStats:
+    """Counts objects, bytes, failures and wall time of a bulk transfer."""
+
+    def __init__(self):
+        self.objects = 0
+        self.bytes = 0
+        self.failures = []
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.objects += 1
+            self.bytes += size
+
+    def fail(self, key, error):
+        with self._lock:
+            self.failures.append((key, str(error)))
+
+    @property
+    def throughput_mb_s(self):
+        return self.bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return (
+            f"{self.objects} objects, {self.bytes / (1024 * 1024):.1f} MB in {self.seconds:.1f}s "
+            f"({self.throughput_mb_s:.1f} MB/s), {len(self.failures)} failed"
+        )
+
+def _with_retries(action, key, retries, stats):
+    """Runs one object transfer, retrying the whole object with backoff; records the outcome in stats."""
+    for attempt in range(retries + 1):
+        try:
+            stats.add(action())
+            return True
+        except Exception as e:
+            if attempt == retries:
+                print(f"Error transferring {key} after {retries + 1} attempts: {e}")
+                stats.fail(key, e)
+                return False
+            time.sleep(min(2 ** attempt, 30))
+
+def _run_bulk(items, action, key_of, max_workers, retries):
+    stats = TransferStats()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda item: _with_retries(lambda: action(item), key_of(item), retries, stats), items))
+    stats.seconds = time.monotonic() - started
+    return stats
+
+def upload_file(local_path, s3_path, extra_args=None):
+    """Uploads one local file with the shared client and TRANSFER_CONFIG; returns its size."""
+    get_s3_client().upload_file(local_path, S3_BUCKET_NAME, s3_path, ExtraArgs=extra_args, Config=TRANSFER_CONFIG)
+    return os.path.getsize(local_path)
+
+def download_file(s3_path, local_path):
+    """Downloads one object with the shared client and TRANSFER_CONFIG; returns its size."""
+    get_s3_client().download_file(S3_BUCKET_NAME, s3_path, local_path, Config=TRANSFER_CONFIG)
+    return os.path.getsize(local_path)
+
+def upload_many(items, max_workers=S3_TRANSFER_CONCURRENCY, retries=S3_OBJECT_RETRIES):
+    """Uploads (local_path, s3_path) pairs concurrently with per-object retries; returns TransferStats."""
+    stats = _run_bulk(items, lambda item: upload_file(*item), lambda item: item[1], max_workers, retries)
+    print(f"Uploaded {stats.summary()}")
+    return stats
+
+def download_many(items, max_workers=S3_TRANSFER_CONCURRENCY, retries=S3_OBJECT_RETRIES):
+    """Downloads (s3_path, local_path) pairs concurrently with per-object retries; returns TransferStats."""
+    stats = _run_bulk(items, lambda item: download_file(*item), lambda item: item[0], max_workers, retries)
+    print(f"Downloaded {stats.summary()}")
+    return stats
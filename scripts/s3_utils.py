@@ -1,25 +1,43 @@
 import os
-import boto3
+import io
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+import s3_transfer
+from s3_transfer import get_s3_client, S3_MIN_PART_SIZE, S3_MULTIPART_CHUNK_SIZE
 
 # Load environment variables
 load_dotenv()
 
 # AWS S3 Configuration
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+S3_BUCKET_NAME = s3_transfer.S3_BUCKET_NAME
 
-# Initialize S3 Client
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION"),
-)
+# Run manifests (which quarters were produced from which inputs) live beside the data folders
+S3_MANIFEST_FOLDER = "sec_manifests/"
+
+# Parts a streamed upload keeps in flight while the caller keeps writing (each holds one chunk in memory)
+S3_WRITER_CONCURRENCY = int(os.getenv("S3_WRITER_CONCURRENCY", 2))
+
+# Ranged GET size for S3RangeReader; also the most it buffers in memory
+S3_RANGE_READ_SIZE = int(os.getenv("S3_RANGE_READ_SIZE", 8 * 1024 * 1024))
+
+# Listing cache shared by every stage in the process: {prefix: (monotonic time listed, [objects])}
+S3_LIST_CACHE_TTL = float(os.getenv("S3_LIST_CACHE_TTL", 60))
+S3_LIST_CONCURRENCY = int(os.getenv("S3_LIST_CONCURRENCY", 8))
+_listing_cache = {}
+_listing_cache_lock = threading.Lock()
+
+# Shared, pooled S3 Client (see s3_transfer)
+s3_client = get_s3_client()
 
 def upload_file_to_s3(local_path, s3_path):
     """Uploads a file to S3."""
     try:
-        s3_client.upload_file(local_path, S3_BUCKET_NAME, s3_path)
+        s3_transfer.upload_file(local_path, s3_path)
+        invalidate_listing_cache(s3_path)
         print(f"Uploaded: {s3_path} to S3.")
     except Exception as e:
         print(f"Error uploading {local_path}: {e}")
@@ -27,20 +45,112 @@ def upload_file_to_s3(local_path, s3_path):
 def download_file_from_s3(s3_path, local_path):
     """Downloads a file from S3."""
     try:
-        s3_client.download_file(S3_BUCKET_NAME, s3_path, local_path)
+        s3_transfer.download_file(s3_path, local_path)
         print(f"Downloaded {s3_path} from S3.")
     except Exception as e:
         print(f"Error downloading {s3_path}: {e}")
 
+def _list_pages(prefix):
+    """Yields every object under a prefix, following list_objects_v2 continuation tokens."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield {"key": obj["Key"], "size": obj["Size"], "etag": obj["ETag"].strip('"'), "last_modified": obj["LastModified"]}
+
+def _cached_listing(prefix):
+    """Returns a fresh cached listing covering the prefix (its own or a parent prefix's), or None."""
+    now = time.monotonic()
+    with _listing_cache_lock:
+        for cached_prefix, (listed_at, objects) in _listing_cache.items():
+            if prefix.startswith(cached_prefix) and now - listed_at < S3_LIST_CACHE_TTL:
+                if cached_prefix == prefix:
+                    return objects
+                return [obj for obj in objects if obj["key"].startswith(prefix)]
+    return None
+
+def invalidate_listing_cache(key=None):
+    """Drops cached listings that could contain the key, or every cached listing when no key is given."""
+    with _listing_cache_lock:
+        for cached_prefix in list(_listing_cache):
+            if key is None or key.startswith(cached_prefix):
+                del _listing_cache[cached_prefix]
+
+def iter_s3_objects(prefix="", with_metadata=False, use_cache=True):
+    """
+    Yields the keys under a prefix across all pages (not just the first 1000), or dicts with
+    key/size/etag/last_modified when with_metadata is set. Listings are kept in an in-process cache
+    for S3_LIST_CACHE_TTL seconds; a cached parent prefix (e.g. the whole bucket) also answers its sub-prefixes.
+    """
+    objects = _cached_listing(prefix) if use_cache else None
+    if objects is None:
+        objects = []
+        for obj in _list_pages(prefix):
+            objects.append(obj)
+            yield obj if with_metadata else obj["key"]
+        with _listing_cache_lock:
+            _listing_cache[prefix] = (time.monotonic(), objects)
+        return
+
+    for obj in objects:
+        yield obj if with_metadata else obj["key"]
+
+def list_prefixes(prefixes, with_metadata=False):
+    """Lists several prefixes in parallel; returns {prefix: [keys or metadata dicts]}."""
+    with ThreadPoolExecutor(max_workers=S3_LIST_CONCURRENCY) as executor:
+        listings = executor.map(lambda prefix: list(iter_s3_objects(prefix, with_metadata)), prefixes)
+        return dict(zip(prefixes, listings))
+
 def list_files_in_s3(prefix):
     """Lists all files in S3 with the given prefix (folder)."""
     try:
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=prefix)
-        return [obj["Key"] for obj in response.get("Contents", [])]
+        return list(iter_s3_objects(prefix))
     except Exception as e:
         print(f"Error listing files in S3: {e}")
         return []
 
+def list_objects_with_metadata(prefix):
+    """Lists every object under a prefix as {key: {"etag": ..., "size": ...}}."""
+    return {obj["key"]: {"etag": obj["etag"], "size": obj["size"]} for obj in iter_s3_objects(prefix, with_metadata=True)}
+
+def load_manifest(name):
+    """Reads a run manifest from S3, or returns an empty one if none has been written yet."""
+    try:
+        obj = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=f"{S3_MANIFEST_FOLDER}{name}.json")
+        return json.loads(obj["Body"].read())
+    except s3_client.exceptions.NoSuchKey:
+        return {"quarters": {}}
+
+def save_manifest(name, manifest):
+    """Writes the whole manifest in one PUT, so readers only ever see a complete old or new version."""
+    s3_client.put_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=f"{S3_MANIFEST_FOLDER}{name}.json",
+        Body=json.dumps(manifest, indent=2, sort_keys=True),
+        ContentType="application/json",
+    )
+    invalidate_listing_cache(f"{S3_MANIFEST_FOLDER}{name}.json")
+
+def manifest_is_current(manifest, quarter, sources, version, existing_keys, output_keys=None):
+    """
+    True when a quarter was last produced from the same sources and version and its outputs still exist.
+    output_keys, when the caller knows them up front, must also match the recorded outputs.
+    """
+    entry = manifest["quarters"].get(quarter)
+    if entry is None or entry["sources"] != sources or entry["version"] != version:
+        return False
+    if output_keys is not None and entry["outputs"] != sorted(output_keys):
+        return False
+    return all(key in existing_keys for key in entry["outputs"])
+
+def record_manifest_quarter(manifest, quarter, sources, version, output_keys):
+    """Stores a finished quarter in the manifest (the caller saves it)."""
+    manifest["quarters"][quarter] = {
+        "sources": sources,
+        "version": version,
+        "outputs": sorted(output_keys),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
 def delete_local_file(file_path):
     """Deletes a local file after uploading to S3."""
     if os.path.exists(file_path):
@@ -52,9 +162,172 @@ def list_folders_in_s3(prefix):
     Lists only top-level folders (quarters) in the specified S3 prefix.
     Used by JSON Transformer to detect available quarters.
     """
-    response = s3_client.list_objects_v2(Bucket=os.getenv("S3_BUCKET_NAME"), Prefix=prefix, Delimiter="/")
+    # Answer from a cached listing when there is one, instead of another Delimiter call
+    objects = _cached_listing(prefix)
+    if objects is not None:
+        folders = {prefix + obj["key"][len(prefix):].split("/", 1)[0] + "/" for obj in objects if "/" in obj["key"][len(prefix):]}
+        return sorted(folders)
+
+    folders = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix, Delimiter="/"):
+        # Extract only folder names (not individual files)
+        folders.extend(obj["Prefix"] for obj in page.get("CommonPrefixes", []))
+    return folders
+
+class S3MultipartWriter:
+    """
+    File-like writer that streams bytes to a single S3 object using a multipart upload.
+    Up to `concurrency` parts upload in the background while writing continues, so at most that many
+    chunks plus the one being filled are held in memory; objects smaller than one chunk are sent with put_object.
+    Used as a context manager, the upload is completed on success and aborted on error.
+    """
+
+    def __init__(self, s3_path, chunk_size=S3_MULTIPART_CHUNK_SIZE, content_type="application/octet-stream", metadata=None,
+                 concurrency=S3_WRITER_CONCURRENCY):
+        self.s3_path = s3_path
+        self.chunk_size = max(chunk_size, S3_MIN_PART_SIZE)
+        self.content_type = content_type
+        self.metadata = metadata or {}
+        self.concurrency = max(concurrency, 1)
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._pending = []
+        self._parts = []
+
+    def write(self, data):
+        """Buffers data and uploads a part every time a full chunk is available."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer.extend(data)
+        self.bytes_written += len(data)
+
+        while len(self._buffer) >= self.chunk_size:
+            self._upload_part(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def _upload_part(self, body):
+        if self._upload_id is None:
+            response = s3_client.create_multipart_upload(
+                Bucket=S3_BUCKET_NAME, Key=self.s3_path, ContentType=self.content_type, Metadata=self.metadata
+            )
+            self._upload_id = response["UploadId"]
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        # Bound the parts in flight (and in memory) before queueing another
+        while len(self._pending) >= self.concurrency:
+            self._parts.append(self._pending.pop(0).result())
+
+        part_number = len(self._parts) + len(self._pending) + 1
+        self._pending.append(self._executor.submit(self._send_part, part_number, body))
+
+    def _send_part(self, part_number, body):
+        response = s3_client.upload_part(
+            Bucket=S3_BUCKET_NAME, Key=self.s3_path, UploadId=self._upload_id, PartNumber=part_number, Body=body
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def close(self):
+        """Uploads the remaining buffer and completes the object."""
+        if self._upload_id is None:
+            s3_client.put_object(
+                Bucket=S3_BUCKET_NAME, Key=self.s3_path, Body=bytes(self._buffer), ContentType=self.content_type, Metadata=self.metadata
+            )
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self._parts.extend(future.result() for future in self._pending)
+            self._pending = []
+            self._shutdown()
+            s3_client.complete_multipart_upload(
+                Bucket=S3_BUCKET_NAME, Key=self.s3_path, UploadId=self._upload_id, MultipartUpload={"Parts": self._parts}
+            )
+        self._buffer = bytearray()
+        invalidate_listing_cache(self.s3_path)
+
+    def abort(self):
+        """Discards buffered data and any parts already uploaded."""
+        self._shutdown()
+        self._pending = []
+        if self._upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=S3_BUCKET_NAME, Key=self.s3_path, UploadId=self._upload_id)
+            self._upload_id = None
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over an S3 object, backed by ranged GETs.
+    Reads are served from one readahead block of S3_RANGE_READ_SIZE, so tools such as zipfile can
+    seek to the central directory and stream members without downloading the whole object.
+    """
+
+    def __init__(self, s3_path, block_size=S3_RANGE_READ_SIZE):
+        self.s3_path = s3_path
+        self.block_size = block_size
+        self.size = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_path)["ContentLength"]
+        self._position = 0
+        self._block_start = 0
+        self._block = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self._position
+        size = min(size, self.size - self._position)
+        if size <= 0:
+            return b""
+
+        block_offset = self._position - self._block_start
+        if not (0 <= block_offset and block_offset + size <= len(self._block)):
+            # Fetch a new block starting here, large enough for this read
+            end = min(self._position + max(size, self.block_size), self.size) - 1
+            response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=self.s3_path, Range=f"bytes={self._position}-{end}")
+            self._block = response["Body"].read()
+            self._block_start = self._position
+            block_offset = 0
+
+        data = self._block[block_offset:block_offset + size]
+        self._position += len(data)
+        return data
 
-    # Extract only folder names (not individual files)
-    folders = [obj["Prefix"] for obj in response.get("CommonPrefixes", [])] if "CommonPrefixes" in response else []
-    
-    return folders
\ No newline at end of file
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
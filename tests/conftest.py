@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+from moto import mock_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "tests", "fixtures")
+
+# The pipeline scripts import each other as top-level modules (from s3_utils import ...)
+sys.path[:0] = [os.path.join(ROOT, "scripts"), ROOT]
+
+# Fake credentials and bucket, set before any module builds its S3 client
+TEST_BUCKET = "test-sec-bucket"
+os.environ.update({
+    "S3_BUCKET_NAME": TEST_BUCKET,
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_REGION": "us-east-1",
+    "AWS_DEFAULT_REGION": "us-east-1",
+})
+
+# s3_utils creates its shared client at import time, so the S3 stand-in is active for the whole session
+_aws = mock_aws()
+_aws.start()
+
+
+def fixture_path(*parts):
+    return os.path.join(FIXTURES, *parts)
+
+
+@pytest.fixture
+def s3():
+    """An empty moto bucket for the test; the listing cache is cleared before and after."""
+    import boto3
+    import s3_utils
+
+    client = boto3.client("s3", region_name="us-east-1")
+    client.create_bucket(Bucket=TEST_BUCKET)
+    s3_utils.invalidate_listing_cache()
+    yield client
+
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=TEST_BUCKET):
+        for obj in page.get("Contents", []):
+            client.delete_object(Bucket=TEST_BUCKET, Key=obj["Key"])
+    for upload in client.list_multipart_uploads(Bucket=TEST_BUCKET).get("Uploads", []):
+        client.abort_multipart_upload(Bucket=TEST_BUCKET, Key=upload["Key"], UploadId=upload["UploadId"])
+    s3_utils.invalidate_listing_cache()
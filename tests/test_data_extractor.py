@@ -0,0 +1,44 @@
+"""Tests for extracting quarterly ZIPs from S3 into per-quarter TSV folders, against moto."""
+
+import io
+import os
+import zipfile
+
+import pytest
+
+import data_extractor_s3
+import s3_transfer
+
+BUCKET = os.environ["S3_BUCKET_NAME"]
+
+MEMBERS = {"sub.txt": b"adsh\tname\n" * 5000, "num.txt": os.urandom(300000), "readme.htm": b"<html></html>"}
+
+
+@pytest.fixture
+def archive(s3):
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in MEMBERS.items():
+            z.writestr(name, data)
+    s3.put_object(Bucket=BUCKET, Key="sec_raw_zips/2024q1.zip", Body=content.getvalue())
+    return s3
+
+
+def test_members_are_uploaded_to_the_quarter_folder(archive):
+    keys = data_extractor_s3.extract_quarterly("2024q1.zip")
+
+    assert sorted(keys) == sorted(f"sec_extracted_tsv/2024q1/{name}" for name in MEMBERS)
+    for name, data in MEMBERS.items():
+        assert archive.get_object(Bucket=BUCKET, Key=f"sec_extracted_tsv/2024q1/{name}")["Body"].read() == data
+
+
+def test_failed_upload_fails_the_quarter(archive, monkeypatch):
+    monkeypatch.setattr(s3_transfer.time, "sleep", lambda seconds: None)
+
+    def upload_file(local_path, s3_path):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(s3_transfer, "upload_file", upload_file)
+
+    with pytest.raises(RuntimeError, match="3 of 3 files"):
+        data_extractor_s3.extract_quarterly("2024q1.zip")
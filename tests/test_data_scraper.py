@@ -0,0 +1,251 @@
+"""
+Tests for the scraper's HTTP link discovery (saved HTML fixture, conditional requests) and the
+resumable archive downloader, against a local HTTP server and moto.
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import data_scraper_s3 as scraper
+
+BUCKET = os.environ["S3_BUCKET_NAME"]
+PAGE_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "scraper", "financial_statement_data_sets.html")
+LAST_MODIFIED = "Tue, 02 Apr 2024 12:00:00 GMT"
+
+
+class Resource:
+    """A file served by the test server, with knobs for validators, Range support and dropped connections."""
+
+    def __init__(self, body, content_type="application/zip", etag=None, last_modified=LAST_MODIFIED, ranges=True, drops=()):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.ranges = ranges
+        # Bytes sent before closing the connection, one entry per GET until they run out
+        self.drops = list(drops)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _serve(self, send_body):
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        resource = self.server.resources.get(self.path)
+        if resource is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if resource.etag and self.headers.get("If-None-Match") == resource.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body, status = resource.body, 200
+        requested = self.headers.get("Range")
+        if requested and resource.ranges:
+            start = int(requested.split("=")[1].split("-")[0])
+            body, status = body[start:], 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", resource.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {len(resource.body) - len(body)}-{len(resource.body) - 1}/{len(resource.body)}")
+        if resource.etag:
+            self.send_header("ETag", resource.etag)
+        if resource.last_modified:
+            self.send_header("Last-Modified", resource.last_modified)
+        self.end_headers()
+        if not send_body:
+            return
+
+        if resource.drops:
+            # Promise the full length, send part of it, then drop the connection
+            self.wfile.write(body[:resource.drops.pop(0)])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.resources = {}
+    httpd.requests = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def link_cache(tmp_path, monkeypatch):
+    path = tmp_path / "links.json"
+    monkeypatch.setattr(scraper, "LINK_CACHE_PATH", str(path))
+    return path
+
+
+def read_page():
+    with open(PAGE_FIXTURE, "rb") as f:
+        return f.read()
+
+
+def gets(server, path):
+    return [headers for method, request_path, headers in server.requests if method == "GET" and request_path == path]
+
+
+# Link discovery
+
+def test_parse_zip_links_matches_the_selenium_xpath_filter():
+    links = scraper.parse_zip_links(read_page().decode("utf-8"), "https://www.sec.gov/data-research/sec-markets-data/financial-statement-data-sets")
+
+    assert links == [
+        "https://www.sec.gov/files/dera/data/financial-statement-data-sets/2024q1.zip",
+        "https://www.sec.gov/files/dera/data/financial-statement-data-sets/2023q4.zip",
+        "https://www.sec.gov/files/dera/data/financial-statement-data-sets/2023q3.zip",
+        "https://www.sec.gov/files/dera/data/financial-statement-data-sets/2009q2.zip?download=1",
+    ]
+
+
+def test_get_zip_links_http_caches_and_revalidates(server, link_cache):
+    server.resources["/fsds"] = Resource(read_page(), content_type="text/html", etag='"v1"')
+    url = f"{server.url}/fsds"
+
+    links = scraper.get_zip_links_http(url=url)
+    assert links[0] == f"{server.url}/files/dera/data/financial-statement-data-sets/2024q1.zip"
+    assert len(links) == 4
+    assert link_cache.exists()
+
+    # The page is unchanged (same ETag): the cached list is reused from the 304
+    server.resources["/fsds"].body = b"<html>not parsed on a 304</html>"
+    assert scraper.get_zip_links_http(url=url) == links
+
+    first, second = gets(server, "/fsds")
+    assert "If-None-Match" not in first
+    assert second["If-None-Match"] == '"v1"'
+    assert second["If-Modified-Since"] == LAST_MODIFIED
+
+
+def test_get_zip_links_http_refetches_a_changed_page(server, link_cache):
+    server.resources["/fsds"] = Resource(read_page(), content_type="text/html", etag='"v1"')
+    url = f"{server.url}/fsds"
+    scraper.get_zip_links_http(url=url)
+
+    server.resources["/fsds"] = Resource(
+        b'<a href="/files/dera/data/financial-statement-data-sets/2024q2.zip">2024 Q2</a>', content_type="text/html", etag='"v2"'
+    )
+    assert scraper.get_zip_links_http(url=url) == [f"{server.url}/files/dera/data/financial-statement-data-sets/2024q2.zip"]
+    assert scraper.get_zip_links_http(url=url) == [f"{server.url}/files/dera/data/financial-statement-data-sets/2024q2.zip"]
+    assert gets(server, "/fsds")[-1]["If-None-Match"] == '"v2"'
+
+
+def test_link_cache_of_another_url_is_not_sent(server, link_cache):
+    server.resources["/fsds"] = Resource(read_page(), content_type="text/html", etag='"v1"')
+    server.resources["/other"] = Resource(read_page(), content_type="text/html", etag='"v1"')
+    scraper.get_zip_links_http(url=f"{server.url}/fsds")
+
+    assert len(scraper.get_zip_links_http(url=f"{server.url}/other")) == 4
+    assert "If-None-Match" not in gets(server, "/other")[0]
+
+
+def test_default_discovery_does_not_need_selenium(monkeypatch):
+    monkeypatch.setattr(scraper, "get_zip_links_http", lambda: ["https://www.sec.gov/files/dera/data/financial-statement-data-sets/2024q1.zip"])
+    monkeypatch.setattr(scraper, "get_zip_links_selenium", lambda: pytest.fail("selenium used"))
+
+    assert len(scraper.get_zip_links()) == 1
+
+
+# Archive downloads
+
+ARCHIVE = bytes(range(256)) * 40000  # ~10 MB, more than one multipart chunk
+
+
+@pytest.fixture
+def archive(server, s3, monkeypatch):
+    monkeypatch.setattr(scraper, "DOWNLOAD_CHUNK_SIZE", 64 * 1024)
+    server.resources["/files/2024q1.zip"] = Resource(ARCHIVE)
+    return f"{server.url}/files/2024q1.zip"
+
+
+def s3_archive(s3):
+    return s3.get_object(Bucket=BUCKET, Key="sec_raw_zips/2024q1.zip")
+
+
+def test_download_streams_archive_to_s3(server, s3, archive):
+    scraper.download_and_upload_zip(archive)
+
+    obj = s3_archive(s3)
+    assert obj["Body"].read() == ARCHIVE
+    assert obj["Metadata"] == {"source-last-modified": LAST_MODIFIED}
+
+
+def test_download_resumes_with_range_after_dropped_connections(server, s3, archive):
+    # Drops on chunk boundaries, so every byte received before them was written and is not requested again
+    chunk = scraper.DOWNLOAD_CHUNK_SIZE
+    server.resources["/files/2024q1.zip"].drops = [16 * chunk, 40 * chunk]
+
+    scraper.download_and_upload_zip(archive)
+
+    assert s3_archive(s3)["Body"].read() == ARCHIVE
+    attempts = gets(server, "/files/2024q1.zip")
+    assert [headers.get("Range") for headers in attempts] == [None, f"bytes={16 * chunk}-", f"bytes={56 * chunk}-"]
+
+
+def test_download_restarts_cleanly_when_server_ignores_range(server, s3, archive):
+    server.resources["/files/2024q1.zip"].ranges = False
+    server.resources["/files/2024q1.zip"].drops = [700_000]
+
+    scraper.download_and_upload_zip(archive)
+
+    assert s3_archive(s3)["Body"].read() == ARCHIVE
+
+
+def test_download_gives_up_after_max_retries(server, s3, archive, monkeypatch):
+    monkeypatch.setattr(scraper, "DOWNLOAD_MAX_RETRIES", 2)
+    server.resources["/files/2024q1.zip"].drops = [1000] * 10
+
+    scraper.download_and_upload_zip(archive)
+
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET, Prefix="sec_raw_zips/")
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+    assert len(gets(server, "/files/2024q1.zip")) == 3
+
+
+def test_unchanged_archive_is_skipped(server, s3, archive):
+    scraper.download_and_upload_zip(archive)
+    scraper.download_and_upload_zip(archive)
+
+    assert len(gets(server, "/files/2024q1.zip")) == 1
+
+
+def test_changed_archive_is_downloaded_again(server, s3, archive):
+    scraper.download_and_upload_zip(archive)
+    server.resources["/files/2024q1.zip"].last_modified = "Wed, 03 Apr 2024 12:00:00 GMT"
+
+    scraper.download_and_upload_zip(archive)
+
+    assert len(gets(server, "/files/2024q1.zip")) == 2
+    assert s3_archive(s3)["Metadata"] == {"source-last-modified": "Wed, 03 Apr 2024 12:00:00 GMT"}
+
+
+def test_missing_archive_is_reported_not_raised(server, s3):
+    scraper.download_and_upload_zip(f"{server.url}/files/missing.zip", requests.Session())
+
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET, Prefix="sec_raw_zips/")
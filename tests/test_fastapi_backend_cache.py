@@ -0,0 +1,68 @@
+"""Tests for the backend's coalescing result cache."""
+
+import asyncio
+
+import pytest
+
+from backend import fastapi_backend as fb
+
+
+def test_concurrent_misses_run_the_loader_once():
+    cache = fb.ResultCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "rows"
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["rows"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_failed_load_reaches_every_waiter_and_is_not_cached():
+    cache = fb.ResultCache()
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("warehouse down")
+
+    async def loader():
+        return "rows"
+
+    async def main():
+        results = await asyncio.gather(*(cache.get_or_load("key", failing) for _ in range(3)), return_exceptions=True)
+        assert [type(result) for result in results] == [RuntimeError] * 3
+        return await cache.get_or_load("key", loader)
+
+    assert asyncio.run(main()) == "rows"
+
+
+def test_cancelled_loader_hands_the_load_to_a_waiter():
+    cache = fb.ResultCache()
+    started = []
+
+    async def loader():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return f"rows from load {len(started)}"
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_load("key", loader))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.ensure_future(cache.get_or_load("key", loader)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+
+        # The first requester's client goes away mid-load
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(main()) == ["rows from load 2"] * 3
+    assert len(started) == 2
+    assert cache.stats()["entries"] == 1
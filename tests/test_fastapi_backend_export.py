@@ -0,0 +1,287 @@
+"""Tests for the backend's exports: releasing aborted streams, Arrow/Parquet encoding of Snowflake chunks, S3 snapshots."""
+
+import asyncio
+import datetime
+import decimal
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from snowflake.connector.constants import FIELD_NAME_TO_ID
+from snowflake.connector.cursor import ResultMetadata
+
+from backend import fastapi_backend as fb
+
+
+class FakeConnection:
+    closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    sfqid = "01b2c3d4-0000-0000-0000-000000000001"
+
+    def __init__(self, events):
+        self.events = events
+        self.aborted = threading.Event()
+
+    def abort_query(self, sfqid):
+        self.events.append("abort")
+        self.aborted.set()
+
+    def close(self):
+        self.events.append("close")
+
+
+@pytest.fixture
+def backend_state():
+    """The app state stream_export relies on: warehouse threads and a pool holding one fake connection."""
+    conn = FakeConnection()
+    fb.app.state.warehouse_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="warehouse")
+    fb.app.state.snowflake_pool = fb.SnowflakeConnectionPool(lambda: conn, max_size=1)
+    yield conn
+    fb.app.state.warehouse_executor.shutdown(wait=True)
+    del fb.app.state.warehouse_executor
+    del fb.app.state.snowflake_pool
+
+
+def test_disconnect_waits_for_the_running_fetch_before_releasing(backend_state):
+    events = []
+    cur = FakeCursor(events)
+    fetching = threading.Event()
+
+    def chunks():
+        yield b"header\n"
+        fetching.set()
+        # Blocks like a fetch on a running query, until the query is aborted
+        cur.aborted.wait(5)
+        events.append("fetch returned")
+        yield b"rows\n"
+
+    async def disconnect():
+        pool = fb.app.state.snowflake_pool
+        conn = pool.acquire()
+        stream = fb.stream_export(conn, cur, chunks(), "export-1")
+        assert await stream.__anext__() == b"header\n"
+
+        # The client goes away while the next chunk is being fetched on a warehouse thread
+        reading = asyncio.ensure_future(stream.__anext__())
+        await asyncio.get_running_loop().run_in_executor(None, fetching.wait, 5)
+        reading.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reading
+        return pool
+
+    pool = asyncio.run(disconnect())
+    fb.app.state.warehouse_executor.shutdown(wait=True)
+
+    assert events == ["abort", "fetch returned", "close"]
+    assert pool.stats()["idle"] == 1
+    assert "export-1" not in fb.active_exports
+
+
+def test_finished_export_is_released_without_abort(backend_state):
+    events = []
+    cur = FakeCursor(events)
+
+    async def consume():
+        conn = fb.app.state.snowflake_pool.acquire()
+        return [chunk async for chunk in fb.stream_export(conn, cur, iter([b"a", b"b"]), "export-2")]
+
+    assert asyncio.run(consume()) == [b"a", b"b"]
+    fb.app.state.warehouse_executor.shutdown(wait=True)
+
+    assert events == ["close"]
+    assert fb.app.state.snowflake_pool.stats()["idle"] == 1
+
+
+def column(name, type_name, precision=None, scale=None):
+    return ResultMetadata(name, FIELD_NAME_TO_ID[type_name], None, None, precision, scale, True)
+
+
+DESCRIPTION = [
+    column("COMPANY_NAME", "TEXT"),
+    column("FISCAL_YEAR", "FIXED", 38, 0),
+    column("VALUE", "FIXED", 38, 2),
+    column("RATIO", "REAL"),
+    column("FILED", "DATE"),
+    column("LOADED_AT", "TIMESTAMP_LTZ", None, 9),
+    column("DATA", "VARIANT"),
+]
+
+
+class ArrowCursor:
+    """Yields Arrow chunks typed per chunk, as Snowflake does: narrow ints, then wider ints and decimals."""
+
+    description = DESCRIPTION
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    def fetch_arrow_batches(self):
+        return iter(self.batches)
+
+
+def chunk(fiscal_year_type, value_type, rows):
+    loaded_at = datetime.datetime(2024, 4, 2, 12, tzinfo=datetime.timezone.utc)
+    return pa.table({
+        "COMPANY_NAME": pa.array([f"CO {i}" for i in rows], pa.string()),
+        "FISCAL_YEAR": pa.array([2000 + i for i in rows], fiscal_year_type),
+        "VALUE": pa.array([decimal.Decimal(f"{i}.25") for i in rows], value_type) if pa.types.is_decimal(value_type)
+        else pa.array([i + 0.25 for i in rows], value_type),
+        "RATIO": pa.array([i / 4 for i in rows], pa.float64()),
+        "FILED": pa.array([datetime.date(2024, 1, 1 + i) for i in rows], pa.date32()),
+        "LOADED_AT": pa.array([loaded_at] * len(rows), pa.timestamp("ns", tz="America/Los_Angeles")),
+        "DATA": pa.array(['{"a": 1}'] * len(rows), pa.string()),
+    })
+
+
+MIXED_CHUNKS = [
+    chunk(pa.int16(), pa.decimal128(38, 2), [0, 1]),
+    chunk(pa.int64(), pa.float64(), [2]),
+    chunk(pa.decimal128(38, 0), pa.decimal128(10, 2), [3, 4]),
+]
+
+EXPECTED_SCHEMA = pa.schema([
+    ("COMPANY_NAME", pa.string()),
+    ("FISCAL_YEAR", pa.int64()),
+    ("VALUE", pa.decimal128(38, 2)),
+    ("RATIO", pa.float64()),
+    ("FILED", pa.date32()),
+    ("LOADED_AT", pa.timestamp("ns", tz="UTC")),
+    ("DATA", pa.string()),
+])
+
+
+def test_arrow_schema_follows_the_description():
+    assert fb.arrow_schema(ArrowCursor([])) == EXPECTED_SCHEMA
+    assert fb.empty_arrow_table(ArrowCursor([])).schema == EXPECTED_SCHEMA
+
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow"])
+def test_arrow_export_casts_every_chunk_to_one_schema(export_format):
+    content = b"".join(fb.iter_arrow_chunks(ArrowCursor(MIXED_CHUNKS), export_format))
+
+    if export_format == "parquet":
+        table = pq.read_table(io.BytesIO(content))
+    else:
+        table = pa.ipc.open_stream(content).read_all()
+    assert table.schema == EXPECTED_SCHEMA
+    assert table.column("FISCAL_YEAR").to_pylist() == [2000, 2001, 2002, 2003, 2004]
+    assert table.column("VALUE").to_pylist() == [decimal.Decimal(f"{i}.25") for i in range(5)]
+
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow"])
+def test_empty_arrow_export_keeps_column_types(export_format):
+    content = b"".join(fb.iter_arrow_chunks(ArrowCursor([]), export_format))
+
+    if export_format == "parquet":
+        table = pq.read_table(io.BytesIO(content))
+    else:
+        table = pa.ipc.open_stream(content).read_all()
+    assert table.num_rows == 0
+    assert table.schema == EXPECTED_SCHEMA
+
+
+def test_preview_file_uses_the_same_schema():
+    content = fb.encode_result_file(ArrowCursor(MIXED_CHUNKS), "parquet")
+
+    table = pq.read_table(io.BytesIO(content))
+    assert table.schema == EXPECTED_SCHEMA
+    assert table.num_rows == 5
+
+
+# S3 snapshots
+
+TABLE_VERSION = (datetime.datetime(2024, 4, 1, tzinfo=datetime.timezone.utc), 5)
+
+
+@pytest.fixture
+def snapshots(s3, monkeypatch):
+    async def table_version(table_name):
+        return TABLE_VERSION
+
+    monkeypatch.setattr(fb, "table_version", table_version)
+    fb.app.state.result_cache = fb.ResultCache()
+    yield s3
+    del fb.app.state.result_cache
+
+
+def write_snapshot(s3, table_name, export_format, part_count):
+    files = []
+    for part in range(part_count):
+        key = f"sec_exports/{table_name}/{export_format}/{table_name}_0_0_{part}.csv.gz"
+        s3.put_object(Bucket=fb.EXPORT_S3_BUCKET, Key=key, Body=b"part")
+        files.append({"key": key, "size": 4})
+    manifest = json.dumps({"files": files})
+    s3.put_object(Bucket=fb.EXPORT_S3_BUCKET, Key=f"sec_exports/{table_name}/{export_format}_manifest.json", Body=manifest)
+    return files
+
+
+def test_single_file_snapshot_is_redirected_to(snapshots):
+    (snapshot_file,) = write_snapshot(snapshots, "balance_sheet", "csv", 1)
+
+    url = asyncio.run(fb.current_snapshot_url("balance_sheet", "csv", TABLE_VERSION))
+
+    assert f"/{snapshot_file['key']}?" in url
+    assert "response-content-encoding=gzip" in url
+    assert "filename%3Dbalance_sheet.csv" in url
+
+
+def test_snapshot_split_over_several_files_is_presigned_from_the_manifest(snapshots):
+    files = write_snapshot(snapshots, "sec_numbers", "csv", 3)
+
+    assert asyncio.run(fb.current_snapshot_url("sec_numbers", "csv", TABLE_VERSION)) == "/snapshots/sec_numbers?format=csv"
+    snapshot = asyncio.run(fb.get_snapshot("sec_numbers", "csv"))
+
+    assert [f"/{f['key']}?" in entry["url"] for f, entry in zip(files, snapshot["files"])] == [True] * 3
+    assert [entry["size"] for entry in snapshot["files"]] == [4, 4, 4]
+
+
+def test_snapshot_older_than_the_table_is_not_used(snapshots):
+    write_snapshot(snapshots, "cash_flow", "parquet", 1)
+    newer_table = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1), 5)
+
+    assert asyncio.run(fb.current_snapshot_url("cash_flow", "parquet", newer_table)) is None
+
+
+def test_missing_snapshot_is_a_404(snapshots):
+    with pytest.raises(fb.HTTPException) as error:
+        asyncio.run(fb.get_snapshot("income_statement", "parquet"))
+
+    assert error.value.status_code == 404
+
+
+@pytest.mark.parametrize("part_count", [1, 3])
+def test_download_endpoint_never_streams_a_snapshotted_table(snapshots, monkeypatch, part_count):
+    async def start_query(*args, **kwargs):
+        raise AssertionError("a snapshotted table must not be streamed from Snowflake")
+
+    monkeypatch.setattr(fb, "start_query", start_query)
+    files = write_snapshot(snapshots, "sec_numbers", "parquet", part_count)
+
+    async def download():
+        transport = httpx.ASGITransport(app=fb.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://backend") as client:
+            response = await client.get("/normalized/download/sec_numbers", params={"format": "parquet"})
+            listing = await client.get(response.headers["location"]) if part_count > 1 else None
+            return response, listing
+
+    response, listing = asyncio.run(download())
+
+    assert response.status_code == 307
+    if part_count == 1:
+        assert f"/{files[0]['key']}?" in response.headers["location"]
+    else:
+        assert response.headers["location"] == "/snapshots/sec_numbers?format=parquet"
+        assert len(listing.json()["files"]) == 3
@@ -0,0 +1,161 @@
+"""
+Concurrency test for the backend: many simultaneous requests through a fake connector whose queries
+take QUERY_SECONDS, against a small pool. Checks that queries never exceed the pool, that requests
+beyond it wait for a connection or get a 503 once the checkout timeout passes, and that the event loop
+stays responsive throughout.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from backend import fastapi_backend as fb
+
+QUERY_SECONDS = 0.3
+POOL_SIZE = 2
+
+
+class Warehouse:
+    """Tracks the queries running on the fake connections; each one runs QUERY_SECONDS after submission."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.queries = 0
+        self.done_at = {}
+
+    def start(self, sfqid):
+        with self.lock:
+            self.running += 1
+            self.queries += 1
+            self.max_running = max(self.max_running, self.running)
+            self.done_at[sfqid] = time.monotonic() + QUERY_SECONDS
+
+    def finish(self):
+        with self.lock:
+            self.running -= 1
+
+
+class SlowCursor:
+    description = [("company_name",), ("fiscal_year",), ("fiscal_period",)]
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        self.sfqid = None
+
+    def execute_async(self, query, params=None):
+        self.sfqid = f"query-{id(self)}"
+        self.warehouse.start(self.sfqid)
+
+    def get_results_from_sfqid(self, sfqid):
+        pass
+
+    def fetchall(self):
+        return [("ALPHA CORP", 2024, "Q1")]
+
+    def abort_query(self, sfqid):
+        pass
+
+    def close(self):
+        self.warehouse.finish()
+
+
+class SlowConnection:
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+
+    def cursor(self):
+        return SlowCursor(self.warehouse)
+
+    def get_query_status_throw_if_error(self, sfqid):
+        return self.warehouse.done_at[sfqid]
+
+    def is_still_running(self, done_at):
+        return time.monotonic() < done_at
+
+    def is_closed(self):
+        return False
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def warehouse():
+    return Warehouse()
+
+
+def install_state(warehouse, checkout_timeout):
+    fb.app.state.snowflake_pool = fb.SnowflakeConnectionPool(
+        lambda: SlowConnection(warehouse), max_size=POOL_SIZE, checkout_timeout=checkout_timeout
+    )
+    fb.app.state.result_cache = fb.ResultCache()
+    fb.app.state.warehouse_executor = ThreadPoolExecutor(max_workers=POOL_SIZE * 2, thread_name_prefix="warehouse")
+
+
+@pytest.fixture
+def teardown_state():
+    yield
+    fb.app.state.warehouse_executor.shutdown(wait=True)
+    for name in ("snowflake_pool", "result_cache", "warehouse_executor"):
+        delattr(fb.app.state, name)
+
+
+async def drive(request_count):
+    """Sends request_count concurrent /query requests; returns their statuses and the worst event loop stall."""
+    stalls = []
+    stop = asyncio.Event()
+
+    async def watch_loop():
+        while not stop.is_set():
+            before = time.monotonic()
+            await asyncio.sleep(0.01)
+            stalls.append(time.monotonic() - before - 0.01)
+
+    transport = httpx.ASGITransport(app=fb.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://backend") as client:
+        watcher = asyncio.ensure_future(watch_loop())
+        responses = await asyncio.gather(*(
+            client.get("/query/balance_sheet", params={"company": f"COMPANY {i}"}) for i in range(request_count)
+        ))
+        # A cheap endpoint still answers at once while the pool is busy
+        started = time.monotonic()
+        assert (await client.get("/")).status_code == 200
+        root_seconds = time.monotonic() - started
+        stop.set()
+        await watcher
+    return [response.status_code for response in responses], max(stalls), root_seconds
+
+
+def test_requests_beyond_the_pool_wait_for_a_connection(warehouse, teardown_state):
+    install_state(warehouse, checkout_timeout=10)
+
+    statuses, worst_stall, _ = asyncio.run(drive(6))
+
+    assert statuses == [200] * 6
+    assert warehouse.queries == 6
+    assert warehouse.max_running == POOL_SIZE
+    assert fb.app.state.snowflake_pool.stats()["waits"] >= 1
+    assert worst_stall < 0.1
+
+
+def test_exhausted_pool_answers_503_without_blocking_the_event_loop(warehouse, teardown_state):
+    install_state(warehouse, checkout_timeout=0.05)
+
+    started = time.monotonic()
+    statuses, worst_stall, root_seconds = asyncio.run(drive(8))
+    elapsed = time.monotonic() - started
+
+    assert statuses.count(200) == POOL_SIZE
+    assert statuses.count(503) == 8 - POOL_SIZE
+    assert warehouse.max_running == POOL_SIZE
+    assert fb.app.state.snowflake_pool.stats()["timeouts"] == 8 - POOL_SIZE
+    # Checkouts time out off the event loop: it never stalls, and the batch takes about one query, not four
+    assert worst_stall < 0.1
+    assert root_seconds < 0.1
+    assert elapsed < QUERY_SECONDS * 3
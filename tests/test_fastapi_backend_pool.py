@@ -0,0 +1,161 @@
+"""Tests for the backend's Snowflake connection pool, with snowflake.connector.connect replaced by a fake."""
+
+import threading
+import time
+
+import pytest
+import snowflake.connector
+
+from backend import fastapi_backend as fb
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query):
+        if self.conn.unhealthy:
+            raise snowflake.connector.errors.OperationalError("session expired")
+        self.conn.queries.append(query)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.closed = False
+        self.unhealthy = False
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Every connection the pool opens through get_snowflake_connection, in order."""
+    opened = []
+
+    def connect(**kwargs):
+        conn = FakeConnection(**kwargs)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(snowflake.connector, "connect", connect)
+    return opened
+
+
+def make_pool(**kwargs):
+    options = {"max_size": 2, "max_age": 3600, "health_check_after": 3600, "checkout_timeout": 0.2}
+    options.update(kwargs)
+    return fb.SnowflakeConnectionPool(fb.get_snowflake_connection, **options)
+
+
+def test_idle_connection_is_reused(connections):
+    pool = make_pool()
+
+    first = pool.acquire()
+    pool.release(first)
+
+    assert pool.acquire() is first
+    assert len(connections) == 1
+    assert pool.stats()["reused"] == 1
+
+
+def test_checkout_times_out_when_pool_is_exhausted(connections):
+    pool = make_pool(checkout_timeout=0.1)
+    pool.acquire()
+    pool.acquire()
+
+    started = time.monotonic()
+    with pytest.raises(fb.PoolTimeout):
+        pool.acquire()
+
+    assert time.monotonic() - started >= 0.1
+    assert len(connections) == 2
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_waiting_checkout_gets_the_released_connection(connections):
+    pool = make_pool(max_size=1, checkout_timeout=5)
+    held = pool.acquire()
+    threading.Timer(0.05, pool.release, args=(held,)).start()
+
+    assert pool.acquire() is held
+    assert pool.stats()["waits"] >= 1
+
+
+def test_connection_past_max_age_is_recycled(connections):
+    pool = make_pool(max_age=0.05)
+    old = pool.acquire()
+    pool.release(old)
+    time.sleep(0.1)
+
+    fresh = pool.acquire()
+
+    assert fresh is not old
+    assert old.closed
+    assert len(connections) == 2
+    assert pool.stats()["recycled"] == 1
+    assert pool.stats()["size"] == 1
+
+
+def test_connection_failing_health_check_is_discarded(connections):
+    pool = make_pool(health_check_after=0)
+    stale = pool.acquire()
+    pool.release(stale)
+    stale.unhealthy = True
+    time.sleep(0.01)
+
+    fresh = pool.acquire()
+
+    assert fresh is not stale
+    assert stale.closed
+    assert pool.stats()["health_check_failures"] == 1
+    assert pool.stats()["size"] == 1
+
+    # A healthy idle connection passes the SELECT 1 check and is reused
+    pool.release(fresh)
+    time.sleep(0.01)
+    assert pool.acquire() is fresh
+    assert fresh.queries == ["SELECT 1"]
+
+
+@pytest.mark.parametrize("break_connection", ["flagged", "closed"])
+def test_broken_connection_is_not_returned_to_the_pool(connections, break_connection):
+    pool = make_pool(max_size=1)
+    conn = pool.acquire()
+
+    if break_connection == "flagged":
+        pool.release(conn, broken=True)
+    else:
+        conn.close()
+        pool.release(conn)
+
+    assert conn.closed
+    assert pool.stats()["idle"] == 0
+    # Its slot is freed, so a max_size=1 pool can still open a replacement
+    replacement = pool.acquire()
+    assert replacement is not conn
+    assert len(connections) == 2
+
+
+def test_failed_connect_frees_its_slot(connections, monkeypatch):
+    def connect(**kwargs):
+        raise snowflake.connector.errors.DatabaseError("login failed")
+
+    pool = make_pool(max_size=1)
+    monkeypatch.setattr(snowflake.connector, "connect", connect)
+
+    with pytest.raises(fb.HTTPException):
+        pool.acquire()
+
+    assert pool.stats()["size"] == 0
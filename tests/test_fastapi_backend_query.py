@@ -0,0 +1,102 @@
+"""Tests for the keyset pagination of /query/{table_name}: generated SQL, bound parameters and cursors."""
+
+import asyncio
+import base64
+import json
+
+import httpx
+import pytest
+
+from backend import fastapi_backend as fb
+
+
+def test_keyset_predicate_expands_the_row_comparison():
+    predicate = fb.keyset_predicate(["a", "b", "c"], {})
+
+    assert predicate == (
+        "((a > %(after_0)s)"
+        " OR (a = %(after_0)s AND b > %(after_1)s)"
+        " OR (a = %(after_0)s AND b = %(after_1)s AND c > %(after_2)s))"
+    )
+
+
+def test_first_page_query_has_no_keyset_predicate():
+    spec = fb.QUERY_TABLES["balance_sheet"]
+
+    query, params = fb.build_page_query(spec, ["company_name", "total_assets"], {}, None, 50)
+
+    assert query == (
+        "SELECT company_name AS company_name, total_assets AS total_assets,"
+        " company_name AS __key_0, fiscal_year AS __key_1, fiscal_period AS __key_2"
+        " FROM balance_sheet ORDER BY company_name, fiscal_year, fiscal_period LIMIT %(limit)s"
+    )
+    assert params == {"limit": 51}
+
+
+def test_resumed_sec_numbers_page_binds_filters_and_all_eleven_key_values():
+    spec = fb.QUERY_TABLES["sec_numbers"]
+    after = ["ALPHA CORP", 2024, "Q1", "0000000001-24-000001", "Assets", "us-gaap/2023", 20240331, 0, "USD", "", ""]
+    filters = {"company": "ALPHA*", "fiscal_year": (2020, None), "tag": "Assets"}
+
+    query, params = fb.build_page_query(spec, ["company_name", "value"], filters, after, 100)
+
+    assert len(spec["key"]) == 11
+    assert params == {
+        "limit": 101,
+        "company": "ALPHA",
+        "fiscal_year_from": 2020,
+        "tag": "Assets",
+        **{f"after_{i}": value for i, value in enumerate(after)},
+    }
+    where = query.split(" WHERE ")[1].split(" ORDER BY ")[0]
+    assert where.startswith("STARTSWITH(s.name, %(company)s) AND s.fy >= %(fiscal_year_from)s AND n.tag = %(tag)s AND ((")
+    # One OR term per key column; the last compares the tenth column's equality prefix then coreg
+    assert where.count(" OR ") == 10
+    assert where.endswith(
+        "COALESCE(n.segments, '') = %(after_9)s AND COALESCE(n.coreg, '') > %(after_10)s))"
+    )
+    assert query.endswith(f" ORDER BY {', '.join(spec['key'])} LIMIT %(limit)s")
+    assert [f"%(after_{i})s" in query for i in range(11)] == [True] * 11
+
+
+def test_cursor_round_trips_the_last_key():
+    key = ["ALPHA CORP", 2024, "Q1"]
+
+    assert fb.decode_page_cursor(fb.encode_page_cursor(key), 3) == key
+
+
+def encoded(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"{not json").decode("ascii"),
+    encoded({"company_name": "ALPHA CORP"}),
+    encoded(["ALPHA CORP", 2024]),
+    encoded(["ALPHA CORP", 2024, {"$gt": ""}]),
+    encoded(["ALPHA CORP", True, "Q1"]),
+    encoded(["A" * 5000, 2024, "Q1"]),
+])
+def test_tampered_or_oversized_cursor_is_a_400(cursor):
+    with pytest.raises(fb.HTTPException) as error:
+        fb.decode_page_cursor(cursor, 3)
+
+    assert error.value.status_code == 400
+
+
+def test_query_endpoint_rejects_a_bad_cursor_before_querying(monkeypatch):
+    async def start_query(*args, **kwargs):
+        raise AssertionError("no query should run")
+
+    monkeypatch.setattr(fb, "start_query", start_query)
+
+    async def request():
+        transport = httpx.ASGITransport(app=fb.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://backend") as client:
+            return await client.get("/query/balance_sheet", params={"cursor": encoded(["ALPHA CORP"])})
+
+    response = asyncio.run(request())
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor."
@@ -0,0 +1,187 @@
+"""
+Equivalence tests for the quarter transform: every engine and mode must write byte-for-byte the JSON
+the original process_sub_row path produced from the all-str TSV frames.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+import json_transformer_s3 as transformer
+
+QUARTER = "2024q1"
+QUARTER_PREFIX = f"{transformer.S3_EXTRACT_FOLDER}{QUARTER}/"
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "transformer")
+TSV_FILES = ["sub.txt", "num.txt", "pre.txt", "tag.txt"]
+
+
+def put_quarter(s3, quarter_name):
+    for file_name in TSV_FILES:
+        with open(os.path.join(FIXTURE_DIR, file_name), "rb") as f:
+            s3.put_object(Bucket=os.environ["S3_BUCKET_NAME"], Key=f"{transformer.S3_EXTRACT_FOLDER}{quarter_name}/{file_name}", Body=f.read())
+
+
+@pytest.fixture
+def quarter(s3):
+    put_quarter(s3, QUARTER)
+    return s3
+
+
+def baseline_records():
+    """Records of the original implementation: every column read as str, process_sub_row per submission."""
+    frames = [transformer.read_tsv_from_s3(f"{QUARTER_PREFIX}{file_name}") for file_name in TSV_FILES]
+    return list(transformer.iter_legacy_quarter_json(*frames))
+
+
+def read_output(s3, key):
+    return s3.get_object(Bucket=os.environ["S3_BUCKET_NAME"], Key=key)["Body"].read().decode("utf-8")
+
+
+def test_fixtures_cover_the_edge_cases(quarter):
+    records = baseline_records()
+    names = [record["name"] for record in records]
+
+    # An overflowing value (1e400) drops its whole submission; the others keep sub.txt order
+    assert "DELTA OVERFLOW" not in names
+    assert names == ["ALPHA CORP", "BETA INC", "GAMMA LLC", 'EPSILON "QUOTED", CO', "ZETA NO NUMBERS"]
+
+    beta = records[1]["data"]
+    # Non-numeric and empty values become 0
+    assert {entry["concept"]: entry["value"] for entry in beta["ic"]}["Revenues"] == 0
+    assert {entry["concept"]: entry["value"] for entry in beta["bs"]}["Assets"] == 0
+
+    alpha = records[0]["data"]
+    # A tag missing from tag.txt is labelled with the tag itself; the last label of a repeated tag wins
+    labels = {entry["concept"]: entry["label"] for entry in alpha["bs"]}
+    assert labels["CustomUnlabelledTag"] == "CustomUnlabelledTag"
+    assert labels["Assets"] == "Total Assets"
+
+
+@pytest.mark.parametrize("parse_engine", ["c", "pyarrow"])
+def test_vectorized_engine_matches_process_sub_row(quarter, monkeypatch, parse_engine):
+    expected = json.dumps(baseline_records(), indent=4)
+    monkeypatch.setattr(transformer, "TSV_PARSE_ENGINE", parse_engine)
+
+    key = transformer.process_quarter(QUARTER)
+
+    assert read_output(quarter, key) == expected
+
+
+@pytest.mark.parametrize("parse_engine", ["c", "pyarrow"])
+def test_value_is_read_as_text_only_when_float_parsing_fails(quarter, monkeypatch, parse_engine):
+    monkeypatch.setattr(transformer, "TSV_PARSE_ENGINE", parse_engine)
+    parses = []
+    parse_typed_tsv = transformer.parse_typed_tsv
+
+    def recording(body, schema, float_text):
+        parses.append(("num" if "value" in schema else "other", float_text))
+        return parse_typed_tsv(body, schema, float_text)
+
+    monkeypatch.setattr(transformer, "parse_typed_tsv", recording)
+
+    # The fixture's not-a-number token fails the float64 parse, so num.txt is read again as text
+    transformer.load_quarter_tables(QUARTER_PREFIX)
+    assert ("num", True) in parses
+
+    # Without the bad tokens every file parses typed on the first pass, with the same output
+    with open(os.path.join(FIXTURE_DIR, "num.txt")) as f:
+        clean = "".join(line for line in f if "not-a-number" not in line and "1e400" not in line)
+    quarter.put_object(Bucket=os.environ["S3_BUCKET_NAME"], Key=f"{QUARTER_PREFIX}num.txt", Body=clean.encode())
+    expected = json.dumps(baseline_records(), indent=4)
+    parses.clear()
+
+    key = transformer.process_quarter(QUARTER)
+
+    assert [float_text for _, float_text in parses] == [False] * 4
+    assert read_output(quarter, key) == expected
+
+
+def test_ndjson_output_has_one_baseline_record_per_line(quarter, monkeypatch):
+    expected = "".join(json.dumps(record) + "\n" for record in baseline_records())
+    monkeypatch.setattr(transformer, "JSON_OUTPUT_FORMAT", "ndjson")
+
+    key = transformer.process_quarter(QUARTER)
+
+    assert key.endswith(".ndjson")
+    assert read_output(quarter, key) == expected
+
+
+def test_chunked_mode_matches_process_sub_row(quarter, monkeypatch):
+    expected = json.dumps(baseline_records(), indent=4)
+    monkeypatch.setattr(transformer, "PROCESSING_MODE", "chunked")
+    # Several chunks per file and several partitions, so spilling and the ordered merge are exercised
+    monkeypatch.setattr(transformer, "TSV_CHUNK_ROWS", 4)
+    monkeypatch.setattr(transformer, "plan_partitions", lambda quarter_s3_path: 3)
+
+    key = transformer.process_quarter(QUARTER)
+
+    assert read_output(quarter, key) == expected
+
+
+def test_sharded_mode_matches_process_sub_row(quarter):
+    expected = json.dumps(baseline_records(), indent=4)
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        key = transformer.process_quarter_sharded(QUARTER, executor, 4)
+
+    assert read_output(quarter, key) == expected
+
+
+def test_next_quarter_is_staged_while_shards_run(quarter, monkeypatch):
+    expected = json.dumps(baseline_records(), indent=4)
+    put_quarter(quarter, "2024q2")
+    next_quarter_staging = threading.Event()
+    load_and_stage_quarter = transformer.load_and_stage_quarter
+    transform_staged_quarter = transformer.transform_staged_quarter
+
+    def staging(quarter_folder, shard_count):
+        if quarter_folder == "2024q2":
+            next_quarter_staging.set()
+        return load_and_stage_quarter(quarter_folder, shard_count)
+
+    def transforming(quarter_folder, *args):
+        # The first quarter only finishes once the second one has started staging
+        overlapped = quarter_folder != QUARTER or next_quarter_staging.wait(10)
+        return transform_staged_quarter(quarter_folder, *args), overlapped
+
+    monkeypatch.setattr(transformer, "load_and_stage_quarter", staging)
+    monkeypatch.setattr(transformer, "transform_staged_quarter", transforming)
+    done = {}
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        transformer.process_quarters_sharded([QUARTER, "2024q2"], executor, 4, lambda q, result: done.update({q: result}))
+
+    assert [overlapped for _, overlapped in done.values()] == [True, True]
+    assert [read_output(quarter, key) for key, _ in done.values()] == [expected, expected]
+    assert list(done) == [QUARTER, "2024q2"]
+
+
+def test_entries_are_built_per_submission_as_records_are_yielded(monkeypatch):
+    dfSub = pd.DataFrame({"adsh": ["B", "A"], "name": ["BETA", "ALPHA"], "countryba": ["US"] * 2,
+                                      "cityba": ["X"] * 2, "fy": ["2024"] * 2, "fp": ["FY"] * 2})
+    # Rows of the two submissions interleave in num.txt
+    dfNum = pd.DataFrame({"adsh": ["A", "B", "A", "B"], "tag": ["T1", "T1", "T2", "T2"],
+                                      "uom": ["USD"] * 4, "value": [1.0, 2.0, 3.0, 4.0]})
+    dfPre = pd.DataFrame({"adsh": ["A", "A", "B", "B"], "tag": ["T1", "T2", "T1", "T2"], "stmt": ["BS", "IC", "BS", "BS"]})
+    dfTag = pd.DataFrame({"tag": ["T1", "T2"], "tlabel": ["Tag 1", "Tag 2"]})
+    built = []
+    get = transformer.StatementEntries.get
+
+    def recording(self, adsh, default=None):
+        built.append(adsh)
+        return get(self, adsh, default)
+
+    monkeypatch.setattr(transformer.StatementEntries, "get", recording)
+    records = transformer.iter_quarter_json(dfSub, dfNum, dfPre, dfTag)
+
+    beta = next(records)
+    assert built == ["B"]
+    assert [entry["value"] for entry in beta["data"]["bs"]] == [2, 4]
+
+    alpha = next(records)
+    assert built == ["B", "A"]
+    assert alpha["data"]["bs"] == [{"concept": "T1", "label": "Tag 1", "value": 1, "unit": "USD"}]
+    assert alpha["data"]["ic"] == [{"concept": "T2", "label": "Tag 2", "value": 3, "unit": "USD"}]
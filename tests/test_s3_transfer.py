@@ -0,0 +1,76 @@
+"""Tests for the bulk upload_many/download_many transfers and their per-object retries, against moto."""
+
+import os
+
+import pytest
+
+import s3_transfer
+
+BUCKET = os.environ["S3_BUCKET_NAME"]
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(s3_transfer.time, "sleep", lambda seconds: None)
+
+
+def write_files(directory, count, size=1000):
+    paths = []
+    for i in range(count):
+        path = directory / f"file-{i}.txt"
+        path.write_bytes(bytes([i]) * (size + i))
+        paths.append(str(path))
+    return paths
+
+
+def test_upload_many_and_download_many_round_trip(s3, tmp_path):
+    paths = write_files(tmp_path, 5)
+    uploads = [(path, f"bulk/{os.path.basename(path)}") for path in paths]
+
+    uploaded = s3_transfer.upload_many(uploads, max_workers=3)
+
+    assert uploaded.objects == 5
+    assert uploaded.bytes == sum(1000 + i for i in range(5))
+    assert uploaded.failures == []
+    assert uploaded.seconds > 0
+    assert "5 objects" in uploaded.summary()
+    for path, key in uploads:
+        assert s3.get_object(Bucket=BUCKET, Key=key)["Body"].read() == open(path, "rb").read()
+
+    downloads = [(key, str(tmp_path / f"copy-{i}")) for i, (_, key) in enumerate(uploads)]
+    downloaded = s3_transfer.download_many(downloads, max_workers=3)
+
+    assert downloaded.objects == 5
+    assert downloaded.bytes == uploaded.bytes
+    for (path, _), (_, copy) in zip(uploads, downloads):
+        assert open(copy, "rb").read() == open(path, "rb").read()
+
+
+def test_failed_object_is_retried_on_its_own(s3, tmp_path, monkeypatch, no_backoff):
+    paths = write_files(tmp_path, 3)
+    attempts = []
+    upload_file = s3_transfer.upload_file
+
+    def flaky(local_path, s3_path):
+        attempts.append(s3_path)
+        if s3_path == "flaky/file-1.txt" and attempts.count(s3_path) < 3:
+            raise ConnectionError("connection reset")
+        return upload_file(local_path, s3_path)
+
+    monkeypatch.setattr(s3_transfer, "upload_file", flaky)
+    stats = s3_transfer.upload_many([(path, f"flaky/{os.path.basename(path)}") for path in paths], retries=3)
+
+    assert stats.objects == 3
+    assert stats.failures == []
+    assert sorted(attempts) == ["flaky/file-0.txt", "flaky/file-1.txt", "flaky/file-1.txt", "flaky/file-1.txt", "flaky/file-2.txt"]
+
+
+def test_object_failing_every_attempt_is_reported(s3, tmp_path, no_backoff):
+    s3.put_object(Bucket=BUCKET, Key="present/a.txt", Body=b"a")
+    items = [("present/a.txt", str(tmp_path / "a.txt")), ("missing/b.txt", str(tmp_path / "b.txt"))]
+
+    stats = s3_transfer.download_many(items, retries=2)
+
+    assert stats.objects == 1
+    assert [key for key, _ in stats.failures] == ["missing/b.txt"]
+    assert "1 failed" in stats.summary()
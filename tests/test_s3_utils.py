@@ -0,0 +1,153 @@
+"""Tests for the paginated, cached S3 listing and the streaming S3 reader/writer, against moto."""
+
+import io
+import os
+import zipfile
+
+import pytest
+
+import s3_utils
+from s3_utils import S3MultipartWriter, S3RangeReader
+
+BUCKET = os.environ["S3_BUCKET_NAME"]
+
+
+def put(s3, key, body=b"x"):
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+
+def count_list_calls(monkeypatch):
+    calls = []
+    list_pages = s3_utils._list_pages
+
+    def counting(prefix):
+        calls.append(prefix)
+        return list_pages(prefix)
+
+    monkeypatch.setattr(s3_utils, "_list_pages", counting)
+    return calls
+
+
+def test_listing_follows_continuation_tokens(s3):
+    keys = sorted(f"many/{i:05d}.txt" for i in range(1005))
+    for key in keys:
+        put(s3, key)
+
+    assert list(s3_utils.iter_s3_objects("many/")) == keys
+    assert len(s3_utils.list_files_in_s3("many/")) == 1005
+
+
+def test_listing_with_metadata(s3):
+    put(s3, "meta/a.txt", b"hello")
+
+    (obj,) = s3_utils.iter_s3_objects("meta/", with_metadata=True)
+    assert obj["key"] == "meta/a.txt"
+    assert obj["size"] == 5
+    assert obj["etag"] == s3.head_object(Bucket=BUCKET, Key="meta/a.txt")["ETag"].strip('"')
+    assert s3_utils.list_objects_with_metadata("meta/") == {"meta/a.txt": {"etag": obj["etag"], "size": 5}}
+
+
+def test_cached_parent_listing_answers_sub_prefixes(s3, monkeypatch):
+    put(s3, "root/2024q1/sub.txt")
+    put(s3, "root/2024q2/sub.txt")
+    calls = count_list_calls(monkeypatch)
+
+    s3_utils.list_prefixes(["root/"])
+    assert s3_utils.list_files_in_s3("root/2024q2/") == ["root/2024q2/sub.txt"]
+    assert s3_utils.list_folders_in_s3("root/") == ["root/2024q1/", "root/2024q2/"]
+    assert calls == ["root/"]
+
+
+def test_listing_cache_expires_and_is_invalidated_by_writes(s3, monkeypatch):
+    put(s3, "cache/a.txt")
+    assert s3_utils.list_files_in_s3("cache/") == ["cache/a.txt"]
+
+    # A write through boto3 directly is not seen until the TTL passes or the cache is invalidated
+    put(s3, "cache/b.txt")
+    assert s3_utils.list_files_in_s3("cache/") == ["cache/a.txt"]
+    monkeypatch.setattr(s3_utils, "S3_LIST_CACHE_TTL", 0)
+    assert s3_utils.list_files_in_s3("cache/") == ["cache/a.txt", "cache/b.txt"]
+    monkeypatch.undo()
+
+    # Writes through S3MultipartWriter invalidate the listings that contain them
+    with S3MultipartWriter("cache/c.txt") as writer:
+        writer.write("c")
+    assert s3_utils.list_files_in_s3("cache/") == ["cache/a.txt", "cache/b.txt", "cache/c.txt"]
+
+
+def test_list_prefixes_lists_each_prefix(s3):
+    put(s3, "p1/a")
+    put(s3, "p2/b")
+    put(s3, "p2/c")
+
+    assert s3_utils.list_prefixes(["p1/", "p2/", "p3/"]) == {"p1/": ["p1/a"], "p2/": ["p2/b", "p2/c"], "p3/": []}
+
+
+def test_folders_without_cache_use_delimiter_listing(s3):
+    put(s3, "tsv/2023q4/num.txt")
+    put(s3, "tsv/2024q1/num.txt")
+    put(s3, "tsv/readme.txt")
+
+    assert s3_utils.list_folders_in_s3("tsv/") == ["tsv/2023q4/", "tsv/2024q1/"]
+
+
+def test_multipart_writer_small_object_uses_single_put(s3):
+    with S3MultipartWriter("out/small.json", content_type="application/json", metadata={"source": "test"}) as writer:
+        writer.write("{}")
+
+    head = s3.head_object(Bucket=BUCKET, Key="out/small.json")
+    assert head["ContentType"] == "application/json"
+    assert head["Metadata"] == {"source": "test"}
+    assert "-" not in head["ETag"]
+
+
+def test_multipart_writer_uploads_parts_in_order(s3):
+    part = s3_utils.S3_MIN_PART_SIZE
+    payload = b"".join(bytes([i]) * (part // 2 + 7) for i in range(5))
+
+    with S3MultipartWriter("out/large.bin", chunk_size=part, concurrency=2) as writer:
+        for offset in range(0, len(payload), 1000003):
+            writer.write(payload[offset:offset + 1000003])
+
+    assert writer.bytes_written == len(payload)
+    assert s3.get_object(Bucket=BUCKET, Key="out/large.bin")["Body"].read() == payload
+    assert s3.head_object(Bucket=BUCKET, Key="out/large.bin")["ETag"].strip('"').endswith("-3")
+
+
+def test_multipart_writer_aborts_on_error(s3):
+    with pytest.raises(RuntimeError):
+        with S3MultipartWriter("out/failed.bin", chunk_size=s3_utils.S3_MIN_PART_SIZE) as writer:
+            writer.write(b"x" * (s3_utils.S3_MIN_PART_SIZE + 1))
+            raise RuntimeError("producer failed")
+
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET, Prefix="out/failed.bin")
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+
+
+def test_range_reader_reads_and_seeks(s3):
+    payload = bytes(range(256)) * 100
+    put(s3, "blob.bin", payload)
+    reader = S3RangeReader("blob.bin", block_size=1000)
+
+    assert reader.size == len(payload)
+    assert reader.read(10) == payload[:10]
+    reader.seek(-5, io.SEEK_END)
+    assert reader.read() == payload[-5:]
+    assert reader.read(1) == b""
+    reader.seek(12345)
+    assert reader.read(3000) == payload[12345:15345]
+    reader.seek(-100, io.SEEK_CUR)
+    assert reader.tell() == 15245
+    assert reader.read(50) == payload[15245:15295]
+
+
+def test_range_reader_serves_zipfile_members(s3):
+    members = {"sub.txt": b"adsh\tname\n" * 5000, "num.txt": os.urandom(300000)}
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+    put(s3, "sec_raw_zips/2024q1.zip", archive.getvalue())
+
+    with zipfile.ZipFile(S3RangeReader("sec_raw_zips/2024q1.zip", block_size=64 * 1024)) as z:
+        assert {name: z.read(name) for name in z.namelist()} == members